@@ -1,11 +1,11 @@
+import logging
 import threading
 import time
+import numpy
 import pyaudio
 
-from Queue import Queue
-from math import ceil
-
-from pydub import AudioSegment
+from audio_normalizer.gain_stage import GainStage, SmoothedGainStage
+from audio_normalizer.ring_buffer import PcmRingBuffer
 
 
 def lookup_device_index(audio_manager, device_name):
@@ -22,17 +22,20 @@ def lookup_device_index(audio_manager, device_name):
     raise KeyError("No audio device with the name " + device_name)
 
 
-def match_target_amplitude(sound, target_dbfs):
-    if sound.dBFS == float("+inf") or sound.dBFS == float("-inf"):
-        return sound
-
-    change_in_dbfs = target_dbfs - sound.dBFS
-
-    print("applying gain of " + str(change_in_dbfs) + " to sound segment")
-    return sound.apply_gain(change_in_dbfs)
+logger = logging.getLogger("audio_normalizer")
 
 
 SAMPLE_RATE = 44100
+CHANNELS = 2
+SAMPLE_WIDTH = 2
+FRAME_BYTES = CHANNELS * SAMPLE_WIDTH
+# Playback writes 10ms at a time.
+PLAYBACK_CHUNK_BYTES = SAMPLE_RATE // 100 * FRAME_BYTES
+# Room for two captured segments, so capture can run ahead a little before the oldest audio gets dropped.
+LATENCY_SECONDS = 1.0
+CALLBACK_FRAMES = 1024
+# In callback mode the capture and playback callbacks take turns, so only a few buffers ever need to wait.
+CALLBACK_LATENCY_SECONDS = 3 * CALLBACK_FRAMES / float(SAMPLE_RATE)
 
 
 class AudioInputNormalizer(object):
@@ -57,41 +60,52 @@ class AudioInputNormalizer(object):
             self.device_index = None
 
         self.input_stream = self.audio_manger.open(format=pyaudio.paInt16,
-                                                   channels=2,
+                                                   channels=CHANNELS,
                                                    rate=self.rate,
                                                    input=True,
                                                    frames_per_buffer=1024,
                                                    input_device_index=self.device_index)
         self.record_rate_seconds = 0.5
+        self.chunks_per_segment = int(self.rate / self.chunk_size * self.record_rate_seconds)
+        self.chunk_bytes = self.chunk_size * FRAME_BYTES
+        # Every segment is captured into and normalised in this one buffer.
+        self.segment_buffer = bytearray(self.chunks_per_segment * self.chunk_bytes)
+        self.gain_stage = GainStage(target_dbfs)
         self.monitor_thread = threading.Thread(target=self.run)
-        self.segment_queue = None
-        """ :type: Queue"""
+        self.ring_buffer = None
+        """ :type: PcmRingBuffer"""
 
-    def start_monitoring(self, segment_queue):
+    def start_monitoring(self, ring_buffer):
         """
 
-        :param segment_queue:
-        :type segment_queue: Queue
+        :param ring_buffer:
+        :type ring_buffer: PcmRingBuffer
         :return:
         """
-        self.segment_queue = segment_queue
+        self.ring_buffer = ring_buffer
         self.running = True
         self.monitor_thread = threading.Thread(target=self.run)
         self.monitor_thread.start()
 
     def get_next_segment(self):
-        frames = []
+        """
+        Capture the next record_rate_seconds of audio and normalise it to target_dbfs.
 
-        for i in range(0, int(self.rate / self.chunk_size * self.record_rate_seconds)):
-            data = self.input_stream.read(self.chunk_size)
-            frames.append(data)
+        :return: The normalised PCM, overwritten by the next call.
+        :rtype: bytearray
+        """
+        view = memoryview(self.segment_buffer)
+
+        for i in range(0, self.chunks_per_segment):
+            offset = i * self.chunk_bytes
+            view[offset:offset + self.chunk_bytes] = self.input_stream.read(self.chunk_size)
 
-        return match_target_amplitude(AudioSegment(b''.join(frames), sample_width=2, channels=2, frame_rate=self.rate),
-                                      self.target_dbfs)
+        self.gain_stage.process(self.segment_buffer)
+        return self.segment_buffer
 
     def run(self):
         while self.running:
-            self.segment_queue.put(self.get_next_segment())
+            self.ring_buffer.write(self.get_next_segment())
 
         self.input_stream.stop_stream()
         self.input_stream.close()
@@ -99,6 +113,22 @@ class AudioInputNormalizer(object):
     def stop(self):
         self.running = False
 
+        # Wake the monitor thread if it's waiting for room in the buffer.
+        if self.ring_buffer:
+            self.ring_buffer.close()
+
+    def join(self, timeout=None):
+        """
+        Wait for the monitor thread to finish after stop().
+
+        :return: False if it's still running after the timeout.
+        :rtype: bool
+        """
+        if self.monitor_thread.is_alive():
+            self.monitor_thread.join(timeout)
+
+        return not self.monitor_thread.is_alive()
+
 
 class AudioPlaybackStreamer(object):
     def __init__(self, audio_manager, device_name=None):
@@ -117,40 +147,33 @@ class AudioPlaybackStreamer(object):
             self.device_index = None
 
         self.output_stream = self.audio_manager.open(format=pyaudio.paInt16,
-                                                     channels=2,
+                                                     channels=CHANNELS,
                                                      rate=SAMPLE_RATE,
                                                      output=True,
                                                      frames_per_buffer=1024,
                                                      output_device_index=self.device_index)
         self.playback_thread = threading.Thread(target=self.run)
         self.running = False
-        self.segment_queue = None
-        """ :type: Queue"""
+        self.chunk = bytearray(PLAYBACK_CHUNK_BYTES)
+        self.ring_buffer = None
+        """ :type: PcmRingBuffer"""
 
-    def start_playback(self, segment_queue):
-        self.segment_queue = segment_queue
+    def start_playback(self, ring_buffer):
+        """
+
+        :param ring_buffer:
+        :type ring_buffer: PcmRingBuffer
+        """
+        self.ring_buffer = ring_buffer
         self.running = True
         self.playback_thread = threading.Thread(target=self.run)
         self.playback_thread.start()
 
-    @staticmethod
-    def _make_chunks(audio_segment, chunk_length):
-        """
-        Breaks an AudioSegment into chunks that are <chunk_length> milliseconds
-        long.
-        if chunk_length is 50 then you'll get a list of 50 millisecond long audio
-        segments back (except the last one, which can be shorter)
-        """
-        number_of_chunks = ceil(len(audio_segment) / float(chunk_length))
-        return [audio_segment[index * chunk_length:(index + 1) * chunk_length]
-                for index in range(int(number_of_chunks))]
-
     def run(self):
         while self.running:
-                segment = self.segment_queue.get()
-                # break audio into half-second chunks (to allows keyboard interrupts)
-                for chunk in self._make_chunks(segment, 10):
-                    self.output_stream.write(chunk._data)
+            # Plays silence when capture falls behind, the write keeps the loop at the device's pace either way.
+            self.ring_buffer.read_into(self.chunk)
+            self.output_stream.write(bytes(self.chunk))
 
         self.output_stream.stop_stream()
         self.output_stream.close()
@@ -158,15 +181,182 @@ class AudioPlaybackStreamer(object):
     def stop(self):
         self.running = False
 
+    def join(self, timeout=None):
+        """
+        Wait for the playback thread to finish after stop().
+
+        :return: False if it's still running after the timeout.
+        :rtype: bool
+        """
+        if self.playback_thread.is_alive():
+            self.playback_thread.join(timeout)
+
+        return not self.playback_thread.is_alive()
+
+
+class CallbackAudioStreamer(object):
+    """
+    Low latency capture, normalisation and playback driven by PyAudio's stream callbacks.
+
+    Instead of a thread reading half a second at a time, every hardware buffer is normalised as soon as it's captured
+    and handed through a ring buffer a few buffers long to the playback callback.  The level used for normalising
+    carries over between callbacks (see SmoothedGainStage).  The callbacks allocate nothing of their own beyond the
+    bytes handed back to PyAudio.
+
+    start() measures the end to end latency over the first second and logs it: how long captured audio had been in
+    the capture device and the ring buffer, plus how long until the playback device plays it, taken from the
+    callbacks' timestamps where the host API gives them and the stream's reported latency where it doesn't.
+    """
+    def __init__(self, audio_manager, input_device_name=None, output_device_name=None, target_dbfs=-40.0,
+                 frames_per_buffer=CALLBACK_FRAMES, latency_seconds=CALLBACK_LATENCY_SECONDS):
+        """
+
+        :param audio_manager:
+        :type audio_manager: pyaudio.PyAudio
+        :type input_device_name: Union[str, None]
+        :type output_device_name: Union[str, None]
+        :param frames_per_buffer: Frames per callback.
+        :type frames_per_buffer: int
+        :param latency_seconds: Most audio that can wait between capture and playback.
+        :type latency_seconds: float
+        """
+        self.audio_manager = audio_manager
+        self.frames_per_buffer = frames_per_buffer
+        self.input_device_index = None
+        self.output_device_index = None
+
+        if input_device_name:
+            self.input_device_index = lookup_device_index(audio_manager, input_device_name)
+
+        if output_device_name:
+            self.output_device_index = lookup_device_index(audio_manager, output_device_name)
+
+        self.ring_buffer = PcmRingBuffer(latency_seconds, SAMPLE_RATE, FRAME_BYTES)
+        self.gain_stage = SmoothedGainStage(target_dbfs, SAMPLE_RATE, CHANNELS)
+        self.input_buffer = bytearray(frames_per_buffer * FRAME_BYTES)
+        # numpy on python 2 can't be relied on to take a slice of a memoryview, so the gain stage gets slices of a
+        # view of the buffer made here once.
+        self.input_samples = numpy.frombuffer(self.input_buffer, dtype=numpy.int16)
+        self.output_buffer = bytearray(frames_per_buffer * FRAME_BYTES)
+        self.input_stream = None
+        self.output_stream = None
+        self.capture_latency = 0.0
+        self.overflows = 0
+        self.underflows = 0
+        self.latency_samples = []
+        self.latency_measured = threading.Event()
+        self.latency_sample_count = 0
+
+    def start(self, measure_seconds=1.0):
+        """
+        Start streaming, and measure and log the latency.
+
+        :param measure_seconds: How long to measure the latency for, 0 not to.
+        :type measure_seconds: float
+        :return: The mean end to end latency in seconds, None if it wasn't measured.
+        :rtype: Union[float, None]
+        """
+        self.ring_buffer.clear()
+        self.latency_samples = []
+        self.latency_sample_count = int(measure_seconds * SAMPLE_RATE / self.frames_per_buffer)
+        self.latency_measured.clear()
+
+        self.output_stream = self.audio_manager.open(format=pyaudio.paInt16,
+                                                     channels=CHANNELS,
+                                                     rate=SAMPLE_RATE,
+                                                     output=True,
+                                                     frames_per_buffer=self.frames_per_buffer,
+                                                     output_device_index=self.output_device_index,
+                                                     stream_callback=self._playback_callback)
+        self.input_stream = self.audio_manager.open(format=pyaudio.paInt16,
+                                                    channels=CHANNELS,
+                                                    rate=SAMPLE_RATE,
+                                                    input=True,
+                                                    frames_per_buffer=self.frames_per_buffer,
+                                                    input_device_index=self.input_device_index,
+                                                    stream_callback=self._capture_callback)
+
+        if not self.latency_sample_count:
+            return None
+
+        if not self.latency_measured.wait(measure_seconds + 2):
+            logger.warning("No audio was played within {0} seconds to measure the latency".format(measure_seconds + 2))
+            return None
+
+        latency = sum(self.latency_samples) / len(self.latency_samples)
+        logger.info("End to end audio latency {0:.0f}ms (max {1:.0f}ms, {2}ms per buffer, stream latency {3:.0f}ms "
+                    "in {4:.0f}ms out)".format(latency * 1000, max(self.latency_samples) * 1000,
+                                               self.frames_per_buffer * 1000 // SAMPLE_RATE,
+                                               self.input_stream.get_input_latency() * 1000,
+                                               self.output_stream.get_output_latency() * 1000))
+        return latency
+
+    def stop(self):
+        for stream in (self.input_stream, self.output_stream):
+            if stream is not None:
+                stream.stop_stream()
+                stream.close()
+
+        self.input_stream = None
+        self.output_stream = None
+
+    def join(self, timeout=None):
+        """
+        The callbacks have finished once stop() returns, so there's nothing to wait for.
+
+        :rtype: bool
+        """
+        return self.input_stream is None and self.output_stream is None
+
+    def _capture_callback(self, in_data, frame_count, time_info, status):
+        if status & pyaudio.paInputOverflow:
+            self.overflows += 1
+
+        length = frame_count * FRAME_BYTES
+        block = memoryview(self.input_buffer)[:length]
+        block[:] = in_data
+        self.gain_stage.process(self.input_samples[:frame_count * CHANNELS])
+        self.ring_buffer.write(block)
+
+        adc_time = time_info.get("input_buffer_adc_time")
+        self.capture_latency = time_info["current_time"] - adc_time if adc_time else self._input_latency()
+
+        return None, pyaudio.paContinue
+
+    def _playback_callback(self, in_data, frame_count, time_info, status):
+        if status & pyaudio.paOutputUnderflow:
+            self.underflows += 1
+
+        length = frame_count * FRAME_BYTES
+        block = memoryview(self.output_buffer)[:length]
+        queued = self.ring_buffer.latency
+        played = self.ring_buffer.read_into(block)
+
+        if played and len(self.latency_samples) < self.latency_sample_count:
+            dac_time = time_info.get("output_buffer_dac_time")
+            playback_latency = dac_time - time_info["current_time"] if dac_time else self._output_latency()
+            self.latency_samples.append(self.capture_latency + queued + playback_latency)
+
+            if len(self.latency_samples) == self.latency_sample_count:
+                self.latency_measured.set()
+
+        return block.tobytes(), pyaudio.paContinue
+
+    def _input_latency(self):
+        return self.input_stream.get_input_latency() if self.input_stream else 0.0
+
+    def _output_latency(self):
+        return self.output_stream.get_output_latency() if self.output_stream else 0.0
+
 
 def start():
     aud_manager = pyaudio.PyAudio()
     normalizer = AudioInputNormalizer(aud_manager, device_name="VirtualCable")
     streamer = AudioPlaybackStreamer(aud_manager, device_name="TV")
-    seg_queue = Queue()
+    ring_buffer = PcmRingBuffer(LATENCY_SECONDS, SAMPLE_RATE, FRAME_BYTES)
 
-    normalizer.start_monitoring(seg_queue)
-    streamer.start_playback(seg_queue)
+    normalizer.start_monitoring(ring_buffer)
+    streamer.start_playback(ring_buffer)
 
     while True:
         command = input("Streaming normalized sound output, enter quit to stop: ")
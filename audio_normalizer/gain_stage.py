@@ -0,0 +1,192 @@
+import math
+
+import numpy
+
+
+# pydub measures levels against the largest possible 16 bit amplitude.
+FULL_SCALE = 32768.0
+SAMPLE_MIN = -32768
+SAMPLE_MAX = 32767
+
+
+def rms(samples):
+    """
+    Root mean square of the samples, truncated to an int like audioop.rms() so levels match pydub.
+
+    :type samples: numpy.ndarray
+    :rtype: int
+    """
+    if not len(samples):
+        return 0
+
+    return int(math.sqrt(numpy.dot(samples, samples) / float(len(samples))))
+
+
+def dbfs(level):
+    """
+    :param level: An RMS level.
+    :type level: int
+    :return: The level in dB relative to full scale, -inf for silence.
+    :rtype: float
+    """
+    if not level:
+        return float("-inf")
+
+    return 20 * math.log10(level / FULL_SCALE)
+
+
+class GainStage(object):
+    """
+    Normalises blocks of 16 bit PCM to a target level in place.
+
+    The block is read through an int16 view and scaled in a float64 work buffer that's kept between blocks, so
+    normalising allocates nothing but the view itself.  The result is the same as
+    AudioSegment.apply_gain(target_dbfs - segment.dBFS): samples are floored and saturate at the int16 limits
+    rather than wrapping, and silent blocks are left alone.
+    """
+    def __init__(self, target_dbfs):
+        """
+
+        :param target_dbfs: Level to normalise every block to.
+        :type target_dbfs: float
+        """
+        self.target_dbfs = target_dbfs
+        self.work = numpy.empty(0, dtype=numpy.float64)
+        self.last_gain = 0.0
+
+    def process(self, buffer):
+        """
+        Normalise a block of samples in place.
+
+        :param buffer: Native endian int16 samples, e.g. a bytearray.  It has to be writable.
+        :type buffer: Union[bytearray, numpy.ndarray]
+        :return: The gain applied in dB.
+        :rtype: float
+        """
+        samples = numpy.frombuffer(buffer, dtype=numpy.int16)
+        work = self._work(len(samples))
+        numpy.copyto(work, samples)
+
+        level = dbfs(rms(work))
+
+        if math.isinf(level):
+            self.last_gain = 0.0
+            return self.last_gain
+
+        self.last_gain = self.target_dbfs - level
+
+        numpy.multiply(work, 10 ** (self.last_gain / 20), out=work)
+        self._store(work, samples)
+
+        return self.last_gain
+
+    def _work(self, length):
+        if len(self.work) < length:
+            self.work = numpy.empty(length, dtype=numpy.float64)
+
+        return self.work[:length]
+
+    @staticmethod
+    def _store(work, samples):
+        numpy.clip(work, SAMPLE_MIN, SAMPLE_MAX, out=work)
+        numpy.floor(work, out=work)
+        numpy.copyto(samples, work, casting="unsafe")
+
+
+class SmoothedGainStage(GainStage):
+    """
+    Normalises a continuous stream of short blocks, e.g. one hardware buffer per audio callback.
+
+    A block of a few milliseconds is too short to be normalised on its own without the volume pumping, so the level
+    is a running mean square that carries over between blocks.  It rises at once to a louder block, so an onset is
+    never amplified by the gain that suited the quiet before it, and falls back with the given time constant.  Blocks
+    quieter than silence_dbfs leave both the level and the gain where they were, rather than the gain creeping up
+    to amplify the next sound into a full scale burst, and the gain never goes above max_gain.  A rising gain is
+    ramped across the block from the previous block's gain so it never steps mid-stream, a falling one is applied to
+    the whole block straight away.
+    """
+    def __init__(self, target_dbfs, rate, channels, time_constant=0.5, silence_dbfs=-70.0, max_gain=20.0):
+        """
+
+        :param target_dbfs: Level to normalise the stream to.
+        :type target_dbfs: float
+        :param rate: Frames per second.
+        :type rate: int
+        :param channels: Samples per frame.
+        :type channels: int
+        :param time_constant: Seconds for the level to follow the sound getting quieter.
+        :type time_constant: float
+        :param silence_dbfs: Blocks below this level are treated as silence.
+        :type silence_dbfs: float
+        :param max_gain: Most gain ever applied in dB.
+        :type max_gain: float
+        """
+        super(SmoothedGainStage, self).__init__(target_dbfs)
+        self.rate = rate
+        self.channels = channels
+        self.time_constant = time_constant
+        self.silence_dbfs = silence_dbfs
+        self.max_gain = max_gain
+        self.mean_square = 0.0
+        self.ramp = numpy.empty(0, dtype=numpy.float64)
+        self.gains = numpy.empty(0, dtype=numpy.float64)
+
+    def process(self, buffer):
+        """
+        Normalise the next block of the stream in place.
+
+        :param buffer: Native endian int16 samples, whole frames.  It has to be writable.
+        :type buffer: Union[bytearray, numpy.ndarray]
+        :return: The gain applied at the end of the block in dB.
+        :rtype: float
+        """
+        samples = numpy.frombuffer(buffer, dtype=numpy.int16)
+        work = self._work(len(samples))
+        numpy.copyto(work, samples)
+
+        if not len(samples):
+            return self.last_gain
+
+        mean_square = numpy.dot(work, work) / len(work)
+
+        if dbfs(int(math.sqrt(mean_square))) < self.silence_dbfs:
+            numpy.multiply(work, 10 ** (self.last_gain / 20), out=work)
+            self._store(work, samples)
+            return self.last_gain
+
+        if mean_square >= self.mean_square:
+            self.mean_square = mean_square
+        else:
+            decay = math.exp(-len(samples) / float(self.rate * self.channels * self.time_constant))
+            self.mean_square = decay * self.mean_square + (1 - decay) * mean_square
+
+        gain = min(self.max_gain, self.target_dbfs - dbfs(int(math.sqrt(self.mean_square))))
+        start, end = 10 ** (self.last_gain / 20), 10 ** (gain / 20)
+        self.last_gain = gain
+
+        if end <= start:
+            numpy.multiply(work, end, out=work)
+        else:
+            gains = self._gains(len(work))
+            numpy.multiply(self._ramp(len(work)), end - start, out=gains)
+            numpy.add(gains, start, out=gains)
+            numpy.multiply(work, gains, out=work)
+
+        self._store(work, samples)
+        return gain
+
+    def _ramp(self, length):
+        """
+        :return: Each sample's frame's position through the block, from just above 0 to 1.
+        """
+        if len(self.ramp) != length:
+            frames = length // self.channels
+            self.ramp = numpy.repeat(numpy.arange(1, frames + 1, dtype=numpy.float64) / frames, self.channels)
+
+        return self.ramp
+
+    def _gains(self, length):
+        if len(self.gains) != length:
+            self.gains = numpy.empty(length, dtype=numpy.float64)
+
+        return self.gains
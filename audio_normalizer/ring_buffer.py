@@ -0,0 +1,167 @@
+import threading
+
+
+DROP_OLDEST = "drop_oldest"
+BLOCK = "block"
+OVERFLOW_POLICIES = (DROP_OLDEST, BLOCK)
+
+
+class PcmRingBuffer(object):
+    """
+    A fixed size FIFO of PCM bytes between a capture thread and a playback thread.
+
+    The storage is allocated once and sized from a latency target, so the audio waiting to be played can never be
+    more than that far behind.  When a write doesn't fit, the overflow policy decides between dropping the oldest
+    audio to make room (keeping latency bounded, for when capture runs ahead) and blocking the writer until there's
+    space.  Reads never wait: whatever is missing is filled with silence, so the playback device keeps its pace and
+    the reader can always notice it's been stopped.
+
+    Everything is counted in whole frames, writes have to be a multiple of frame_bytes.
+    """
+    def __init__(self, latency_seconds, rate, frame_bytes, overflow=DROP_OLDEST):
+        """
+
+        :param latency_seconds: Most audio that can be waiting to be played.
+        :type latency_seconds: float
+        :param rate: Frames per second.
+        :type rate: int
+        :param frame_bytes: Size of a frame, the sample width times the number of channels.
+        :type frame_bytes: int
+        :param overflow: DROP_OLDEST or BLOCK.
+        :type overflow: str
+        """
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError("Unknown overflow policy " + str(overflow))
+
+        self.rate = rate
+        self.frame_bytes = frame_bytes
+        self.overflow = overflow
+        self.capacity = max(1, int(latency_seconds * rate)) * frame_bytes
+        self.buffer = bytearray(self.capacity)
+        self.view = memoryview(self.buffer)
+        self.read_pos = 0
+        self.fill = 0
+        self.closed = False
+        self.dropped_bytes = 0
+        self.underruns = 0
+        self.silence = bytearray(0)
+        self.condition = threading.Condition()
+
+    @property
+    def latency(self):
+        """
+        :return: Seconds of audio waiting to be played.
+        :rtype: float
+        """
+        return self.fill / float(self.frame_bytes * self.rate)
+
+    def write(self, data):
+        """
+        Queue PCM to be played, dropping the oldest audio or waiting for space when full.
+
+        :param data: Whole frames of PCM.
+        :type data: Union[bytes, bytearray, memoryview]
+        :return: Number of bytes written, short if the buffer was closed while waiting for space.
+        :rtype: int
+        """
+        data = memoryview(data)
+
+        if len(data) % self.frame_bytes:
+            raise ValueError("Writes have to be whole frames of {0} bytes".format(self.frame_bytes))
+
+        with self.condition:
+            if self.overflow == DROP_OLDEST:
+                return self._write_dropping(data)
+
+            written = 0
+
+            while written < len(data):
+                while self.fill == self.capacity and not self.closed:
+                    self.condition.wait()
+
+                if self.closed:
+                    break
+
+                written += self._copy_in(data[written:written + self.capacity - self.fill])
+
+            return written
+
+    def read_into(self, out):
+        """
+        Take the oldest audio, padding with silence if there isn't enough.
+
+        :param out: Buffer to fill completely, a multiple of frame_bytes long.
+        :type out: Union[bytearray, memoryview]
+        :return: Number of bytes that were real audio rather than silence.
+        :rtype: int
+        """
+        out = memoryview(out)
+
+        with self.condition:
+            count = min(len(out), self.fill)
+            first = min(count, self.capacity - self.read_pos)
+
+            out[:first] = self.view[self.read_pos:self.read_pos + first]
+            out[first:count] = self.view[:count - first]
+
+            self.read_pos = (self.read_pos + count) % self.capacity
+            self.fill -= count
+
+            if count:
+                self.condition.notify_all()
+
+            if count < len(out):
+                self.underruns += 1
+
+        if count < len(out):
+            out[count:] = self._silence(len(out) - count)
+
+        return count
+
+    def clear(self):
+        """
+        Drop everything waiting to be played and reopen the buffer.
+        """
+        with self.condition:
+            self.read_pos = 0
+            self.fill = 0
+            self.closed = False
+            self.condition.notify_all()
+
+    def close(self):
+        """
+        Wake any writer waiting for space, all writes return immediately until clear() is called.
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def _silence(self, length):
+        if len(self.silence) < length:
+            self.silence = bytearray(length)
+
+        return memoryview(self.silence)[:length]
+
+    def _write_dropping(self, data):
+        if len(data) > self.capacity:
+            self.dropped_bytes += len(data) - self.capacity
+            data = data[len(data) - self.capacity:]
+
+        overflow = self.fill + len(data) - self.capacity
+
+        if overflow > 0:
+            self.read_pos = (self.read_pos + overflow) % self.capacity
+            self.fill -= overflow
+            self.dropped_bytes += overflow
+
+        return self._copy_in(data)
+
+    def _copy_in(self, data):
+        write_pos = (self.read_pos + self.fill) % self.capacity
+        first = min(len(data), self.capacity - write_pos)
+
+        self.view[write_pos:write_pos + first] = data[:first]
+        self.view[:len(data) - first] = data[first:]
+
+        self.fill += len(data)
+        return len(data)
@@ -0,0 +1,66 @@
+"""
+Run every benchmark and write the results to a JSON file, to compare between versions.
+
+    python -m benchmarks -o bench_results.json
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+
+from benchmarks import bench_audio_gain, bench_ir_learning, bench_ir_transmitter
+
+
+SUITES = (("audio_gain", bench_audio_gain), ("ir_learning", bench_ir_learning),
+          ("ir_transmitter", bench_ir_transmitter))
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Run the benchmarks and save the results as JSON.")
+    p.add_argument("-o", "--output", help="JSON file to write, - for stdout", default="bench_results.json")
+    p.add_argument("--repeat", help="timing repeats, the best is kept", type=int, default=3)
+    p.add_argument("suites", nargs="*", help="suites to run, all by default: " + ", ".join(dict(SUITES)))
+    args = p.parse_args(argv)
+
+    for name in args.suites:
+        if name not in dict(SUITES):
+            p.error("unknown suite: " + name)
+
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    selected = args.suites or [name for name, _ in SUITES]
+    results = {}
+
+    for name, suite in SUITES:
+        if name in selected:
+            print("Running {0} benchmarks".format(name), file=sys.stderr)
+            results[name] = suite.run(repeat=args.repeat)
+
+    report = {"timestamp": time.time(),
+              "revision": git_revision(),
+              "python": platform.python_version(),
+              "machine": platform.machine(),
+              "results": results}
+
+    if args.output == "-":
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print()
+    else:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
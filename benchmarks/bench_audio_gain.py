@@ -0,0 +1,134 @@
+"""
+Benchmark the desktop's per-segment normalisation, GainStage against the original pydub path from
+audio_normalizer.py, on synthetic stereo blocks of the size AudioInputNormalizer captures, checking the outputs are
+identical along the way.  Also times SmoothedGainStage on the single hardware buffers CallbackAudioStreamer
+normalises, each of which has to be done well within the buffer's duration.
+
+    python -m benchmarks.bench_audio_gain
+"""
+import random
+import struct
+import timeit
+import tracemalloc
+
+from pydub import AudioSegment
+
+from audio_normalizer.gain_stage import GainStage, SmoothedGainStage
+
+
+SAMPLE_RATE = 44100
+CHUNK_SIZE = 1024
+CHANNELS = 2
+# AudioInputNormalizer captures record_rate_seconds at a time, in whole chunks.
+CHUNKS_PER_SEGMENT = int(SAMPLE_RATE / CHUNK_SIZE * 0.5)
+TARGET_DBFS = -40.0
+
+
+def reference_match_target_amplitude(sound, target_dbfs):
+    if sound.dBFS == float("+inf") or sound.dBFS == float("-inf"):
+        return sound
+
+    return sound.apply_gain(target_dbfs - sound.dBFS)
+
+
+def reference_segment(chunks):
+    return reference_match_target_amplitude(AudioSegment(b"".join(chunks), sample_width=2, channels=CHANNELS,
+                                                         frame_rate=SAMPLE_RATE), TARGET_DBFS)
+
+
+def captured_chunks(amplitude, seed=0):
+    """
+    A segment's worth of chunks as stream.read() returns them, noise with occasional full scale peaks.
+    """
+    rng = random.Random(seed)
+    samples = CHUNK_SIZE * CHANNELS
+    chunks = []
+
+    for _ in range(CHUNKS_PER_SEGMENT):
+        values = [max(-32768, min(32767, int(rng.gauss(0, amplitude)))) for _ in range(samples)]
+
+        if amplitude:
+            values[rng.randrange(samples)] = 32767
+
+        chunks.append(struct.pack("<{0}h".format(samples), *values))
+
+    return chunks
+
+
+def gain_stage_segment(stage, buffer, chunks):
+    view = memoryview(buffer)
+    offset = 0
+
+    for chunk in chunks:
+        view[offset:offset + len(chunk)] = chunk
+        offset += len(chunk)
+
+    stage.process(buffer)
+    return buffer
+
+
+def peak_allocated(function):
+    function()
+    tracemalloc.start()
+
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run(repeat=3):
+    results = []
+
+    for name, amplitude in (("silence", 0), ("quiet", 100), ("speech", 3000), ("loud", 20000)):
+        chunks = captured_chunks(amplitude)
+        stage = GainStage(TARGET_DBFS)
+        buffer = bytearray(sum(len(chunk) for chunk in chunks))
+
+        def reference():
+            return reference_segment(chunks)
+
+        def vectorised():
+            return gain_stage_segment(stage, buffer, chunks)
+
+        assert bytes(vectorised()) == reference().raw_data
+
+        results.append({"benchmark": "gain",
+                        "signal": name,
+                        "bytes": len(buffer),
+                        "pydub_seconds": min(timeit.repeat(reference, number=20, repeat=repeat)) / 20,
+                        "gain_stage_seconds": min(timeit.repeat(vectorised, number=20, repeat=repeat)) / 20,
+                        "pydub_peak_bytes": peak_allocated(reference),
+                        "gain_stage_peak_bytes": peak_allocated(vectorised)})
+
+        smoothed = SmoothedGainStage(TARGET_DBFS, SAMPLE_RATE, CHANNELS)
+        block = bytearray(chunks[0])
+
+        def callback():
+            block[:] = chunks[0]
+            smoothed.process(block)
+
+        results.append({"benchmark": "callback_gain",
+                        "signal": name,
+                        "bytes": len(block),
+                        "buffer_seconds": CHUNK_SIZE / float(SAMPLE_RATE),
+                        "seconds": min(timeit.repeat(callback, number=200, repeat=repeat)) / 200,
+                        "peak_bytes": peak_allocated(callback)})
+
+    return results
+
+
+def main():
+    for result in run():
+        if result["benchmark"] == "callback_gain":
+            print("{0:<8} callback {1:9.6f}s of a {2:.6f}s buffer {3:8d} bytes".format(
+                result["signal"], result["seconds"], result["buffer_seconds"], result["peak_bytes"]))
+        else:
+            print("{0:<8} pydub {1:9.6f}s {2:8d} bytes  gain stage {3:9.6f}s {4:8d} bytes  {5:5.1f}x".format(
+                result["signal"], result["pydub_seconds"], result["pydub_peak_bytes"], result["gain_stage_seconds"],
+                result["gain_stage_peak_bytes"], result["pydub_seconds"] / result["gain_stage_seconds"]))
+
+
+if __name__ == "__main__":
+    main()
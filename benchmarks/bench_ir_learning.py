@@ -0,0 +1,176 @@
+"""
+Benchmark normalise() and tidy() from ir_transmitter.ir_learning against the original pairwise implementations
+from ir_rxtx_sample.py, on synthetic noisy recordings, checking the outputs are identical along the way.
+
+    python -m benchmarks.bench_ir_learning
+"""
+import random
+import timeit
+
+from ir_transmitter.ir_learning import normalise, tidy, tolerance_bounds
+
+
+TOLERANCE = 15
+
+
+def reference_normalise(c, tolerance=TOLERANCE):
+    toler_min, toler_max = tolerance_bounds(tolerance)
+    entries = len(c)
+    p = [0] * entries
+    for i in range(entries):
+        if not p[i]:
+            v = c[i]
+            tot = v
+            similar = 1.0
+
+            for j in range(i + 2, entries, 2):
+                if not p[j]:
+                    if (c[j] * toler_min) < v < (c[j] * toler_max):
+                        tot = tot + c[j]
+                        similar += 1.0
+
+            newv = round(tot / similar, 2)
+            c[i] = newv
+
+            for j in range(i + 2, entries, 2):
+                if not p[j]:
+                    if (c[j] * toler_min) < v < (c[j] * toler_max):
+                        c[j] = newv
+                        p[j] = 1
+
+
+def reference_tidy_mark_space(records, base, tolerance=TOLERANCE):
+    _, toler_max = tolerance_bounds(tolerance)
+    ms = {}
+
+    for rec in records:
+        rl = len(records[rec])
+        for i in range(base, rl, 2):
+            if records[rec][i] in ms:
+                ms[records[rec][i]] += 1
+            else:
+                ms[records[rec][i]] = 1
+
+    v = None
+
+    for plen in sorted(ms):
+        if v == None:
+            e = [plen]
+            v = plen
+            tot = plen * ms[plen]
+            similar = ms[plen]
+
+        elif plen < (v * toler_max):
+            e.append(plen)
+            tot += (plen * ms[plen])
+            similar += ms[plen]
+
+        else:
+            v = int(round(tot / float(similar)))
+            for i in e:
+                ms[i] = v
+            e = [plen]
+            v = plen
+            tot = plen * ms[plen]
+            similar = ms[plen]
+
+    v = int(round(tot / float(similar)))
+    for i in e:
+        ms[i] = v
+
+    for rec in records:
+        rl = len(records[rec])
+        for i in range(base, rl, 2):
+            records[rec][i] = ms[records[rec][i]]
+
+
+def reference_tidy(records, tolerance=TOLERANCE):
+    reference_tidy_mark_space(records, 0, tolerance)
+    reference_tidy_mark_space(records, 1, tolerance)
+
+
+def noisy_code(edges, rng, noise=0.08):
+    """
+    A recording of an NEC-like code with the given number of edges, every pulse off by up to noise.
+    """
+    marks = [600, 9000]
+    spaces = [560, 1690, 4500]
+    code = []
+
+    for i in range(edges):
+        nominal = rng.choice(marks if i % 2 == 0 else spaces)
+        code.append(int(nominal * rng.uniform(1 - noise, 1 + noise)))
+
+    return code
+
+
+def spread_code(edges, rng):
+    """
+    A long recording with pulse lengths spread over a wide range, as from an air conditioner remote, which gives
+    normalise() many distinct groups to find.
+    """
+    return [int(200 * 1.05 ** rng.uniform(0, 90)) for _ in range(edges)]
+
+
+def noisy_remote(keys, edges, rng):
+    return dict(("KEY_{0}".format(key), noisy_code(edges, rng)) for key in range(keys))
+
+
+def time_call(function, make_input, repeat):
+    inputs = [make_input() for _ in range(repeat)]
+    iterator = iter(inputs)
+    return min(timeit.repeat(lambda: function(next(iterator)), number=1, repeat=repeat))
+
+
+def run(seed=0, repeat=3):
+    rng = random.Random(seed)
+    results = []
+
+    for kind, make_code in (("nec", noisy_code), ("spread", spread_code)):
+        for edges in (67, 301, 1001, 3001):
+            code = make_code(edges, rng)
+            expected, actual = list(code), list(code)
+            reference_normalise(expected)
+            normalise(actual, TOLERANCE)
+            assert expected == actual, "normalise output differs from the reference for {0} edges".format(edges)
+
+            results.append({"benchmark": "normalise",
+                            "code": kind,
+                            "edges": edges,
+                            "reference_seconds": time_call(reference_normalise, lambda: list(code), repeat),
+                            "seconds": time_call(lambda c: normalise(c, TOLERANCE), lambda: list(code), repeat)})
+
+    for keys in (16, 64, 256):
+        remote = noisy_remote(keys, 301, rng)
+        expected = dict((name, list(code)) for name, code in remote.items())
+        actual = dict((name, list(code)) for name, code in remote.items())
+        reference_tidy(expected)
+        tidy(actual, TOLERANCE)
+        assert expected == actual, "tidy output differs from the reference for {0} keys".format(keys)
+
+        def copy_remote():
+            return dict((name, list(code)) for name, code in remote.items())
+
+        results.append({"benchmark": "tidy",
+                        "keys": keys,
+                        "edges": 301,
+                        "reference_seconds": time_call(reference_tidy, copy_remote, repeat),
+                        "seconds": time_call(lambda r: tidy(r, TOLERANCE), copy_remote, repeat)})
+
+    return results
+
+
+def main():
+    for result in run():
+        if "keys" in result:
+            size = "{0} keys x {1} edges".format(result["keys"], result["edges"])
+        else:
+            size = "{0} {1} edges".format(result["edges"], result["code"])
+
+        print("{0:<10} {1:<22} reference {2:9.5f}s  sweep {3:9.5f}s  ({4:.1f}x)".format(
+            result["benchmark"], size, result["reference_seconds"], result["seconds"],
+            result["reference_seconds"] / result["seconds"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+Benchmark the IR encoding and controller paths headless, on a FakePi and a SimulatedClock.
+
+Covers carrier generation, building the waves and chain for every key, loading each code file format and whole
+simulated bedtime/daytime transitions, for which the keys sent, simulated seconds and pigpiod round trips are
+reported alongside the real time taken.
+
+    python -m benchmarks.bench_ir_transmitter
+"""
+import os
+import timeit
+
+import ir_transmitter.ir_transmitter as ir_transmitter_module
+
+from ir_transmitter.code_store import load_codes
+from ir_transmitter.fake_pigpio import FakePi, SimulatedClock
+from ir_transmitter.ir_transmitter import InsigniaController
+from ir_transmitter.pigpio_transport import PigpioTransport
+from ir_transmitter.wave_cache import WaveCache, carrier
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CODE_FILES = ("insignia_commands.json", "insignia_commands.irc", "insignia_nec.json")
+GPIO = 17
+FREQUENCY = 38.0
+
+
+def code_file(name):
+    return os.path.join(ROOT, name)
+
+
+def best_of(function, number, repeat):
+    return min(timeit.repeat(function, number=number, repeat=repeat)) / number
+
+
+def bench_carrier(repeat):
+    results = []
+
+    for micros in (560, 1690, 4500, 9000):
+        results.append({"benchmark": "carrier",
+                        "micros": micros,
+                        "pulses": len(carrier(GPIO, FREQUENCY, micros)),
+                        "seconds": best_of(lambda: carrier(GPIO, FREQUENCY, micros), 100, repeat)})
+
+    return results
+
+
+def bench_chains(repeat):
+    """
+    Build every key's chain from scratch on a fresh cache, then again once its waves are resident.
+    """
+    codes = load_codes(code_file("insignia_commands.json"))
+    results = []
+
+    for command in sorted(codes):
+        code = codes[command]
+
+        def cold():
+            transport = PigpioTransport(FakePi(record_edges=False, pipelined=True))
+            WaveCache(transport.pi, GPIO, FREQUENCY, transport=transport).chain(command, code)
+
+        pi = FakePi(record_edges=False, pipelined=True)
+        transport = PigpioTransport(pi)
+        cache = WaveCache(pi, GPIO, FREQUENCY, transport=transport)
+        round_trips = transport.round_trips
+        chain = cache.chain(command, code)
+
+        results.append({"benchmark": "chain",
+                        "command": command,
+                        "edges": len(code),
+                        "chain_length": len(chain),
+                        "pulses": cache.pulses_used,
+                        "round_trips": transport.round_trips - round_trips,
+                        "cold_seconds": best_of(cold, 10, repeat),
+                        "warm_seconds": best_of(lambda: cache.chain(command, code), 1000, repeat)})
+
+    return results
+
+
+def bench_loading(repeat):
+    results = []
+
+    for name in CODE_FILES:
+        filepath = code_file(name)
+        results.append({"benchmark": "load_codes",
+                        "file": name,
+                        "bytes": os.path.getsize(filepath),
+                        "keys": len(load_codes(filepath)),
+                        "seconds": best_of(lambda: load_codes(filepath), 20, repeat)})
+
+    return results
+
+
+def simulated_controller(clock):
+    pi = FakePi(clock=clock, record_edges=False, pipelined=True)
+    controller = InsigniaController(code_file("insignia_nec.json"), pi=pi)
+    controller.scheduler.clock = clock
+    # tvservice isn't running, so tell the controller the TV is on rather than waiting for it to say so.
+    controller.power_state.update(True)
+    return controller
+
+
+def bench_transitions():
+    """
+    Run startup, bedtime and daytime on simulated time, as the Pi server would.
+    """
+    clock = SimulatedClock()
+    module_time = ir_transmitter_module.time
+    ir_transmitter_module.time = clock
+    results = []
+
+    try:
+        controller = simulated_controller(clock)
+
+        for name in ("recalibrate", "bedtime", "daytime", "daytime"):
+            keys_sent = controller.keys_sent
+            round_trips = controller.transport.round_trips
+            # Let the gap after the previous transition run out, as it would between requests.
+            clock.sleep(60)
+            simulated = clock.now
+            seconds = timeit.default_timer()
+
+            getattr(controller, name)()
+
+            results.append({"benchmark": "transition",
+                            "transition": name,
+                            "keys_sent": controller.keys_sent - keys_sent,
+                            "round_trips": controller.transport.round_trips - round_trips,
+                            "simulated_seconds": clock.now - simulated,
+                            "seconds": timeit.default_timer() - seconds})
+    finally:
+        ir_transmitter_module.time = module_time
+
+    return results
+
+
+def run(repeat=3):
+    return bench_carrier(repeat) + bench_chains(repeat) + bench_loading(repeat) + bench_transitions()
+
+
+def main():
+    for result in run():
+        if result["benchmark"] == "transition":
+            print("{0:<12} {1:<22} {2:3d} keys {3:4d} round trips {4:7.2f}s simulated {5:9.5f}s".format(
+                result["benchmark"], result["transition"], result["keys_sent"], result["round_trips"],
+                result["simulated_seconds"], result["seconds"]))
+        elif result["benchmark"] == "chain":
+            print("{0:<12} {1:<22} {2:3d} entries {3:3d} round trips cold {4:9.6f}s  warm {5:9.6f}s".format(
+                result["benchmark"], result["command"], result["chain_length"], result["round_trips"],
+                result["cold_seconds"], result["warm_seconds"]))
+        else:
+            print("{0:<12} {1:<22} {2:9.6f}s".format(
+                result["benchmark"], str(result.get("micros", result.get("file"))), result["seconds"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+import logging
+
+import pigpio
+
+from ir_transmitter.code_store import load_codes
+from ir_transmitter.gap_scheduler import GapScheduler
+from ir_transmitter.ir_transmitter import wait_for_transmit
+from ir_transmitter.metrics import GAP_WAIT_SECONDS
+from ir_transmitter.pigpio_transport import PigpioTransport
+from ir_transmitter.wave_cache import code_pulses, merge_pulses
+
+
+logger = logging.getLogger("ir_transmitter.broadcast")
+
+
+class BroadcastTransmitter(object):
+    """
+    Drives several IR LEDs, one per device, from a single pigpio connection.
+
+    The codes for every LED in a broadcast are expanded into pulse trains for their own GPIOs and merged into one
+    wave, so different codes go out on different LEDs at the same time and a broadcast takes as long as its longest
+    code rather than the sum of them.
+
+    Merged waves aren't cached: each is fully expanded (the carrier loops WaveCache uses can't be shared between
+    codes that overlap in time), built just before it's sent and deleted straight after.
+    """
+    def __init__(self, emitters, frequency=38.0, gap_seconds=0.1, gap_profiles=None, pi=None):
+        """
+
+        :param emitters: The code file for the device each GPIO's LED points at.
+        :type emitters: dict[int, str]
+        :param frequency: Carrier frequency in kHz, shared by every LED.
+        :type frequency: float
+        :param gap_seconds: Minimum seconds between the end of one broadcast and the start of the next.
+        :type gap_seconds: float
+        :param gap_profiles: Minimum gaps after specific commands, overriding gap_seconds.
+        :type gap_profiles: dict[str, float]
+        :param pi: Connection to pigpiod to use instead of opening a new one, e.g. a fake_pigpio.FakePi.
+        :type pi: pigpio.pi
+        """
+        self.pi = pi if pi is not None else pigpio.pi()
+        self.transport = PigpioTransport(self.pi)
+        self.frequency = frequency
+        self.emitters = dict((gpio, load_codes(filepath)) for gpio, filepath in emitters.items())
+        self.scheduler = GapScheduler(gap_seconds, gap_profiles)
+        self.keys_sent = 0
+
+        for gpio in self.emitters:
+            self.pi.set_mode(gpio, pigpio.OUTPUT)
+
+    def transmit(self, commands, end_delay=None):
+        """
+        Send a key on each of the given LEDs simultaneously.
+
+        :param commands: The command to send on each GPIO.
+        :type commands: dict[int, str]
+        :param end_delay: Minimum seconds before the next broadcast, instead of the longest of the commands' gaps.
+        :type end_delay: Union[float, None]
+        """
+        if not commands:
+            return
+
+        trains = []
+
+        for gpio, command in commands.items():
+            if gpio not in self.emitters:
+                raise KeyError("No emitter on GPIO {0}".format(gpio))
+
+            if command not in self.emitters[gpio]:
+                raise KeyError("Given command not supported on GPIO {0}: {1}".format(gpio, command))
+
+            trains.append(code_pulses(gpio, self.frequency, self.emitters[gpio][command]))
+
+        wf = merge_pulses(trains)
+
+        try:
+            wave_id, _ = self.transport.create_waves([wf])[0]
+        except pigpio.error:
+            logger.exception("Failed to generate merged IR waveform ({0} pulses) for: {1}".format(len(wf), commands))
+            raise
+
+        try:
+            GAP_WAIT_SECONDS.observe(self.scheduler.wait())
+            self.transport.wave_chain([wave_id])
+            wait_for_transmit(self.transport, sum(pulse.delay for pulse in wf))
+        finally:
+            self.transport.wave_delete(wave_id)
+
+        self.keys_sent += len(commands)
+
+        if end_delay is None:
+            end_delay = max(self.scheduler.gap(command) for command in commands.values())
+
+        self.scheduler.emitted(None, end_delay)
+
+    def transmit_sequences(self, sequences):
+        """
+        Run a key sequence on each LED side by side: the first keys of every sequence go out together, then the
+        second keys once the longest of the first keys' gaps has passed, and so on.
+
+        :param sequences: Commands, or (command, gap in milliseconds after the key) pairs, for each GPIO.  A gap of
+            None uses the command's gap profile.
+        :type sequences: dict[int, list[Union[str, tuple[str, Union[float, None]]]]]
+        """
+        steps = max(len(sequence) for sequence in sequences.values()) if sequences else 0
+
+        for step in range(steps):
+            commands = {}
+            gaps = []
+
+            for gpio, sequence in sequences.items():
+                if step >= len(sequence):
+                    continue
+
+                item = sequence[step]
+                command, gap_ms = (item, None) if isinstance(item, str) else item
+                commands[gpio] = command
+                gaps.append(self.scheduler.gap(command) if gap_ms is None else gap_ms / 1000.0)
+
+            self.transmit(commands, max(gaps))
@@ -0,0 +1,205 @@
+"""
+Compact binary storage for recorded IR codes.
+
+Recorded codes are made up of a handful of distinct pulse lengths, so rather than keeping every code as a list
+of integers the store keeps one sorted alphabet of pulse lengths and, for each command, an array of indices into
+it.  Everything lives in flat arrays that are read straight off disk, so loading costs one read no matter how
+many codes there are.
+
+File layout (little endian):
+
+    header      magic, version, index width, alphabet size, command count, total indices, names size
+    alphabet    uint32 pulse lengths in microseconds
+    offsets     uint32 start of each command in the index array, plus one trailing end offset
+    indices     uint8 (or uint16 for alphabets over 256 entries) indices into the alphabet
+    names       utf-8 command names separated by newlines
+
+To convert a JSON file written by ir_rxtx_sample.py:
+
+    python -m ir_transmitter.code_store insignia_commands.json insignia_commands.irc
+"""
+import json
+import struct
+import sys
+
+from array import array
+from collections.abc import Mapping
+
+from ir_transmitter.nec import NECCodeSet
+
+
+MAGIC = b"IRCS"
+VERSION = 1
+HEADER = struct.Struct("<4sBBHIIII")
+
+
+def _to_little_endian(values):
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+
+    return values.tobytes()
+
+
+def _from_little_endian(typecode, data):
+    values = array(typecode)
+    values.frombytes(data)
+
+    if sys.byteorder == "big":
+        values.byteswap()
+
+    return values
+
+
+class CodeStore(Mapping):
+    """
+    Read only mapping of command name to the list of pulse lengths making up its code.
+    """
+    def __init__(self, alphabet, offsets, indices, names):
+        """
+
+        :param alphabet: Distinct pulse lengths in microseconds.
+        :type alphabet: array
+        :param offsets: Start of each command's indices, followed by the end of the last one.
+        :type offsets: array
+        :param indices: Indices into the alphabet for every pulse of every command.
+        :type indices: array
+        :param names: Command names, in the same order as the offsets.
+        :type names: list[str]
+        """
+        self.alphabet = alphabet
+        self.offsets = offsets
+        self.indices = indices
+        self.names = names
+        self.positions = dict((name, position) for position, name in enumerate(names))
+
+    @classmethod
+    def from_records(cls, records):
+        """
+        Build a store from a dictionary of command name to pulse lengths, as written by ir_rxtx_sample.py.
+
+        :type records: dict[str, list[int]]
+        :rtype: CodeStore
+        """
+        names = sorted(records)
+        alphabet = array("I", sorted(set(int(round(length)) for name in names for length in records[name])))
+        lookup = dict((length, index) for index, length in enumerate(alphabet))
+
+        offsets = array("I", [0])
+        indices = array("B" if len(alphabet) <= 256 else "H")
+
+        for name in names:
+            indices.extend(lookup[int(round(length))] for length in records[name])
+            offsets.append(len(indices))
+
+        return cls(alphabet, offsets, indices, names)
+
+    @classmethod
+    def load(cls, filepath):
+        """
+        :type filepath: str
+        :rtype: CodeStore
+        """
+        with open(filepath, "rb") as store_file:
+            data = store_file.read()
+
+        magic, version, width, _, alphabet_size, command_count, index_count, names_size = HEADER.unpack_from(data)
+
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("{0} is not an IR code store this version can read".format(filepath))
+
+        position = HEADER.size
+        sections = []
+
+        for typecode, count, size in (("I", alphabet_size, 4),
+                                      ("I", command_count + 1, 4),
+                                      ("B" if width == 1 else "H", index_count, width)):
+            sections.append(_from_little_endian(typecode, data[position:position + count * size]))
+            position += count * size
+
+        names_data = data[position:position + names_size].decode("utf-8")
+        names = names_data.split("\n") if names_data else []
+
+        return cls(sections[0], sections[1], sections[2], names)
+
+    def save(self, filepath):
+        """
+        :type filepath: str
+        """
+        names_data = "\n".join(self.names).encode("utf-8")
+        header = HEADER.pack(MAGIC, VERSION, self.indices.itemsize, 0, len(self.alphabet), len(self.names),
+                             len(self.indices), len(names_data))
+
+        with open(filepath, "wb") as store_file:
+            store_file.write(header)
+            store_file.write(_to_little_endian(self.alphabet))
+            store_file.write(_to_little_endian(self.offsets))
+            store_file.write(_to_little_endian(self.indices))
+            store_file.write(names_data)
+
+    def code_indices(self, command):
+        """
+        Return the alphabet indices making up the given command without expanding them into pulse lengths.
+
+        :type command: str
+        :rtype: array
+        """
+        position = self.positions[command]
+        return self.indices[self.offsets[position]:self.offsets[position + 1]]
+
+    def __getitem__(self, command):
+        alphabet = self.alphabet
+        return [alphabet[index] for index in self.code_indices(command)]
+
+    def __contains__(self, command):
+        return command in self.positions
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+
+def load_codes(filepath):
+    """
+    Load IR codes from a binary code store, an NEC code set or a JSON file written by ir_rxtx_sample.py.
+
+    :type filepath: str
+    :rtype: Mapping[str, list[int]]
+    """
+    with open(filepath, "rb") as code_file:
+        magic = code_file.read(len(MAGIC))
+
+    if magic == MAGIC:
+        return CodeStore.load(filepath)
+
+    with open(filepath) as code_file:
+        data = json.load(code_file)
+
+    if "protocol" in data:
+        return NECCodeSet.from_json(data)
+
+    return CodeStore.from_records(data)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+
+    if len(argv) != 2:
+        print("usage: python -m ir_transmitter.code_store <codes.json> <codes.irc>")
+        return 1
+
+    json_filepath, store_filepath = argv
+
+    with open(json_filepath) as json_file:
+        store = CodeStore.from_records(json.load(json_file))
+
+    store.save(store_filepath)
+    print("Wrote {0} codes using {1} distinct pulse lengths to {2}".format(len(store), len(store.alphabet),
+                                                                          store_filepath))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,199 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+import uuid
+
+from collections import OrderedDict
+
+
+logger = logging.getLogger("ir_transmitter.command_queue")
+
+# Jobs that each leave the TV in a complete state, so only the newest pending one matters.
+TRANSITIONS = ("bedtime", "daytime")
+# Lower runs first, anything not listed runs at DEFAULT_PRIORITY in submission order.
+PRIORITIES = {"update_configuration": 0}
+DEFAULT_PRIORITY = 1
+
+
+class Job(object):
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    SUPERSEDED = "superseded"
+
+    def __init__(self, name, kwargs, priority):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.kwargs = kwargs
+        self.priority = priority
+        self.status = Job.QUEUED
+        self.error = None
+        self.superseded_by = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        # Progress, kept up to date while the job runs.
+        self.step = None
+        self.keys_sent = 0
+        self.eta = None
+
+    @property
+    def pending(self):
+        return self.status == Job.QUEUED
+
+    def to_json(self):
+        return {"id": self.id,
+                "name": self.name,
+                "kwargs": self.kwargs,
+                "status": self.status,
+                "error": self.error,
+                "superseded_by": self.superseded_by,
+                "created": self.created,
+                "started": self.started,
+                "finished": self.finished,
+                "progress": {"step": self.step,
+                             "keys_sent": self.keys_sent,
+                             "eta": self.eta}}
+
+
+class ControllerWorker(object):
+    """
+    Runs controller commands one at a time on a single background thread, so IR keys from different requests
+    never interleave and callers don't have to wait for the TV.
+
+    Queued work that a newer job makes pointless is dropped before it runs: a pending bedtime or daytime is
+    superseded by any later transition, and a pending volume change by any later volume change or transition.
+
+    A running job's progress comes from the controller's step and keys_sent attributes, and its ETA from how long
+    the last job of the same name took.
+    """
+    def __init__(self, controller, history_size=100):
+        """
+
+        :param controller: Object whose methods the jobs call, normally an InsigniaController.
+        :param history_size: Number of finished jobs kept around for status lookups.
+        :type history_size: int
+        """
+        self.controller = controller
+        self.history_size = history_size
+        self.jobs = OrderedDict()
+        """ :type: OrderedDict[str, Job]"""
+        self.pending = []
+        self.sequence = itertools.count()
+        self.durations = {}
+        """ :type: dict[str, float]"""
+        self.current = None
+        self.keys_at_start = 0
+        self.condition = threading.Condition()
+        self.running = False
+        self.worker_thread = threading.Thread(target=self.run, name="controller-worker")
+        self.worker_thread.daemon = True
+
+    def start(self):
+        self.running = True
+        self.worker_thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+
+    def submit(self, name, **kwargs):
+        """
+        Queue a call to controller.<name>(**kwargs).
+
+        :type name: str
+        :rtype: Job
+        """
+        job = Job(name, kwargs, PRIORITIES.get(name, DEFAULT_PRIORITY))
+
+        with self.condition:
+            for other in self.jobs.values():
+                if other.pending and self._supersedes(job, other):
+                    logger.info("Dropping queued {0} job {1}, superseded by {2}".format(other.name, other.id, job.id))
+                    other.status = Job.SUPERSEDED
+                    other.superseded_by = job.id
+                    other.finished = time.time()
+
+            self.jobs[job.id] = job
+            heapq.heappush(self.pending, (job.priority, next(self.sequence), job))
+            self._trim_history()
+            self.condition.notify_all()
+
+        return job
+
+    def job(self, job_id):
+        """
+        :type job_id: str
+        :rtype: Union[Job, None]
+        """
+        with self.condition:
+            job = self.jobs.get(job_id)
+
+            if job is not None and job is self.current:
+                self._update_progress(job)
+
+            return job
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.running and not self.pending:
+                    self.condition.wait()
+
+                if not self.running:
+                    return
+
+                _, _, job = heapq.heappop(self.pending)
+
+                if not job.pending:
+                    continue
+
+                job.status = Job.RUNNING
+                job.started = time.time()
+
+                if job.name in self.durations:
+                    job.eta = job.started + self.durations[job.name]
+
+                self.current = job
+                self.keys_at_start = getattr(self.controller, "keys_sent", 0)
+
+            logger.info("Running {0} job {1}".format(job.name, job.id))
+
+            try:
+                getattr(self.controller, job.name)(**job.kwargs)
+            except Exception as err:
+                logger.exception("{0} job {1} failed".format(job.name, job.id))
+                status, error = Job.FAILED, str(err)
+            else:
+                status, error = Job.DONE, None
+
+            with self.condition:
+                self._update_progress(job)
+                self.current = None
+                job.status = status
+                job.error = error
+                job.finished = time.time()
+
+                if status == Job.DONE:
+                    self.durations[job.name] = job.finished - job.started
+
+    def _update_progress(self, job):
+        job.step = getattr(self.controller, "step", None)
+        job.keys_sent = getattr(self.controller, "keys_sent", 0) - self.keys_at_start
+
+    @staticmethod
+    def _supersedes(job, other):
+        if job.name in TRANSITIONS:
+            return other.name in TRANSITIONS or other.name == "set_volume"
+
+        return job.name == "set_volume" and other.name == "set_volume"
+
+    def _trim_history(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished is not None]
+
+        for job_id in finished[:max(len(self.jobs) - self.history_size, 0)]:
+            del self.jobs[job_id]
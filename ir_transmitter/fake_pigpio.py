@@ -0,0 +1,387 @@
+"""
+A stand-in for pigpio.pi that runs without a Pi or pigpiod, for benchmarking and testing the IR path headless.
+
+FakePi implements the wave calls IRTransmitter uses, enforces pigpio's resource limits (wave ids, pulses, DMA
+control blocks, chain length and loop counters), models how long the DMA engine takes to send a chain and records
+every output level change it would have produced.  Only pigpio's pure python client module is needed, which
+installs on any platform.
+
+With pipelined=True it also has the raw socket a real pigpio.pi exposes, a FakePigpioSocket that decodes pigpiod's
+command frames and answers each with a reply frame, so PigpioTransport's batched path runs against it too.
+
+    pi = FakePi(clock=SimulatedClock())
+    controller = InsigniaController("insignia_nec.json", pi=pi)
+"""
+import struct
+import threading
+import time
+
+import pigpio
+
+from ir_transmitter import pigpio_transport
+from ir_transmitter.wave_cache import merge_pulses
+
+
+MAX_WAVE_IDS = 250
+MAX_PULSES = 12000
+MAX_CBS = 25016
+MAX_CHAIN_LENGTH = 600
+MAX_CHAIN_LOOPS = 20
+MAX_MICROS = 1800000000
+
+# The errors FakePi raises, by their text, so the socket can reply with pigpiod's result codes.
+ERROR_CODES = dict((pigpio.error_text(code), code) for code in (
+    pigpio.PI_EMPTY_WAVEFORM, pigpio.PI_NO_WAVEFORM_ID, pigpio.PI_TOO_MANY_PULSES, pigpio.PI_TOO_MANY_CBS,
+    pigpio.PI_BAD_WAVE_ID, pigpio.PI_CHAIN_TOO_BIG, pigpio.PI_BAD_CHAIN_CMD, pigpio.PI_CHAIN_COUNTER))
+
+
+class SimulatedClock(object):
+    """
+    Virtual clock that only moves when something sleeps on it.
+
+    It has the same time()/monotonic()/sleep() calls as the time module, so it can be dropped in wherever a module
+    does `import time` to run hours of simulated IR traffic instantly.
+    """
+    def __init__(self, start=0.0):
+        self.now = start
+        self.slept = 0.0
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            self.now += seconds
+            self.slept += seconds
+
+
+def _cbs(pulses):
+    # pigpio spends a control block on the levels and another on the delay of every pulse that changes a GPIO,
+    # and just the delay for pulses that don't.
+    return sum(2 if (pulse.gpio_on or pulse.gpio_off) else 1 for pulse in pulses)
+
+
+class FakePigpioSocket(object):
+    """
+    The pigpiod end of a connection's command socket, carrying out the wave commands on a FakePi.
+
+    Every frame written is executed as soon as it arrives and its reply queued, like pigpiod does, so a batch with a
+    failing command still runs the commands after it.  writes counts the sendall() calls, i.e. round trips.
+    """
+    def __init__(self, pi):
+        """
+
+        :type pi: FakePi
+        """
+        self.pi = pi
+        self.replies = bytearray()
+        self.writes = 0
+        self.commands = []
+        """ :type: list[tuple[int, int, int, bytes]]"""
+        self.results = []
+        """ :type: list[int]"""
+
+    def sendall(self, data):
+        data = bytes(data)
+        offset = 0
+        self.writes += 1
+
+        while offset < len(data):
+            cmd, p1, p2, length = pigpio_transport.COMMAND.unpack_from(data, offset)
+            offset += pigpio_transport.COMMAND.size
+            extension = data[offset:offset + length]
+            offset += length
+
+            self.commands.append((cmd, p1, p2, extension))
+            self.results.append(self._execute(cmd, p1, extension))
+            self.replies += pigpio_transport.REPLY.pack(cmd, p1, p2, self.results[-1])
+
+    def recv_into(self, buffer):
+        count = min(len(buffer), len(self.replies))
+        buffer[:count] = self.replies[:count]
+        del self.replies[:count]
+        return count
+
+    def _execute(self, cmd, p1, extension):
+        try:
+            if cmd == pigpio_transport.WVCLR:
+                self.pi.wave_clear()
+            elif cmd == pigpio_transport.WVNEW:
+                self.pi.wave_add_new()
+            elif cmd == pigpio_transport.WVAG:
+                values = struct.unpack("<{0}I".format(len(extension) // 4), extension)
+                return self.pi.wave_add_generic([pigpio.pulse(*values[i:i + 3]) for i in range(0, len(values), 3)])
+            elif cmd == pigpio_transport.WVSC:
+                return self.pi.wave_get_max_cbs() if p1 == 2 else self.pi.wave_get_cbs()
+            elif cmd == pigpio_transport.WVCRE:
+                return self.pi.wave_create()
+            elif cmd == pigpio_transport.WVDEL:
+                self.pi.wave_delete(p1)
+            elif cmd == pigpio_transport.WVCHA:
+                return self.pi.wave_chain(list(bytearray(extension)))
+            elif cmd == pigpio_transport.WVBSY:
+                return self.pi.wave_tx_busy()
+            else:
+                return pigpio.PI_UNKNOWN_COMMAND
+        except pigpio.error as error:
+            return ERROR_CODES[error.value]
+
+        return 0
+
+
+class FakeSocketLock(object):
+    """
+    Stands in for the socket and lock pair pigpio.pi keeps as pi.sl.
+    """
+    def __init__(self, pi):
+        self.s = FakePigpioSocket(pi)
+        self.l = threading.Lock()
+
+
+class FakePi(object):
+    def __init__(self, clock=None, max_pulses=MAX_PULSES, max_cbs=MAX_CBS, record_edges=True, pipelined=False):
+        """
+
+        :param clock: Source of time for transmit durations, the time module unless given a SimulatedClock.
+        :param max_pulses: Total pulses pigpio has room for across all waves.
+        :type max_pulses: int
+        :param max_cbs: Total DMA control blocks pigpio has room for across all waves.
+        :type max_cbs: int
+        :param record_edges: Keep the output level timeline of every chain sent.
+        :type record_edges: bool
+        :param pipelined: Expose a FakeSocketLock as sl, for PigpioTransport to batch commands over.
+        :type pipelined: bool
+        """
+        self.connected = True
+        self.clock = clock or time
+        self.max_pulses = max_pulses
+        self.max_cbs = max_cbs
+        self.record_edges = record_edges
+
+        self.modes = {}
+        self.levels = 0
+        self.current = []
+        self.waves = {}
+        self.tx_end = 0.0
+
+        self.edges = []
+        """ :type: list[tuple[float, int]]"""
+        self.chains_sent = 0
+        self.micros_sent = 0
+        self.calls = {}
+
+        if pipelined:
+            self.sl = FakeSocketLock(self)
+
+    def _count(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def set_mode(self, gpio, mode):
+        self._count("set_mode")
+        self.modes[gpio] = mode
+
+    def get_mode(self, gpio):
+        self._count("get_mode")
+        return self.modes.get(gpio, pigpio.INPUT)
+
+    def wave_clear(self):
+        self._count("wave_clear")
+        self.current = []
+        self.waves = {}
+
+    def wave_add_new(self):
+        self._count("wave_add_new")
+        self.current = []
+
+    def wave_add_generic(self, pulses):
+        self._count("wave_add_generic")
+        self.current = merge_pulses([self.current, pulses]) if self.current else list(pulses)
+        return len(self.current)
+
+    def wave_get_pulses(self):
+        self._count("wave_get_pulses")
+        return len(self.current)
+
+    def wave_get_cbs(self):
+        self._count("wave_get_cbs")
+        return _cbs(self.current)
+
+    def wave_get_micros(self):
+        self._count("wave_get_micros")
+        return sum(pulse.delay for pulse in self.current)
+
+    def wave_get_max_pulses(self):
+        self._count("wave_get_max_pulses")
+        return self.max_pulses
+
+    def wave_get_max_cbs(self):
+        self._count("wave_get_max_cbs")
+        return self.max_cbs
+
+    def wave_get_max_micros(self):
+        self._count("wave_get_max_micros")
+        return MAX_MICROS
+
+    def pulses_used(self):
+        return sum(len(pulses) for pulses in self.waves.values())
+
+    def cbs_used(self):
+        return sum(_cbs(pulses) for pulses in self.waves.values())
+
+    def wave_create(self):
+        self._count("wave_create")
+
+        if not self.current:
+            raise pigpio.error(pigpio.error_text(pigpio.PI_EMPTY_WAVEFORM))
+
+        if len(self.waves) >= MAX_WAVE_IDS:
+            raise pigpio.error(pigpio.error_text(pigpio.PI_NO_WAVEFORM_ID))
+
+        if self.pulses_used() + len(self.current) > self.max_pulses:
+            raise pigpio.error(pigpio.error_text(pigpio.PI_TOO_MANY_PULSES))
+
+        if self.cbs_used() + _cbs(self.current) > self.max_cbs:
+            raise pigpio.error(pigpio.error_text(pigpio.PI_TOO_MANY_CBS))
+
+        wave_id = min(set(range(MAX_WAVE_IDS)) - set(self.waves))
+        self.waves[wave_id] = self.current
+        self.current = []
+
+        return wave_id
+
+    def wave_delete(self, wave_id):
+        self._count("wave_delete")
+
+        if wave_id not in self.waves:
+            raise pigpio.error(pigpio.error_text(pigpio.PI_BAD_WAVE_ID))
+
+        del self.waves[wave_id]
+
+    def wave_send_once(self, wave_id):
+        self._count("wave_send_once")
+        return self._send([("wave", self._wave(wave_id))])
+
+    def wave_chain(self, data):
+        self._count("wave_chain")
+
+        if len(data) > MAX_CHAIN_LENGTH:
+            raise pigpio.error(pigpio.error_text(pigpio.PI_CHAIN_TOO_BIG))
+
+        return self._send(self._parse_chain(list(data)))
+
+    def wave_tx_busy(self):
+        self._count("wave_tx_busy")
+        return 1 if self.clock.time() < self.tx_end else 0
+
+    def wave_tx_stop(self):
+        self._count("wave_tx_stop")
+        self.tx_end = min(self.tx_end, self.clock.time())
+
+    def stop(self):
+        self._count("stop")
+        self.connected = False
+
+    def _wave(self, wave_id):
+        if wave_id not in self.waves:
+            raise pigpio.error(pigpio.error_text(pigpio.PI_BAD_WAVE_ID))
+
+        return self.waves[wave_id]
+
+    def _parse_chain(self, data):
+        stack = [[]]
+        loops = 0
+        index = 0
+
+        while index < len(data):
+            entry = data[index]
+
+            if entry != 255:
+                stack[-1].append(("wave", self._wave(entry)))
+                index += 1
+                continue
+
+            command = data[index + 1] if index + 1 < len(data) else None
+
+            if command == 0:
+                stack.append([])
+                index += 2
+            elif command in (1, 2):
+                if index + 3 >= len(data):
+                    raise pigpio.error(pigpio.error_text(pigpio.PI_BAD_CHAIN_CMD))
+
+                value = data[index + 2] + 256 * data[index + 3]
+
+                if command == 2:
+                    stack[-1].append(("delay", value))
+                else:
+                    if len(stack) == 1:
+                        raise pigpio.error(pigpio.error_text(pigpio.PI_BAD_CHAIN_CMD))
+
+                    loops += 1
+                    body = stack.pop()
+                    stack[-1].append(("loop", body, value))
+
+                index += 4
+            else:
+                raise pigpio.error(pigpio.error_text(pigpio.PI_BAD_CHAIN_CMD))
+
+        if len(stack) != 1:
+            raise pigpio.error(pigpio.error_text(pigpio.PI_BAD_CHAIN_CMD))
+
+        if loops > MAX_CHAIN_LOOPS:
+            raise pigpio.error(pigpio.error_text(pigpio.PI_CHAIN_COUNTER))
+
+        return stack[0]
+
+    def _duration(self, items):
+        micros = 0
+
+        for item in items:
+            if item[0] == "wave":
+                micros += sum(pulse.delay for pulse in item[1])
+            elif item[0] == "delay":
+                micros += item[1]
+            else:
+                micros += item[2] * self._duration(item[1])
+
+        return micros
+
+    def _play(self, items, start, offset):
+        for item in items:
+            if item[0] == "wave":
+                for pulse in item[1]:
+                    levels = (self.levels | pulse.gpio_on) & ~pulse.gpio_off
+
+                    if levels != self.levels:
+                        self.levels = levels
+                        self.edges.append((start + offset / 1000000.0, levels))
+
+                    offset += pulse.delay
+            elif item[0] == "delay":
+                offset += item[1]
+            else:
+                for _ in range(item[2]):
+                    offset = self._play(item[1], start, offset)
+
+        return offset
+
+    def _send(self, items):
+        now = self.clock.time()
+
+        if now < self.tx_end:
+            # A new chain replaces whatever is still being sent.
+            self.wave_tx_stop()
+
+        micros = self._duration(items)
+
+        if self.record_edges:
+            self._play(items, now, 0)
+
+        self.tx_end = now + micros / 1000000.0
+        self.chains_sent += 1
+        self.micros_sent += micros
+
+        return 0
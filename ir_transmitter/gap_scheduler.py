@@ -0,0 +1,66 @@
+import logging
+import time
+
+
+logger = logging.getLogger("ir_transmitter.gap_scheduler")
+
+
+class GapScheduler(object):
+    """
+    Enforces the minimum gap the TV needs between keys, sleeping only for whatever part of it hasn't already passed.
+
+    After each key is sent the scheduler notes when the next key may go out, on the monotonic clock, using a gap
+    that can be set per command (menu navigation needs longer than volume presses).  wait() is called before the
+    next key and sleeps for the remainder, so any time spent elsewhere in between, building waves, waiting on the
+    TV or handling requests, counts towards the gap instead of being added on top of it.
+    """
+    def __init__(self, default_gap=0.1, profiles=None, clock=None):
+        """
+
+        :param default_gap: Seconds to leave after any command without a profile.
+        :type default_gap: float
+        :param profiles: Seconds to leave after specific commands.
+        :type profiles: dict[str, float]
+        :param clock: Provides monotonic() and sleep(), the time module unless given e.g. a SimulatedClock.
+        """
+        self.default_gap = default_gap
+        self.profiles = dict(profiles or {})
+        self.clock = clock or time
+        self.ready_at = float("-inf")
+
+    def gap(self, command):
+        return self.profiles.get(command, self.default_gap)
+
+    def wait(self):
+        """
+        Sleep until the next key is allowed to go out.
+
+        :return: Seconds slept.
+        :rtype: float
+        """
+        remaining = self.ready_at - self.clock.monotonic()
+
+        if remaining <= 0:
+            return 0.0
+
+        logger.debug("Waiting {0:.3f}s before the next key".format(remaining))
+        self.clock.sleep(remaining)
+        return remaining
+
+    def emitted(self, command, gap=None):
+        """
+        Record that a command has just finished transmitting.
+
+        :type command: str
+        :param gap: Seconds to leave before the next key, instead of the command's profile.
+        :type gap: Union[float, None]
+        """
+        self.hold_off(self.gap(command) if gap is None else gap)
+
+    def hold_off(self, seconds):
+        """
+        Make sure nothing is sent for at least the given number of seconds from now.
+
+        :type seconds: float
+        """
+        self.ready_at = max(self.ready_at, self.clock.monotonic() + seconds)
@@ -0,0 +1,169 @@
+import logging
+import os
+import selectors
+import subprocess
+import threading
+import time
+
+from collections import deque, namedtuple
+
+
+logger = logging.getLogger("ir_transmitter.hdmi_monitor")
+
+
+class HDMIEvent(namedtuple("HDMIEvent", ["monotonic", "timestamp", "powered", "message"])):
+    """
+    A single tvservice monitor message.
+
+    monotonic is time.monotonic() when the message was read, timestamp is the wall clock time for display and
+    powered is True/False for attach/unplug events and None for anything else.
+    """
+    def to_json(self):
+        return {"monotonic": self.monotonic,
+                "timestamp": self.timestamp,
+                "powered": self.powered,
+                "message": self.message}
+
+
+def query_power(args=("tvservice", "-s"), timeout=5.0):
+    """
+    Ask tvservice whether the TV is on right now, e.g. "state 0x12000a [HDMI CEA (16) RGB lim 16:9], 1920x1080 @
+    60.00Hz, progressive" when it is and "state 0x120001 [TV is off]" when it isn't.
+
+    :return: True/False, or None if tvservice couldn't be run or its answer wasn't understood.
+    :rtype: Union[bool, None]
+    """
+    try:
+        output = subprocess.check_output(list(args), stderr=subprocess.STDOUT, timeout=timeout)
+    except (OSError, subprocess.SubprocessError):
+        logger.exception("Failed to query tvservice status")
+        return None
+
+    status = output.decode("ascii", "replace").strip().lower()
+
+    if "tv is off" in status or "unplugged" in status:
+        return False
+
+    if "hdmi" in status or "dvi" in status:
+        return True
+
+    logger.warning("Found unexpected tvservice status: " + status)
+    return None
+
+
+class TVServiceMonitor(object):
+    """
+    Watches `tvservice -M` for HDMI attach/unplug events on a background thread.
+
+    The process output is read through a selector as soon as it arrives, and if tvservice exits it's reaped and
+    started again.  The most recent events are kept in a fixed size history for diagnostics.
+    """
+    def __init__(self, on_power_change, history_size=64, args=("tvservice", "-M"), restart_delay=1.0):
+        """
+
+        :param on_power_change: Called with True/False whenever tvservice reports the TV attaching or unplugging.
+        :type on_power_change: callable
+        :param history_size: Number of events kept in the history.
+        :type history_size: int
+        :param args: Command line for the monitor process.
+        :type args: tuple[str]
+        :param restart_delay: Seconds to wait before restarting tvservice after it exits.
+        :type restart_delay: float
+        """
+        self.on_power_change = on_power_change
+        self.args = list(args)
+        self.restart_delay = restart_delay
+        self.history = deque(maxlen=history_size)
+        self.history_lock = threading.Lock()
+        self.running = False
+        self.process = None
+        self.monitor_thread = threading.Thread(target=self.run, name="tvservice-monitor")
+        self.monitor_thread.daemon = True
+
+    def start(self):
+        self.running = True
+        self.monitor_thread.start()
+
+    def stop(self):
+        self.running = False
+
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+
+    def events(self, since=None):
+        """
+        Return the recorded events, oldest first.
+
+        :param since: Only return events recorded after this time.monotonic() value.
+        :type since: Union[float, None]
+        :rtype: list[HDMIEvent]
+        """
+        with self.history_lock:
+            events = list(self.history)
+
+        if since is not None:
+            events = [event for event in events if event.monotonic > since]
+
+        return events
+
+    def run(self):
+        logger.info("Beginning tvservice monitor process thread")
+
+        while self.running:
+            try:
+                self.process = subprocess.Popen(self.args, shell=False, stdout=subprocess.PIPE,
+                                                stderr=subprocess.STDOUT)
+            except OSError:
+                logger.exception("Failed to start tvservice monitor process")
+            else:
+                self._read_events(self.process)
+                exit_code = self.process.wait()
+
+                if self.running:
+                    logger.warning("tvservice monitor process exited with code {0}, restarting".format(exit_code))
+
+            if self.running:
+                time.sleep(self.restart_delay)
+
+    def _read_events(self, process):
+        fd = process.stdout.fileno()
+        os.set_blocking(fd, False)
+        pending = b""
+
+        with selectors.DefaultSelector() as selector:
+            selector.register(fd, selectors.EVENT_READ)
+
+            while self.running:
+                if not selector.select(timeout=1.0):
+                    continue
+
+                data = os.read(fd, 4096)
+
+                if not data:
+                    return
+
+                lines = (pending + data).split(b"\n")
+                pending = lines.pop()
+
+                for line in lines:
+                    self._handle_line(line.decode("ascii", "replace").strip().lower())
+
+    def _handle_line(self, data):
+        if not data.startswith("["):
+            return
+
+        if "cable is unplugged" in data:
+            logger.info("tvservice reported the tv turned off")
+            powered = False
+        elif "is attached" in data:
+            logger.info("tvservice reported the tv turned on")
+            powered = True
+        else:
+            logger.info("Found unexpected tvservice monitor message: " + data)
+            powered = None
+
+        with self.history_lock:
+            self.history.append(HDMIEvent(time.monotonic(), time.time(), powered, data))
+
+        if powered is not None:
+            self.on_power_change(powered)
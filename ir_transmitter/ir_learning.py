@@ -0,0 +1,236 @@
+"""
+Clean up recorded IR codes.
+
+These are the normalise/compare/tidy steps from ir_rxtx_sample.py as plain functions, taking the tolerance as an
+argument instead of reading the script's command line globals.  normalise() and tidy_mark_space() sort the pulse
+lengths once and sweep through them, so they stay fast on long codes (air conditioner remotes send hundreds of
+edges) and on whole remotes, while producing exactly the same output as the original pairwise versions.
+"""
+from bisect import bisect_left, bisect_right
+from collections import Counter
+
+
+DEFAULT_TOLERANCE = 15
+
+
+def tolerance_bounds(tolerance):
+    """
+    :param tolerance: Percentage two pulses may differ by and still count as the same.
+    :type tolerance: float
+    :return: (minimum ratio, maximum ratio)
+    :rtype: tuple[float, float]
+    """
+    return (100 - tolerance) / 100.0, (100 + tolerance) / 100.0
+
+
+def normalise(c, tolerance=DEFAULT_TOLERANCE, verbose=False):
+    """
+    Typically a code will be made up of two or three distinct
+    marks (carrier) and spaces (no carrier) of different lengths.
+
+    Because of transmission and reception errors those pulses
+    which should all be x micros long will have a variance around x.
+
+    This function identifies the distinct pulses and takes the
+    average of the lengths making up each distinct pulse.  Marks
+    and spaces are processed separately.
+
+    This makes the eventual generation of waves much more efficient.
+
+    Input
+
+      M    S   M   S   M   S   M    S   M    S   M
+    9000 4500 600 540 620 560 590 1660 620 1690 615
+
+    Distinct marks
+
+    9000                average 9000
+    600 620 590 620 615 average  609
+
+    Distinct spaces
+
+    4500                average 4500
+    540 560             average  550
+    1660 1690           average 1675
+
+    Output
+
+      M    S   M   S   M   S   M    S   M    S   M
+    9000 4500 609 550 609 550 609 1675 609 1675 609
+
+    Pulses are grouped exactly as the original pairwise version did: the earliest pulse not yet in a group starts
+    a new one and takes in every later ungrouped pulse within tolerance of it.  Those pulses are found by binary
+    searching a sorted copy of the lengths, skipping grouped ones through a union-find "next ungrouped" pointer,
+    which makes the whole thing O(n log n).
+    """
+    toler_min, toler_max = tolerance_bounds(tolerance)
+
+    if verbose:
+        print("before normalise", c)
+
+    original = list(c)
+
+    for parity in (0, 1):
+        indices = range(parity, len(c), 2)
+        order = sorted(indices, key=original.__getitem__)
+        values = [original[i] for i in order]
+        position = [0] * len(c)
+
+        for p, i in enumerate(order):
+            position[i] = p
+
+        # next_free[p] leads to the first ungrouped position at or after p, len(order) meaning none left.
+        next_free = list(range(len(order) + 1))
+
+        def find(p):
+            root = p
+
+            while next_free[root] != root:
+                root = next_free[root]
+
+            while next_free[p] != root:
+                next_free[p], p = root, next_free[p]
+
+            return root
+
+        for i in indices:
+            p = position[i]
+
+            if next_free[p] != p:  # Already part of an earlier group.
+                continue
+
+            next_free[p] = p + 1
+            v = original[i]
+
+            # Search a slightly wider range than the tolerance and apply the exact test below, so floating point
+            # rounding at the edges can't change which pulses get grouped.
+            low = bisect_left(values, v / toler_max * (1 - 1e-9))
+            high = bisect_right(values, v / toler_min * (1 + 1e-9)) if toler_min > 0 else len(values)
+
+            members = []
+            q = find(low)
+
+            while q < high:
+                if (values[q] * toler_min) < v < (values[q] * toler_max):  # Similar.
+                    members.append(order[q])
+                    next_free[q] = q + 1
+
+                q = find(q + 1)
+
+            # Sum in the original order so the average comes out bit for bit the same.
+            members.sort()
+            tot = v
+
+            for j in members:
+                tot = tot + original[j]
+
+            newv = round(tot / (1.0 + len(members)), 2)
+            c[i] = newv
+
+            for j in members:
+                c[j] = newv
+
+    if verbose:
+        print("after normalise", c)
+
+
+def compare(p1, p2, tolerance=DEFAULT_TOLERANCE, verbose=False):
+    """
+    Check that both recodings correspond in pulse length to within
+    tolerance%.  If they do average the two recordings pulse lengths.
+
+    Input
+
+         M    S   M   S   M   S   M    S   M    S   M
+    1: 9000 4500 600 560 600 560 600 1700 600 1700 600
+    2: 9020 4570 590 550 590 550 590 1640 590 1640 590
+
+    Output
+
+    A: 9010 4535 595 555 595 555 595 1670 595 1670 595
+    """
+    toler_min, toler_max = tolerance_bounds(tolerance)
+
+    if len(p1) != len(p2):
+        return False
+
+    for i in range(len(p1)):
+        v = p1[i] / p2[i]
+        if (v < toler_min) or (v > toler_max):
+            return False
+
+    for i in range(len(p1)):
+        p1[i] = int(round((p1[i] + p2[i]) / 2.0))
+
+    if verbose:
+        print("after compare", p1)
+
+    return True
+
+
+def tidy_mark_space(records, base, tolerance=DEFAULT_TOLERANCE, verbose=False):
+    """
+    Collapse the marks (base=0) or spaces (base=1) of every record onto a shared set of lengths.
+
+    Go through the distinct lengths in order, shortest first, and collapse
+    pulses which are the same within a tolerance to the
+    same value.  The value is the weighted average of the
+    occurences.
+
+    E.g. 500x20 550x30 600x30  1000x10 1100x10  1700x5 1750x5
+
+    becomes 556(x80) 1050(x20) 1725(x10)
+    """
+    _, toler_max = tolerance_bounds(tolerance)
+
+    # Count the number of times each distinct length appears across all the records.
+    ms = Counter()
+
+    for code in records.values():
+        ms.update(code[base::2])
+
+    if verbose:
+        print("t_m_s A", dict(ms))
+
+    collapsed = {}
+    group = []
+    v = None
+    tot = 0
+    similar = 0
+
+    for plen in sorted(ms):
+        if v is not None and plen >= (v * toler_max):
+            average = int(round(tot / float(similar)))
+
+            for i in group:
+                collapsed[i] = average
+
+            v = None
+
+        if v is None:
+            group = [plen]
+            v = plen
+            tot = plen * ms[plen]
+            similar = ms[plen]
+        else:
+            group.append(plen)
+            tot += plen * ms[plen]
+            similar += ms[plen]
+
+    if group:
+        average = int(round(tot / float(similar)))
+
+        for i in group:
+            collapsed[i] = average
+
+    if verbose:
+        print("t_m_s B", collapsed)
+
+    for code in records.values():
+        code[base::2] = [collapsed[plen] for plen in code[base::2]]
+
+
+def tidy(records, tolerance=DEFAULT_TOLERANCE, verbose=False):
+    tidy_mark_space(records, 0, tolerance, verbose)  # Marks.
+
+    tidy_mark_space(records, 1, tolerance, verbose)  # Spaces.
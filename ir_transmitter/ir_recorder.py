@@ -0,0 +1,272 @@
+"""
+Record IR codes from a receiver on a GPIO.
+
+Rather than a pigpio callback, which costs a trip into Python for every edge and is what makes a Pi Zero miss
+edges, the recorder opens a pigpio notification pipe and reads the reports in bulk into a preallocated buffer.
+A background thread turns the reports into frames, so a key press is only handed over once it's complete.
+
+    recorder = IRRecorder(pigpio.pi(), 18)
+    recorder.start()
+    records = recorder.record_batch(["KEY_POWER", "KEY_OK"])
+    recorder.stop()
+    save_records(records, "insignia_commands.irc")
+"""
+import json
+import logging
+import os
+import threading
+
+from queue import Empty, Queue
+
+import pigpio
+
+from ir_transmitter.code_store import CodeStore, load_codes
+from ir_transmitter.ir_learning import DEFAULT_TOLERANCE, compare, normalise, tidy
+
+
+logger = logging.getLogger("ir_transmitter.ir_recorder")
+
+# Every notification report is a uint16 sequence number, uint16 flags, uint32 tick and uint32 levels.
+REPORT_SIZE = 12
+NTFY_FLAGS_WDOG = 1 << 5
+NTFY_FLAGS_ALIVE = 1 << 6
+
+
+class IRRecorder(object):
+    def __init__(self, pi, gpio, glitch=100, pre_ms=200, post_ms=15, short=10, tolerance=DEFAULT_TOLERANCE,
+                 buffer_reports=4096):
+        """
+
+        :type pi: pigpio.pi
+        :param gpio: The GPIO connected to the IR receiver.
+        :type gpio: int
+        :param glitch: Ignore edges shorter than this many microseconds.
+        :type glitch: int
+        :param pre_ms: Silence expected before a code starts.
+        :type pre_ms: int
+        :param post_ms: Silence that marks the end of a code.
+        :type post_ms: int
+        :param short: Codes with this many pulses or less are discarded as repeats.
+        :type short: int
+        :param tolerance: Percentage two pulses may differ by and still count as the same.
+        :type tolerance: float
+        :param buffer_reports: Number of notification reports read from the pipe at a time.
+        :type buffer_reports: int
+        """
+        self.pi = pi
+        self.gpio = gpio
+        self.glitch = glitch
+        self.pre_us = pre_ms * 1000
+        self.post_ms = post_ms
+        self.post_us = post_ms * 1000
+        self.short = short
+        self.tolerance = tolerance
+
+        self.buffer = bytearray(buffer_reports * REPORT_SIZE)
+        self.codes = Queue()
+        self.handle = None
+        self.pipe = None
+        self.running = False
+        self.reader_thread = None
+
+        self.last_tick = 0
+        self.in_code = False
+        self.code = []
+
+    def start(self):
+        self.pi.set_mode(self.gpio, pigpio.INPUT)
+        self.pi.set_glitch_filter(self.gpio, self.glitch)
+
+        self.handle = self.pi.notify_open()
+        self.pipe = open("/dev/pigpio{0}".format(self.handle), "rb", buffering=0)
+        self.pi.notify_begin(self.handle, 1 << self.gpio)
+
+        self.running = True
+        self.reader_thread = threading.Thread(target=self.run, name="ir-recorder")
+        self.reader_thread.daemon = True
+        self.reader_thread.start()
+
+    def stop(self):
+        self.running = False
+        self.pi.set_watchdog(self.gpio, 0)
+        self.pi.set_glitch_filter(self.gpio, 0)
+
+        if self.handle is not None:
+            # Closing the notification ends the pipe, which wakes the reader thread up.
+            self.pi.notify_close(self.handle)
+            self.handle = None
+
+        if self.reader_thread:
+            self.reader_thread.join(1.0)
+
+        if self.pipe:
+            self.pipe.close()
+            self.pipe = None
+
+    def run(self):
+        view = memoryview(self.buffer)
+        # Reports are three uint32 words: seqno | flags << 16, tick, levels.
+        words = view.cast("I")
+        pending = 0
+
+        while self.running:
+            try:
+                count = self.pipe.readinto(view[pending:])
+            except (OSError, ValueError):
+                break
+
+            if not count:
+                break
+
+            pending += count
+            complete = pending - pending % REPORT_SIZE
+
+            for report in range(0, complete // 4, 3):
+                self._handle_report(words[report] >> 16, words[report + 1], words[report + 2])
+
+            # Keep any partial report at the front of the buffer for the next read.
+            self.buffer[:pending - complete] = self.buffer[complete:pending]
+            pending -= complete
+
+    def next_code(self, timeout=None):
+        """
+        Wait for the next complete code.
+
+        :param timeout: Seconds to wait, or None to wait forever.
+        :type timeout: Union[float, None]
+        :return: The code's normalised mark/space lengths, or None if the timeout expired.
+        :rtype: Union[list[float], None]
+        """
+        try:
+            return self.codes.get(timeout=timeout)
+        except Empty:
+            return None
+
+    def clear(self):
+        while not self.codes.empty():
+            self.codes.get_nowait()
+
+    def record(self, key, confirm=True, tries=3, prompt=print, timeout=None):
+        """
+        Record a single key, optionally asking for it to be pressed again to confirm the recording.
+
+        :type key: str
+        :param confirm: Require a second press that matches the first.
+        :type confirm: bool
+        :param tries: Number of confirmation presses allowed to not match before giving up.
+        :type tries: int
+        :param prompt: Called with the instructions for the user.
+        :type prompt: callable
+        :param timeout: Seconds to wait for each press.
+        :type timeout: Union[float, None]
+        :return: The code, or None if it couldn't be recorded.
+        :rtype: Union[list[int], None]
+        """
+        self.clear()
+        prompt("Press key for '{0}'".format(key))
+        press_1 = self.next_code(timeout)
+
+        if press_1 is None:
+            prompt("No code received for '{0}'".format(key))
+            return None
+
+        if not confirm:
+            return press_1
+
+        for _ in range(tries + 1):
+            prompt("Press key for '{0}' to confirm".format(key))
+            press_2 = self.next_code(timeout)
+
+            if press_2 is not None and compare(press_1, press_2, self.tolerance):
+                prompt("Okay")
+                return press_1
+
+            prompt("No match")
+
+        prompt("Giving up on key '{0}'".format(key))
+        return None
+
+    def record_batch(self, keys, confirm=True, prompt=print, timeout=None):
+        """
+        Record several keys in one session, then tidy them onto a shared set of pulse lengths.
+
+        :type keys: list[str]
+        :rtype: dict[str, list[int]]
+        """
+        records = {}
+
+        for key in keys:
+            code = self.record(key, confirm, prompt=prompt, timeout=timeout)
+
+            if code is not None:
+                records[key] = code
+
+        tidy(records, self.tolerance)
+        return records
+
+    def _handle_report(self, flags, tick, levels):
+        if flags & NTFY_FLAGS_ALIVE:
+            return
+
+        if flags & NTFY_FLAGS_WDOG:
+            self.pi.set_watchdog(self.gpio, 0)
+
+            if self.in_code:
+                self.in_code = False
+                self._end_of_code()
+
+            return
+
+        edge = pigpio.tickDiff(self.last_tick, tick)
+        self.last_tick = tick
+
+        if edge > self.pre_us and not self.in_code:  # Start of a code.
+            self.in_code = True
+            self.code = []
+            self.pi.set_watchdog(self.gpio, self.post_ms)
+        elif edge > self.post_us and self.in_code:  # End of a code.
+            self.in_code = False
+            self.pi.set_watchdog(self.gpio, 0)
+            self._end_of_code()
+        elif self.in_code:
+            self.code.append(edge)
+
+    def _end_of_code(self):
+        code, self.code = self.code, []
+
+        if len(code) > self.short:
+            normalise(code, self.tolerance)
+            self.codes.put(code)
+        else:
+            logger.info("Short code, probably a repeat, try again")
+
+
+def save_records(records, filepath, merge_from=None, tolerance=DEFAULT_TOLERANCE):
+    """
+    Merge recorded codes into a code file, a binary code store if it ends in .irc or JSON otherwise.
+
+    The new codes are tidied together with the existing ones, so a mark or space ends up with the same length in
+    every code in the file.
+
+    :type records: dict[str, list[int]]
+    :type filepath: str
+    :param merge_from: File holding the existing codes, if not filepath itself (e.g. a backup of it).
+    :type merge_from: Union[str, None]
+    :param tolerance: Percentage two pulses may differ by and still count as the same.
+    :type tolerance: float
+    """
+    merge_from = merge_from or filepath
+    merged = {}
+
+    if os.path.exists(merge_from):
+        existing = load_codes(merge_from)
+        merged.update((name, list(existing[name])) for name in existing)
+
+    merged.update((name, list(code)) for name, code in records.items())
+    tidy(merged, tolerance)
+
+    if filepath.endswith(".irc"):
+        CodeStore.from_records(merged).save(filepath)
+    else:
+        with open(filepath, "w") as code_file:
+            code_file.write(json.dumps(merged, sort_keys=True).replace("],", "],\n") + "\n")
@@ -1,80 +1,212 @@
-import json
 import pigpio
 import time
-import subprocess
 import logging
 import sys
-import threading
+
+from ir_transmitter.code_store import load_codes
+from ir_transmitter.gap_scheduler import GapScheduler
+from ir_transmitter.hdmi_monitor import TVServiceMonitor, query_power
+from ir_transmitter.metrics import (GAP_WAIT_SECONDS, POWER_WAIT_SECONDS, TRANSITION_KEYS, TRANSITION_SECONDS,
+                                    TRANSITIONS, TRANSMIT_SECONDS)
+from ir_transmitter.nec import FRAME_PERIOD
+from ir_transmitter.pigpio_transport import PigpioTransport, is_bad_wave_id
+from ir_transmitter.power_state import PowerStateTracker
+from ir_transmitter.state_store import StateStore
+from ir_transmitter.transition_planner import (DISPLAY_MODE, DISPLAY_MODE_KEYS, POWER_ON, RECALIBRATE, VOLUME,
+                                               TransitionPlanner, TVState)
+from ir_transmitter.wave_cache import WaveCache, carrier
 
 
 logger = logging.getLogger("ir_transmitter")
 
+# Seconds the Insignia needs after each key before it reliably takes the next one.  Opening or closing the menu
+# takes longest, moving around it less and the volume menu only needs a short pause between presses.
+INSIGNIA_GAP_PROFILES = {
+    "KEY_MENU": 0.5,
+    "KEY_UP": 0.25,
+    "KEY_DOWN": 0.25,
+    "KEY_LEFT": 0.25,
+    "KEY_RIGHT": 0.25,
+    "KEY_OK": 0.25,
+    "KEY_EXIT": 1.0,
+    "KEY_VOLUME_UP": 0.1,
+    "KEY_VOLUME_DOWN": 0.1,
+}
+
+
+def wait_for_transmit(transport, micros):
+    """
+    Wait for the current wave chain to finish, given how long it's expected to take.
+
+    Sleeping through the known duration means pigpio is only asked whether it's done once or twice at the end,
+    instead of being polled for the whole transmission.
+    """
+    start = time.time()
+
+    if micros:
+        time.sleep(micros / 1000000.0)
+
+    while transport.wave_tx_busy():
+        time.sleep(0.001)
+
+    logger.debug("Transmission finished {0:.1f}ms after it was expected to".format(
+        (time.time() - start) * 1000 - micros / 1000.0))
+
 
 class IRTransmitter(object):
-    def __init__(self, command_filepath, output_pin=17, frequency=38.0, gap_seconds=100):
+    def __init__(self, command_filepath, output_pin=17, frequency=38.0, gap_seconds=0.1, gap_profiles=None, pi=None,
+                 clear_waves=False):
+        """
+
+        :param gap_seconds: Minimum seconds between the end of one key and the start of the next.
+        :type gap_seconds: float
+        :param gap_profiles: Minimum gaps for specific commands, overriding gap_seconds.
+        :type gap_profiles: dict[str, float]
+        :param pi: Connection to pigpiod to use instead of opening a new one, e.g. a fake_pigpio.FakePi.
+        :type pi: pigpio.pi
+        :param clear_waves: Delete every wave on pigpiod at startup, including other clients' waves.  Only for the
+            process that owns the daemon.
+        :type clear_waves: bool
+        """
         self.output_pin = output_pin
-        self.pi = pigpio.pi()
+        self.pi = pi if pi is not None else pigpio.pi()
 
-        with open(command_filepath) as command_file:
-            self.commands = json.load(command_file)
+        self.commands = load_codes(command_filepath)
 
         self.pi.set_mode(self.output_pin, pigpio.OUTPUT)
         self.frequency = frequency
         self.gap_seconds = gap_seconds
+        self.scheduler = GapScheduler(gap_seconds, gap_profiles)
+        self.transport = PigpioTransport(self.pi)
+        self.wave_cache = WaveCache(self.pi, self.output_pin, self.frequency, transport=self.transport,
+                                    clear_daemon=clear_waves)
+        # Running count of key presses sent, for progress reporting.
+        self.keys_sent = 0
+
+    def transmit(self, command, end_delay=None):
+        """
 
-    def transmit(self, command, end_delay=0.1):
+        :type command: str
+        :param end_delay: Minimum seconds before the next key, instead of the command's gap profile.
+        :type end_delay: Union[float, None]
+        """
         if command not in self.supported_commands():
             raise KeyError("Given command not supported!")
 
-        code = self.commands[command]
-        self.pi.wave_add_new()
-        emit_time = time.time()
+        try:
+            wave = self.wave_cache.chain(command, self.commands[command])
+        except pigpio.error:
+            logger.exception("Failed to generate IR waveform for command: " + command)
+            raise
+
+        GAP_WAIT_SECONDS.observe(self.scheduler.wait())
+        start = time.monotonic()
+        self._send_chain(wave, lambda: self.wave_cache.chain(command, self.commands[command]))
+        self._wait_for_transmit(sum(self.commands[command]))
+        TRANSMIT_SECONDS.observe(time.monotonic() - start, command=command)
+        self.keys_sent += 1
+        self.scheduler.emitted(command, end_delay)
+
+    def transmit_sequence(self, sequence):
+        """
+        Transmit several keys as a single wave chain, letting pigpio handle the gaps between them.
+
+        Sequences too long for one chain, or using more distinct waves than pigpio has room for at once, are sent as
+        several chains back to back, each built once the one before it has finished.
+        The gap after the last key isn't part of the chain, it's left to the scheduler like any other key's.
+
+        :param sequence: Commands, or (command, gap in milliseconds after the key) pairs, in the order they're sent.
+            A gap of None uses the command's gap profile.
+        :type sequence: list[Union[str, tuple[str, Union[float, None]]]]
+        """
+        sequence = [(item, None) if isinstance(item, str) else item for item in sequence]
+
+        for command, _ in sequence:
+            if command not in self.supported_commands():
+                raise KeyError("Given command not supported: " + command)
+
+        if not sequence:
+            return
 
-        marks_wid = {}
-        spaces_wid = {}
+        gaps = [self.scheduler.gap(command) if gap_ms is None else gap_ms / 1000.0 for command, gap_ms in sequence]
+        steps = [(command, self.commands[command], int(round(gap * 1000000)))
+                 for (command, _), gap in zip(sequence, gaps)]
+        steps[-1] = steps[-1][:2] + (0,)
 
-        wave = [0] * len(code)
+        start = None
 
-        for i in range(0, len(code)):
-            ci = code[i]
+        for group in self.wave_cache.sequence(steps):
+            try:
+                wave, micros = self.wave_cache.sequence_chain(group)
+            except pigpio.error:
+                logger.exception("Failed to generate IR waveforms for sequence: " + str(sequence))
+                raise
 
-            if i & 1:
-                if ci not in spaces_wid:
-                    self.pi.wave_add_generic([pigpio.pulse(0, 0, ci)])
-                    spaces_wid[ci] = self.pi.wave_create()
+            if start is None:
+                GAP_WAIT_SECONDS.observe(self.scheduler.wait())
+                start = time.monotonic()
 
-                wave[i] = spaces_wid[ci]
-            else:
-                if ci not in marks_wid:
-                    wf = self.carrier(self.frequency, ci)
-                    self.pi.wave_add_generic(wf)
+            self._send_chain(wave, lambda: self.wave_cache.sequence_chain(group)[0])
+            self._wait_for_transmit(micros)
 
-                    try:
-                        marks_wid[ci] = self.pi.wave_create()
-                    except pigpio.error as err:
-                        logger.exception("Failed to generate IR waveform for command: "
-                                         + command + " - waveform was: " + str(wf), err)
+        TRANSMIT_SECONDS.observe(time.monotonic() - start, command="sequence")
 
-                wave[i] = marks_wid[ci]
+        self.keys_sent += len(sequence)
+        self.scheduler.emitted(sequence[-1][0], gaps[-1])
 
-        delay = emit_time - time.time()
+    def hold(self, command, repeats, end_delay=None):
+        """
+        Transmit a key as if it was held down on the remote: one full frame followed by the given number of
+        repeat frames, all in a single wave chain.
 
-        if delay > 0.0:
-            time.sleep(delay)
+        Code sets without a dedicated repeat frame (anything but NEC) repeat the full frame instead.
 
-        self.pi.wave_chain(wave)
+        :type command: str
+        :param repeats: Number of repeat frames to send after the first frame.
+        :type repeats: int
+        :param end_delay: Minimum seconds before the next key, instead of the command's gap profile.
+        :type end_delay: Union[float, None]
+        """
+        if command not in self.supported_commands():
+            raise KeyError("Given command not supported!")
 
-        while self.pi.wave_tx_busy():
-            time.sleep(0.002)
+        code = self.commands[command]
+        repeat_code = self.commands.repeat() if hasattr(self.commands, "repeat") else code
+        period = getattr(self.commands, "frame_period", FRAME_PERIOD)
+
+        try:
+            wave = self.wave_cache.held(command, code, repeat_code, repeats, period)
+        except pigpio.error:
+            logger.exception("Failed to generate IR waveform for held command: " + command)
+            raise
+
+        GAP_WAIT_SECONDS.observe(self.scheduler.wait())
+        start = time.monotonic()
+        self._send_chain(wave, lambda: self.wave_cache.held(command, code, repeat_code, repeats, period))
+        self._wait_for_transmit(period * (repeats + 1))
+        TRANSMIT_SECONDS.observe(time.monotonic() - start, command=command + ":held")
+        self.keys_sent += 1
+        self.scheduler.emitted(command, end_delay)
+
+    def _send_chain(self, wave, rebuild):
+        """
+        Send a wave chain, rebuilding it once if pigpiod no longer has some of its waves.
 
-        for i in marks_wid:
-            self.pi.wave_delete(marks_wid[i])
+        :param rebuild: Builds the chain again from scratch.
+        :type rebuild: callable
+        """
+        try:
+            self.transport.wave_chain(wave)
+        except pigpio.error as e:
+            if not is_bad_wave_id(e):
+                raise
 
-        for i in spaces_wid:
-            self.pi.wave_delete(spaces_wid[i])
+            logger.warning("pigpiod lost waves from the wave cache, e.g. another client cleared them, rebuilding")
+            self.wave_cache.clear(delete=False)
+            self.transport.wave_chain(rebuild())
 
-        if end_delay:
-            time.sleep(end_delay)
+    def _wait_for_transmit(self, micros):
+        wait_for_transmit(self.transport, micros)
 
     def supported_commands(self):
         return self.commands.keys()
@@ -83,50 +215,76 @@ class IRTransmitter(object):
         """
         Generate carrier square wave.
         """
-        wf = []
-        cycle = 1000.0 / frequency
-        cycles = int(round(micros / cycle))
-        on = int(round(cycle / 2.0))
-        sofar = 0
-
-        for c in range(cycles):
-            target = int(round((c + 1) * cycle))
-            sofar += on
-            off = target - sofar
-            sofar += off
-            wf.append(pigpio.pulse(1 << self.output_pin, 0, on))
-            wf.append(pigpio.pulse(0, 1 << self.output_pin, off))
-
-        return wf
+        return carrier(self.output_pin, frequency, micros)
 
 
 class InsigniaController(IRTransmitter):
-    def __init__(self, command_file, bedtime_volume=15, daytime_volume=25, pc_hostname="IAN-DESKTOP:8080"):
-        IRTransmitter.__init__(self, command_file)
+    def __init__(self, command_file, bedtime_volume=15, daytime_volume=25, pc_hostname="IAN-DESKTOP:8080",
+                 volume_hold_delay=4, volume_repeats_per_step=2, volume_press_limit=4, power_timeout=30,
+                 recalibrate_interval=24 * 60 * 60, state_file=None, state_max_age=24 * 60 * 60, pi=None,
+                 clear_waves=False):
+        """
 
-        self.powered = False
+        :param volume_hold_delay: Repeat frames the TV lets go by after the first frame of a held volume key before
+            it starts auto-repeating.
+        :type volume_hold_delay: int
+        :param volume_repeats_per_step: Repeat frames per volume step once the TV is auto-repeating.
+        :type volume_repeats_per_step: int
+        :param volume_press_limit: Volume changes of up to this many steps are made with separate presses, which
+            move the volume exactly one step each, rather than by holding the key.
+        :type volume_press_limit: int
+        :param recalibrate_interval: Seconds between recalibrating the volume down to 0 even when the tracked volume
+            is trusted, or None to only recalibrate when it isn't.
+        :type recalibrate_interval: Union[float, None]
+        :param state_file: File the tracked state is saved to after every change and restored from at startup.
+        :type state_file: Union[str, None]
+        :param state_max_age: Seconds after which a saved state is too old to restore.
+        :type state_max_age: float
+        """
+        IRTransmitter.__init__(self, command_file, gap_profiles=INSIGNIA_GAP_PROFILES, pi=pi,
+                               clear_waves=clear_waves)
+
+        self.power_state = PowerStateTracker()
+        # How long to wait for tvservice to report each power transition before giving up on it.
+        self.power_timeout = power_timeout
         self.display_mode = "STANDARD"
         self.bedtime_volume = bedtime_volume
         self.daytime_volume = daytime_volume
-        self.batch_volume_increase = False
-        self.last_powered_state_change = time.time()
+        # How the TV auto-repeats a held volume key.  The defaults are a typical half second delay and 4-5 steps a
+        # second at NEC's 108ms frame period, not measured on this set, so held changes aren't trusted until they
+        # are: time a held key on the TV and set both through update_configuration().
+        self.volume_hold_delay = volume_hold_delay
+        self.volume_repeats_per_step = volume_repeats_per_step
+        self.volume_press_limit = volume_press_limit
         self.api_url = "http://{0}/api/".format(pc_hostname)
         self.initialized = False
+        # What the controller is currently doing, for progress reporting.
+        self.step = None
 
         # Assume that the volume will never exceed daytime max and we're going to set it to 0
         self.current_volume = self.daytime_volume
+        # Whether current_volume is believed to match the TV, and when it was last made to by recalibrating.
+        self.trusted = False
+        self.last_calibrated = None
+        self.planner = TransitionPlanner(recalibrate_interval)
+        self.state_store = StateStore(state_file) if state_file else None
+        self.state_max_age = state_max_age
 
-        self.monitor_thread = threading.Thread(target=self._monitor_hdmi_events)
+        self.hdmi_monitor = TVServiceMonitor(self.power_state.update)
 
     def initialize(self):
-        self.monitor_thread.start()
-        self.power_on()
-        self.set_volume(0)
+        self.hdmi_monitor.start()
+
+        if not self.restore_state():
+            self.power_on()
+            self.recalibrate()
 
         logger.info("InsigniaController initialized and ready for commands!")
         self.initialized = True
 
     def power_on(self):
+        self.step = "power_on"
+
         # Iterate this twice in the hopes that the tvservice monitor will update with the current tv state
         #  And then if we actually turned it off we know to turn it on again.
         if not self.powered:
@@ -137,141 +295,260 @@ class InsigniaController(IRTransmitter):
             logger.info("turning the power on second pass - not sure if it's on or not")
             self._power_cycle()
 
+    @property
+    def powered(self):
+        return self.power_state.powered
+
+    @property
+    def last_powered_state_change(self):
+        return self.power_state.last_change
+
+    def wait_for_power(self, state, timeout=None):
+        return self.power_state.wait_for_power(state, timeout)
+
     def _power_cycle(self):
-        last_powered_state_change = self.last_powered_state_change
+        changes = self.power_state.changes
+
+        self.save_state(dirty=True)
+        self.transmit("KEY_POWER")
+
+        start = time.monotonic()
+        outcome = self._wait_for_power_cycle(changes)
+        POWER_WAIT_SECONDS.observe(time.monotonic() - start, outcome=outcome)
+
+        if outcome == "on":
+            # Give it 5 seconds before the next key just to make sure it really is all good.
+            self.scheduler.hold_off(5)
+        elif outcome == "off":
+            self.scheduler.hold_off(10)
 
-        self.transmit("KEY_POWER", .1)
+        self.save_state()
 
-        while last_powered_state_change == self.last_powered_state_change:
-            time.sleep(.1)
+    def _wait_for_power_cycle(self, changes):
+        """
+        :return: "on" or "off" once tvservice reports the TV settled after pressing power, or "timeout".
+        :rtype: str
+        """
+        if not self.power_state.wait_for_change(changes, self.power_timeout):
+            logger.warning("tvservice didn't report a power change within {0} seconds of pressing power".format(
+                self.power_timeout))
+            return "timeout"
 
-        if self.powered:
-            # When the tv comes on, the expected state change is on - off - on and then the tv is ready for input
-            last_powered_state_change = self.last_powered_state_change
+        if not self.powered:
+            return "off"
 
-            while last_powered_state_change == self.last_powered_state_change:
-                time.sleep(.1)
+        # When the tv comes on, the expected state change is on - off - on and then the tv is ready for input
+        if not self.power_state.wait_for_change(changes + 1, self.power_timeout):
+            logger.warning("tvservice didn't report the tv turning off again after it came on")
+            return "timeout"
 
-            assert not self.powered
+        if not self.power_state.wait_for_power(True, self.power_timeout):
+            logger.warning("tvservice didn't report the tv coming back on after it turned off")
+            return "timeout"
 
-            last_powered_state_change = self.last_powered_state_change
+        return "on"
 
-            while last_powered_state_change == self.last_powered_state_change:
-                time.sleep(.1)
+    def hdmi_events(self, since=None):
+        return self.hdmi_monitor.events(since)
 
-            assert self.powered
+    def set_volume(self, volume):
+        if self.current_volume == volume:
+            logger.info("Volume is already set to given value, nothing to do.")
+            return
 
-            # sleep for 5 seconds just to make sure it really is all good.
-            time.sleep(5)
+        if self.current_volume > volume:
+            logger.info("We're over the target volume, decreasing. Current Volume: {0}, Target Volume: {1}".format(
+                self.current_volume, volume))
+            key = "KEY_VOLUME_DOWN"
+        else:
+            logger.info("We're under the target volume, increasing. Current Volume: {0}, Target Volume: {1}".format(
+                self.current_volume, volume))
+            key = "KEY_VOLUME_UP"
+
+        self.step = "set_volume {0}".format(volume)
+        steps = abs(self.current_volume - volume)
+        self.save_state(dirty=True)
+
+        # The first press just brings up the volume menu.  The menu then stays up for a few seconds and swallows
+        # the next key.
+        if volume == 0:
+            # The TV stops at 0, so holding the key for twice as long as it should take lands on 0 exactly.
+            self.hold(key, 2 * self._volume_hold_repeats(steps), end_delay=4)
+        elif steps <= self.volume_press_limit:
+            self.transmit_sequence([(key, None)] * steps + [(key, 4000)])
         else:
-            assert not self.powered
-            time.sleep(10)
+            self.hold(key, self._volume_hold_repeats(steps), end_delay=4)
+            # How far a held key moves the volume depends on the TV's auto-repeat timing, so don't rely on it
+            # until the next recalibration.
+            logger.info("Volume set by holding the key, it's no longer trusted")
+            self.trusted = False
 
-    def _monitor_hdmi_events(self):
-        logger.info("Beginning tvservice monitor process thread")
-        args = ["tvservice", "-M"]
-        process = subprocess.Popen(args, shell=False, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        self.current_volume = volume
+        self.save_state()
 
-        while True:
-            data = process.stdout.readline().decode("ascii").lower()
+    def _volume_hold_repeats(self, steps):
+        return self.volume_hold_delay + steps * self.volume_repeats_per_step
 
-            if data and data.startswith("["):
-                if "cable is unplugged" in data:
-                    logger.info("tvservice reported the tv turned off")
-                    self.powered = False
-                    self.last_powered_state_change = time.time()
-                elif "is attached" in data:
-                    logger.info("tvservice reported the tv turned on")
-                    self.powered = True
-                    self.last_powered_state_change = time.time()
-                else:
-                    logger.info("Found unexpected tvservice monitor message: " + data)
+    def recalibrate(self):
+        """
+        Drive the volume down to 0 from as high as it could plausibly be, so the tracked volume is known again.
+        """
+        self.current_volume = max(self.current_volume, self.daytime_volume)
+        self.set_volume(0)
+        self.trusted = True
+        self.last_calibrated = time.monotonic()
+        self.save_state()
 
-            time.sleep(.1)
+    def invalidate(self):
+        """
+        Stop trusting the tracked volume, e.g. after the remote has been used, so the next transition recalibrates.
+        """
+        self.trusted = False
+        self.save_state()
 
-    def increase_volume(self):
-        if not self.batch_volume_increase:
-            # The first volume key press just brings up the volume menu,
-            # so if this isn't a batch volume increase we have to press the key twice.
-            self.transmit("KEY_VOLUME_UP", 0.5)
+    def save_state(self, dirty=False):
+        """
+        Snapshot the tracked state.
 
-        self.transmit("KEY_VOLUME_UP", 0.1)
+        :param dirty: Save it as untrusted, before starting to change the TV, so that if the process dies part way
+            through the change the next run recalibrates rather than trusting the old state.
+        :type dirty: bool
+        """
+        if self.state_store is None:
+            return
 
-        self.current_volume += 1
+        now = time.time()
+        calibrated_at = None
 
-    def decrease_volume(self):
-        if not self.batch_volume_increase:
-            # The first volume key press just brings up the volume menu,
-            # so if this isn't a batch volume increase we have to press the key twice.
-            self.transmit("KEY_VOLUME_DOWN", 0.5)
+        if self.last_calibrated is not None:
+            # Monotonic times don't survive a reboot, so store the wall clock time instead.
+            calibrated_at = now - (time.monotonic() - self.last_calibrated)
 
-        self.transmit("KEY_VOLUME_DOWN", 0.1)
+        try:
+            self.state_store.save({"saved": now,
+                                   "powered": self.powered,
+                                   "volume": self.current_volume,
+                                   "display_mode": self.display_mode,
+                                   "trusted": self.trusted and not dirty,
+                                   "calibrated_at": calibrated_at})
+        except (OSError, ValueError):
+            logger.exception("Failed to save controller state")
 
-        self.current_volume -= 1
+    def restore_state(self):
+        """
+        Pick up the tracked state from the last run, as long as it's recent and tvservice agrees about the power.
 
-    def set_volume(self, volume):
-        self.batch_volume_increase = True
+        :return: False if there was no usable state, meaning the TV needs powering on and recalibrating.
+        :rtype: bool
+        """
+        if self.state_store is None:
+            return False
 
-        if self.current_volume == volume:
-            logger.info("Volume is already set to given value, nothing to do.")
-            return
+        snapshot = self.state_store.load()
 
-        if self.current_volume > volume:
-            message = "We're over the target volume, decreasing. Current Volume: {0}, Target Volume: {1}"
-            step_function = self.decrease_volume
-            # Send a volume_down without decreasing the current volume counter
-            self.current_volume += 1
-            self.decrease_volume()
-            time.sleep(.5)
-        else:
-            message = "We're under the target volume, increasing. Current Volume: {0}, Target Volume: {1}"
-            step_function = self.increase_volume
-            # Send a volume_up without increasing the current volume counter
-            self.current_volume -= 1
-            self.increase_volume()
-            time.sleep(.5)
+        if snapshot is None:
+            logger.info("No saved controller state, recalibrating")
+            return False
 
-        while self.current_volume != volume:
-            logger.debug(message.format(self.current_volume, volume))
-            step_function()
+        now = time.time()
+        age = now - snapshot["saved"]
 
-        self.batch_volume_increase = False
+        if not 0 <= age <= self.state_max_age:
+            logger.info("Saved controller state is {0:.0f} seconds old, recalibrating".format(age))
+            return False
 
-        time.sleep(4)
+        powered = query_power()
 
-    def daytime(self):
-        self.power_on()
-        self.set_volume(0)
+        if powered is not None and powered != snapshot["powered"]:
+            logger.info("tvservice says the tv is {0} but the saved state says otherwise, recalibrating".format(
+                "on" if powered else "off"))
+            return False
 
-        if self.display_mode == "CUSTOM":
-            self.transmit("KEY_MENU", .5)
-            self.transmit("KEY_DOWN", .25)
-            self.transmit("KEY_OK", .25)
-            self.transmit("KEY_UP", .25)
-            self.transmit("KEY_OK", .25)
-            self.transmit("KEY_EXIT", 1)
-            self.display_mode = "STANDARD"
+        self.power_state.update(snapshot["powered"] if powered is None else powered)
+        self.current_volume = snapshot["volume"]
+        self.trusted = snapshot["trusted"]
+        # An untrusted snapshot may have been saved just before a display mode change that never finished, so the
+        # next transition sets the display mode whatever it was.
+        self.display_mode = snapshot["display_mode"] if self.trusted else None
 
-        self.set_volume(self.daytime_volume)
+        if snapshot["calibrated_at"] is not None:
+            self.last_calibrated = time.monotonic() - (now - snapshot["calibrated_at"])
 
-    def bedtime(self):
-        self.power_on()
-        self.set_volume(0)
+        logger.info("Restored controller state from {0:.0f} seconds ago: {1}".format(age, self.state))
+        return True
+
+    @property
+    def state(self):
+        return TVState(self.powered, self.current_volume, self.display_mode)
 
-        if self.display_mode == "STANDARD":
-            self.transmit("KEY_MENU", .5)
-            self.transmit("KEY_DOWN", .25)
-            self.transmit("KEY_OK", .25)
-            self.transmit("KEY_DOWN", .25)
-            self.transmit("KEY_OK", .25)
-            self.transmit("KEY_EXIT", 1)
-            self.display_mode = "CUSTOM"
+    def set_display_mode(self, display_mode):
+        self.step = "display_mode {0}".format(display_mode)
+        self.save_state(dirty=True)
+        self.transmit_sequence(DISPLAY_MODE_KEYS[display_mode])
+
+        if self.display_mode is None:
+            # The menu keys only switch from the other mode, so from an unknown one they may land anywhere.
+            logger.warning("Sent the {0} display mode keys without knowing the display mode, it stays unknown until "
+                           "it's set through the configuration".format(display_mode))
+            self.trusted = False
+        else:
+            self.display_mode = display_mode
 
-        self.set_volume(self.bedtime_volume)
+        self.save_state()
+
+    def transition(self, target, name="transition"):
+        """
+        Take the TV to the target state with as few keys as possible.
+
+        :type target: TVState
+        :param name: What to call the transition in the metrics.
+        :type name: str
+        """
+        start = time.monotonic()
+        keys_sent = self.keys_sent
+        plan = self.planner.plan(self.state, target, self.trusted, self.last_calibrated, time.monotonic())
+
+        if plan:
+            self.save_state(dirty=True)
+
+        try:
+            for step in plan:
+                if step.action == POWER_ON:
+                    self.power_on()
+                elif step.action == RECALIBRATE:
+                    self.recalibrate()
+                elif step.action == DISPLAY_MODE:
+                    self.set_display_mode(step.value)
+                elif step.action == VOLUME:
+                    self.set_volume(step.value)
+        except Exception:
+            # Part of the plan may or may not have reached the TV.
+            self.invalidate()
+            raise
+        finally:
+            TRANSITIONS.inc(transition=name)
+            TRANSITION_KEYS.inc(self.keys_sent - keys_sent, transition=name)
+            TRANSITION_SECONDS.observe(time.monotonic() - start, transition=name)
+
+    def daytime(self):
+        self.transition(TVState(True, self.daytime_volume, "STANDARD"), "daytime")
+
+    def bedtime(self):
+        self.transition(TVState(True, self.bedtime_volume, "CUSTOM"), "bedtime")
 
     def update_configuration(self, configuration_data):
         self.bedtime_volume = configuration_data.get("bedtime_volume", self.bedtime_volume)
         self.daytime_volume = configuration_data.get("daytime_volume", self.daytime_volume)
+        self.volume_hold_delay = configuration_data.get("volume_hold_delay", self.volume_hold_delay)
+        self.volume_repeats_per_step = configuration_data.get("volume_repeats_per_step", self.volume_repeats_per_step)
+
+        if "display_mode" in configuration_data:
+            # Someone has looked at the TV and says what mode it's really in.
+            if configuration_data["display_mode"] not in DISPLAY_MODE_KEYS:
+                raise KeyError("Unknown display mode: " + str(configuration_data["display_mode"]))
+
+            self.display_mode = configuration_data["display_mode"]
+            self.save_state()
 
         logger.info("Volume settings after config update:")
         logger.info("Bedtime volume: {0}".format(self.bedtime_volume))
@@ -281,5 +558,5 @@ class InsigniaController(IRTransmitter):
 if __name__ == "__main__":
     logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
 
-    controller = InsigniaController("insignia_commands.json")
+    controller = InsigniaController("insignia_nec.json")
     controller.bedtime()
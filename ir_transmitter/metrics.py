@@ -0,0 +1,207 @@
+"""
+Minimal Prometheus style metrics, rendered in the text exposition format.
+
+Only what the controller needs: counters, histograms and gauges read from a function at scrape time, all with
+optional labels.  Updating a metric is a dictionary lookup and a few additions under a lock, so it's cheap enough
+for the IR hot paths, and nothing beyond the standard library is needed on the Pi.
+"""
+import threading
+
+from bisect import bisect_left
+from collections import OrderedDict
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+
+    if not pairs:
+        return ""
+
+    return "{" + ",".join("{0}=\"{1}\"".format(name, _escape(value)) for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+
+    if isinstance(value, int):
+        return str(value)
+
+    return repr(float(value))
+
+
+class Metric(object):
+    TYPE = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self.lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.label_names):
+            raise ValueError("{0} takes labels {1}, got {2}".format(self.name, self.label_names, sorted(labels)))
+
+        return tuple(labels[name] for name in self.label_names)
+
+    def samples(self):
+        """
+        :return: (suffix, label values, extra labels, value) for every sample.
+        :rtype: list[tuple[str, tuple, tuple, float]]
+        """
+        raise NotImplementedError()
+
+    def render(self):
+        lines = ["# HELP {0} {1}".format(self.name, self.documentation.replace("\\", "\\\\").replace("\n", "\\n")),
+                 "# TYPE {0} {1}".format(self.name, self.TYPE)]
+
+        for suffix, values, extra, value in self.samples():
+            lines.append("{0}{1}{2} {3}".format(self.name, suffix, _format_labels(self.label_names, values, extra),
+                                                _format_value(value)))
+
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    TYPE = "counter"
+
+    def __init__(self, name, documentation, labels=()):
+        Metric.__init__(self, name, documentation, labels)
+        self.values = OrderedDict()
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            return [("", key, (), value) for key, value in self.values.items()]
+
+
+class Gauge(Metric):
+    """
+    A value read from a function whenever the metrics are rendered, e.g. how much of pigpio's wave memory is used.
+    """
+    TYPE = "gauge"
+
+    def __init__(self, name, documentation, function):
+        Metric.__init__(self, name, documentation)
+        self.function = function
+
+    def samples(self):
+        return [("", (), (), self.function())]
+
+
+class Histogram(Metric):
+    TYPE = "histogram"
+
+    def __init__(self, name, documentation, buckets, labels=()):
+        Metric.__init__(self, name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        self.values = OrderedDict()
+        """ :type: OrderedDict[tuple, list]"""
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        # Counts are kept per bucket and only made cumulative when rendered.
+        index = bisect_left(self.buckets, value)
+
+        with self.lock:
+            counts = self.values.get(key)
+
+            if counts is None:
+                # One count per bucket, one for +Inf, then the sum.
+                counts = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+
+            counts[index] += 1
+            counts[-1] += value
+
+    def samples(self):
+        samples = []
+
+        with self.lock:
+            values = [(key, list(counts)) for key, counts in self.values.items()]
+
+        for key, counts in values:
+            total = 0
+
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                total += count
+                samples.append(("_bucket", key, (("le", _format_value(bound)),), total))
+
+            samples.append(("_sum", key, (), counts[-1]))
+            samples.append(("_count", key, (), total))
+
+        return samples
+
+
+class Registry(object):
+    def __init__(self):
+        self.metrics = OrderedDict()
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        """
+        Add a metric, replacing any earlier one with the same name.
+
+        :type metric: Metric
+        :rtype: Metric
+        """
+        with self.lock:
+            self.metrics[metric.name] = metric
+
+        return metric
+
+    def counter(self, name, documentation, labels=()):
+        return self.register(Counter(name, documentation, labels))
+
+    def gauge(self, name, documentation, function):
+        return self.register(Gauge(name, documentation, function))
+
+    def histogram(self, name, documentation, buckets, labels=()):
+        return self.register(Histogram(name, documentation, buckets, labels))
+
+    def render(self):
+        """
+        :return: Every metric in the Prometheus text format.
+        :rtype: str
+        """
+        with self.lock:
+            metrics = list(self.metrics.values())
+
+        return "".join(metric.render() + "\n" for metric in metrics)
+
+
+REGISTRY = Registry()
+
+TRANSMIT_SECONDS = REGISTRY.histogram(
+    "ir_transmit_seconds", "Time from starting a key's transmission until pigpio finished sending it.",
+    (0.025, 0.05, 0.075, 0.1, 0.15, 0.25, 0.5, 1.0, 2.5, 5.0), labels=("command",))
+GAP_WAIT_SECONDS = REGISTRY.histogram(
+    "ir_gap_wait_seconds", "Time spent waiting out the gap after the previous key before sending the next one.",
+    (0.0, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0))
+WAVE_BUILD_SECONDS = REGISTRY.histogram(
+    "ir_wave_build_seconds", "Time taken to create the pigpio waves missing from a chain.",
+    (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1))
+WAVE_EVICTIONS = REGISTRY.counter(
+    "ir_wave_evictions_total", "Waves deleted from pigpio to make room for others.")
+POWER_WAIT_SECONDS = REGISTRY.histogram(
+    "tv_power_wait_seconds", "Time from pressing power until tvservice reported the TV settled, by outcome.",
+    (1.0, 2.5, 5.0, 7.5, 10.0, 15.0, 20.0, 30.0, 60.0), labels=("outcome",))
+TRANSITION_SECONDS = REGISTRY.histogram(
+    "tv_transition_seconds", "Time taken by each state transition.",
+    (1.0, 2.5, 5.0, 10.0, 15.0, 20.0, 30.0, 45.0, 60.0, 120.0), labels=("transition",))
+TRANSITIONS = REGISTRY.counter(
+    "tv_transitions_total", "State transitions run.", labels=("transition",))
+TRANSITION_KEYS = REGISTRY.counter(
+    "tv_transition_keys_total", "Key presses sent by state transitions.", labels=("transition",))
@@ -0,0 +1,254 @@
+"""
+Encoder/decoder for the NEC IR protocol.
+
+An NEC frame is a 9ms header mark and 4.5ms space followed by 32 bits, least significant bit first: the address,
+the inverted address (or the high byte of a 16 bit extended address), the command and the inverted command.
+Every bit is a short mark followed by a short space for 0 or a long space for 1, and the frame ends with a
+final mark.  While a key is held the remote sends a repeat frame (header mark, 2.25ms space, mark) every 108ms.
+
+Because every key on a remote differs only in its command byte, a whole remote can be stored as one address and
+a byte per key:
+
+    {"protocol": "nec", "address": "0x0586", "commands": {"KEY_POWER": "0x0f", ...}}
+
+To convert a JSON file of raw codes written by ir_rxtx_sample.py:
+
+    python -m ir_transmitter.nec insignia_commands.json insignia_nec.json
+"""
+import json
+import sys
+
+from collections.abc import Mapping
+
+
+PROTOCOL = "nec"
+FRAME_BITS = 32
+# Start of one frame to the start of the next, in microseconds.
+FRAME_PERIOD = 108000
+
+
+class NECCodec(object):
+    """
+    Converts between NEC (address, command) pairs and raw mark/space lengths.
+
+    The default timings are the ones measured from the Insignia remote rather than the nominal NEC values, so
+    synthesized frames match the recordings we already know the TV accepts.
+    """
+    def __init__(self, header_mark=9081, header_space=4461, bit_mark=609, zero_space=555, one_space=1665,
+                 repeat_space=2250, tolerance=0.25):
+        self.header_mark = header_mark
+        self.header_space = header_space
+        self.bit_mark = bit_mark
+        self.zero_space = zero_space
+        self.one_space = one_space
+        self.repeat_space = repeat_space
+        self.tolerance = tolerance
+
+    def timing(self):
+        return {"header_mark": self.header_mark,
+                "header_space": self.header_space,
+                "bit_mark": self.bit_mark,
+                "zero_space": self.zero_space,
+                "one_space": self.one_space,
+                "repeat_space": self.repeat_space}
+
+    def encode(self, address, command):
+        """
+        Synthesize the mark/space lengths of a full frame.
+
+        :param address: 8 bit address, or a 16 bit extended address.
+        :type address: int
+        :param command: 8 bit command.
+        :type command: int
+        :rtype: list[int]
+        """
+        if address > 0xff:
+            address_bytes = [address & 0xff, address >> 8 & 0xff]
+        else:
+            address_bytes = [address, address ^ 0xff]
+
+        code = [self.header_mark, self.header_space]
+
+        for byte in address_bytes + [command & 0xff, command & 0xff ^ 0xff]:
+            for bit in range(8):
+                code.append(self.bit_mark)
+                code.append(self.one_space if byte >> bit & 1 else self.zero_space)
+
+        code.append(self.bit_mark)
+        return code
+
+    def repeat(self):
+        """
+        Mark/space lengths of a repeat frame.
+
+        :rtype: list[int]
+        """
+        return [self.header_mark, self.repeat_space, self.bit_mark]
+
+    def decode(self, code):
+        """
+        Recover the address and command from a recorded frame.
+
+        :param code: Alternating mark/space lengths in microseconds, starting with the header mark.
+        :type code: list[int]
+        :return: (address, command), the address being 16 bits wide if the second byte isn't its inverse.
+        :rtype: tuple[int, int]
+        :raises ValueError: If the code isn't a valid NEC frame.
+        """
+        if len(code) != 2 * FRAME_BITS + 3:
+            raise ValueError("NEC frames have {0} pulses, got {1}".format(2 * FRAME_BITS + 3, len(code)))
+
+        if not (self._matches(code[0], self.header_mark) and self._matches(code[1], self.header_space)):
+            raise ValueError("Code doesn't start with an NEC header")
+
+        value = 0
+
+        for bit in range(FRAME_BITS):
+            mark, space = code[2 + 2 * bit], code[3 + 2 * bit]
+
+            if not self._matches(mark, self.bit_mark):
+                raise ValueError("Bit {0} has a mark of {1}us".format(bit, mark))
+
+            if self._matches(space, self.one_space):
+                value |= 1 << bit
+            elif not self._matches(space, self.zero_space):
+                raise ValueError("Bit {0} has a space of {1}us".format(bit, space))
+
+        address_low, address_high, command, inverse = [value >> shift & 0xff for shift in (0, 8, 16, 24)]
+
+        if command ^ inverse != 0xff:
+            raise ValueError("Command byte {0:#04x} doesn't match its inverse {1:#04x}".format(command, inverse))
+
+        if address_low ^ address_high == 0xff:
+            return address_low, command
+
+        return address_high << 8 | address_low, command
+
+    def is_repeat(self, code):
+        return (len(code) == 3 and self._matches(code[0], self.header_mark) and
+                self._matches(code[1], self.repeat_space) and self._matches(code[2], self.bit_mark))
+
+    @staticmethod
+    def frame_gap(code):
+        """
+        Silence needed after a frame so the next one starts a full frame period after it.
+
+        :type code: list[int]
+        :rtype: int
+        """
+        return max(FRAME_PERIOD - sum(code), 0)
+
+    def _matches(self, micros, expected):
+        return abs(micros - expected) <= expected * self.tolerance
+
+
+class NECCodeSet(Mapping):
+    """
+    Read only mapping of command name to synthesized mark/space lengths for a remote using the NEC protocol.
+    """
+    def __init__(self, address, commands, codec=None):
+        """
+
+        :param address: Address shared by every key on the remote.
+        :type address: int
+        :param commands: Command byte for each key.
+        :type commands: dict[str, int]
+        :type codec: NECCodec
+        """
+        self.address = address
+        self.commands = commands
+        self.codec = codec or NECCodec()
+        self.frame_period = FRAME_PERIOD
+        self.codes = {}
+
+    @classmethod
+    def from_json(cls, data):
+        """
+        :type data: dict
+        :rtype: NECCodeSet
+        """
+        if data.get("protocol") != PROTOCOL:
+            raise ValueError("Not an NEC code set: protocol is {0}".format(data.get("protocol")))
+
+        commands = dict((name, _parse_byte(value)) for name, value in data["commands"].items())
+        return cls(_parse_byte(data["address"]), commands, NECCodec(**data.get("timing", {})))
+
+    @classmethod
+    def from_records(cls, records, codec=None):
+        """
+        Decode raw codes, as written by ir_rxtx_sample.py, into an NEC code set.
+
+        :type records: dict[str, list[int]]
+        :type codec: NECCodec
+        :rtype: NECCodeSet
+        :raises ValueError: If any code isn't NEC or the codes don't share an address.
+        """
+        codec = codec or NECCodec()
+        addresses = set()
+        commands = {}
+
+        for name, code in records.items():
+            address, commands[name] = codec.decode(code)
+            addresses.add(address)
+
+        if len(addresses) != 1:
+            raise ValueError("Expected every code to share one address, found {0}".format(sorted(addresses)))
+
+        return cls(addresses.pop(), commands, codec)
+
+    def to_json(self):
+        address_format = "{0:#06x}" if self.address > 0xff else "{0:#04x}"
+
+        return {"protocol": PROTOCOL,
+                "address": address_format.format(self.address),
+                "timing": self.codec.timing(),
+                "commands": dict((name, "{0:#04x}".format(command)) for name, command in self.commands.items())}
+
+    def repeat(self):
+        return self.codec.repeat()
+
+    def __getitem__(self, name):
+        if name not in self.codes:
+            self.codes[name] = self.codec.encode(self.address, self.commands[name])
+
+        return self.codes[name]
+
+    def __contains__(self, name):
+        return name in self.commands
+
+    def __iter__(self):
+        return iter(sorted(self.commands))
+
+    def __len__(self):
+        return len(self.commands)
+
+
+def _parse_byte(value):
+    if isinstance(value, int):
+        return value
+
+    return int(value, 0)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+
+    if len(argv) != 2:
+        print("usage: python -m ir_transmitter.nec <codes.json> <nec_codes.json>")
+        return 1
+
+    raw_filepath, nec_filepath = argv
+
+    with open(raw_filepath) as raw_file:
+        code_set = NECCodeSet.from_records(json.load(raw_file))
+
+    with open(nec_filepath, "w") as nec_file:
+        json.dump(code_set.to_json(), nec_file, indent=4, sort_keys=True)
+        nec_file.write("\n")
+
+    print("Wrote {0} NEC commands for address {1:#x} to {2}".format(len(code_set), code_set.address, nec_filepath))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
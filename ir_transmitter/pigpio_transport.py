@@ -0,0 +1,207 @@
+"""
+Pipelined access to the wave commands of a pigpio connection.
+
+Every call on a pigpio.pi is a synchronous round trip to pigpiod: send a 16 byte command, wait for the 16 byte
+reply.  Building a wave takes four of them (new, add, count control blocks, create), so filling the wave cache, or
+talking to a pigpiod on another machine, is dominated by waiting on the socket.  PigpioTransport writes a whole
+batch of commands to the connection's socket in one go, with pulse lists packed straight into the extension
+bytes, then reads all the replies back, so building any number of waves is a single round trip.
+
+Connections without a raw pigpio socket, e.g. a fake_pigpio.FakePi made without pipelined=True, are driven through
+their ordinary methods instead, one round trip per call.  round_trips counts them either way.
+"""
+import logging
+import struct
+
+import pigpio
+
+
+logger = logging.getLogger("ir_transmitter.pigpio_transport")
+
+# pigpiod socket command numbers.
+WVCLR = 27
+WVAG = 28
+WVBSY = 32
+WVSC = 36
+WVCRE = 49
+WVDEL = 50
+WVNEW = 53
+WVCHA = 93
+
+# Commands are cmd, p1, p2, p3 (the extension length) followed by the extension, replies are cmd, p1, p2, result.
+COMMAND = struct.Struct("<IIII")
+REPLY = struct.Struct("<IIIi")
+
+
+def pack_pulses(pulses):
+    """
+    :type pulses: list[pigpio.pulse]
+    :return: The pulses as the gpio_on, gpio_off, delay uint32 triples pigpiod expects.
+    :rtype: bytes
+    """
+    values = []
+
+    for pulse in pulses:
+        values += (pulse.gpio_on, pulse.gpio_off, pulse.delay)
+
+    return struct.pack("<{0}I".format(len(values)), *values)
+
+
+def is_bad_wave_id(error):
+    """
+    Whether pigpiod refused a command because a wave it was given doesn't exist, e.g. another client on the same
+    daemon cleared every wave.
+
+    :type error: pigpio.error
+    :rtype: bool
+    """
+    return getattr(error, "value", None) == pigpio.error_text(pigpio.PI_BAD_WAVE_ID)
+
+
+class PigpioTransport(object):
+    def __init__(self, pi):
+        """
+
+        :param pi: The connection to pipeline commands over.
+        :type pi: pigpio.pi
+        """
+        self.pi = pi
+        self.round_trips = 0
+
+        socket_lock = getattr(pi, "sl", None)
+        self.socket = getattr(socket_lock, "s", None)
+        self.lock = getattr(socket_lock, "l", None)
+
+    @property
+    def pipelined(self):
+        return self.socket is not None and self.lock is not None
+
+    def pipeline(self, commands):
+        """
+        Send several commands in one write and read all their replies.
+
+        Nothing else can use the connection in between, the socket's lock is held for the whole batch.
+
+        :param commands: (cmd, p1, p2, extension bytes) for each command.
+        :type commands: list[tuple[int, int, int, bytes]]
+        :return: The result of each command, negative for a pigpio error.
+        :rtype: list[int]
+        """
+        request = bytearray()
+
+        for cmd, p1, p2, extension in commands:
+            request += COMMAND.pack(cmd, p1, p2, len(extension))
+            request += extension
+
+        reply = bytearray(REPLY.size * len(commands))
+        view = memoryview(reply)
+
+        with self.lock:
+            self.socket.sendall(request)
+            received = 0
+
+            while received < len(reply):
+                count = self.socket.recv_into(view[received:])
+
+                if not count:
+                    raise pigpio.error("pigpiod closed the connection")
+
+                received += count
+
+        self.round_trips += 1
+        return [REPLY.unpack_from(reply, offset)[3] for offset in range(0, len(reply), REPLY.size)]
+
+    def create_waves(self, waveforms):
+        """
+        Create a wave for each pulse list.
+
+        If pigpio refuses any of them, the ones that were created are deleted again before the error is raised.
+
+        :type waveforms: list[list[pigpio.pulse]]
+        :return: (wave id, DMA control blocks used) for each wave.
+        :rtype: list[tuple[int, int]]
+        """
+        if not self.pipelined:
+            waves = []
+
+            try:
+                for pulses in waveforms:
+                    waves.append(self._create_wave(pulses))
+            except pigpio.error:
+                self.delete_waves([wave_id for wave_id, _ in waves])
+                raise
+
+            return waves
+
+        commands = []
+
+        for pulses in waveforms:
+            commands += [(WVNEW, 0, 0, b""),
+                         (WVAG, 0, 0, pack_pulses(pulses)),
+                         (WVSC, 0, 0, b""),
+                         (WVCRE, 0, 0, b"")]
+
+        results = self.pipeline(commands)
+        waves = [(results[i + 3], results[i + 2]) for i in range(0, len(results), 4)]
+        failed = [result for result in results if result < 0]
+
+        if failed:
+            self.delete_waves([wave_id for wave_id, _ in waves if wave_id >= 0])
+            raise pigpio.error(pigpio.error_text(failed[0]))
+
+        return waves
+
+    def delete_waves(self, wave_ids):
+        """
+        :type wave_ids: list[int]
+        """
+        if not wave_ids:
+            return
+
+        if not self.pipelined:
+            for wave_id in wave_ids:
+                self.round_trips += 1
+                self.pi.wave_delete(wave_id)
+
+            return
+
+        self._check(self.pipeline([(WVDEL, wave_id, 0, b"") for wave_id in wave_ids]))
+
+    def wave_delete(self, wave_id):
+        self.delete_waves([wave_id])
+
+    def wave_clear(self):
+        if not self.pipelined:
+            self.round_trips += 1
+            return self.pi.wave_clear()
+
+        return self._check(self.pipeline([(WVCLR, 0, 0, b"")]))[0]
+
+    def wave_chain(self, chain):
+        if not self.pipelined:
+            self.round_trips += 1
+            return self.pi.wave_chain(chain)
+
+        return self._check(self.pipeline([(WVCHA, 0, 0, bytes(bytearray(chain)))]))[0]
+
+    def wave_tx_busy(self):
+        if not self.pipelined:
+            self.round_trips += 1
+            return self.pi.wave_tx_busy()
+
+        return self._check(self.pipeline([(WVBSY, 0, 0, b"")]))[0]
+
+    def _create_wave(self, pulses):
+        self.round_trips += 4
+        self.pi.wave_add_new()
+        self.pi.wave_add_generic(pulses)
+        cbs = self.pi.wave_get_cbs()
+        return self.pi.wave_create(), cbs
+
+    @staticmethod
+    def _check(results):
+        for result in results:
+            if result < 0:
+                raise pigpio.error(pigpio.error_text(result))
+
+        return results
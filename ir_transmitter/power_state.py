@@ -0,0 +1,51 @@
+import threading
+import time
+
+
+class PowerStateTracker(object):
+    """
+    Thread safe record of the TV's power state, as reported by tvservice.
+
+    The monitor thread calls update() for every HDMI event and anything waiting on a transition is woken straight
+    away, rather than polling the state on a timer.  Every update bumps a change counter so callers can wait for
+    "the next change after this one" without racing the monitor thread.
+    """
+    def __init__(self, powered=False):
+        self.condition = threading.Condition()
+        self.powered = powered
+        self.changes = 0
+        self.last_change = time.time()
+
+    def update(self, powered):
+        with self.condition:
+            self.powered = powered
+            self.changes += 1
+            self.last_change = time.time()
+            self.condition.notify_all()
+
+    def wait_for_change(self, since, timeout=None):
+        """
+        Block until the state has changed more than the given number of times.
+
+        :param since: A value of self.changes read before triggering the change.
+        :type since: int
+        :param timeout: Seconds to wait, or None to wait forever.
+        :type timeout: Union[float, None]
+        :return: False if the timeout expired first.
+        :rtype: bool
+        """
+        with self.condition:
+            return self.condition.wait_for(lambda: self.changes > since, timeout)
+
+    def wait_for_power(self, state, timeout=None):
+        """
+        Block until the TV is in the given power state.
+
+        :type state: bool
+        :param timeout: Seconds to wait, or None to wait forever.
+        :type timeout: Union[float, None]
+        :return: False if the timeout expired first.
+        :rtype: bool
+        """
+        with self.condition:
+            return self.condition.wait_for(lambda: self.powered == state, timeout)
@@ -0,0 +1,64 @@
+import json
+import logging
+import os
+import tempfile
+
+
+logger = logging.getLogger("ir_transmitter.state_store")
+
+STATE_VERSION = 1
+
+
+class StateStore(object):
+    """
+    Keeps a snapshot of the controller's tracked TV state in a JSON file so it survives restarts.
+
+    Snapshots are written to a temporary file in the same directory, flushed to disk and renamed over the old one,
+    so a power cut part way through a save leaves either the old snapshot or the new one, never half of each.
+    """
+    def __init__(self, filepath):
+        """
+
+        :type filepath: str
+        """
+        self.filepath = filepath
+
+    def save(self, snapshot):
+        """
+        :param snapshot: JSON serialisable state.
+        :type snapshot: dict
+        """
+        snapshot = dict(snapshot, version=STATE_VERSION)
+        directory = os.path.dirname(os.path.abspath(self.filepath))
+        fd, temp_path = tempfile.mkstemp(prefix=".state-", suffix=".tmp", dir=directory)
+
+        try:
+            with os.fdopen(fd, "w") as temp_file:
+                json.dump(snapshot, temp_file, sort_keys=True)
+                temp_file.flush()
+                os.fsync(temp_file.fileno())
+
+            os.replace(temp_path, self.filepath)
+        except Exception:
+            os.unlink(temp_path)
+            raise
+
+    def load(self):
+        """
+        :return: The last saved snapshot, or None if there isn't a usable one.
+        :rtype: Union[dict, None]
+        """
+        try:
+            with open(self.filepath) as state_file:
+                snapshot = json.load(state_file)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            logger.exception("Failed to read controller state from " + self.filepath)
+            return None
+
+        if not isinstance(snapshot, dict) or snapshot.get("version") != STATE_VERSION:
+            logger.warning("Ignoring controller state with an unknown format in " + self.filepath)
+            return None
+
+        return snapshot
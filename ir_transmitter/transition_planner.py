@@ -0,0 +1,89 @@
+import logging
+
+from collections import namedtuple
+
+
+logger = logging.getLogger("ir_transmitter.transition_planner")
+
+# Tracked or wanted state of the TV, display_mode being "STANDARD" or "CUSTOM".
+TVState = namedtuple("TVState", ["powered", "volume", "display_mode"])
+
+POWER_ON = "power_on"
+RECALIBRATE = "recalibrate"
+DISPLAY_MODE = "display_mode"
+VOLUME = "volume"
+
+# Menu keys that switch the picture mode to each display mode from the other one.
+DISPLAY_MODE_KEYS = {
+    "CUSTOM": ["KEY_MENU", "KEY_DOWN", "KEY_OK", "KEY_DOWN", "KEY_OK", "KEY_EXIT"],
+    "STANDARD": ["KEY_MENU", "KEY_DOWN", "KEY_OK", "KEY_UP", "KEY_OK", "KEY_EXIT"],
+}
+
+
+class PlanStep(namedtuple("PlanStep", ["action", "value"])):
+    """
+    One step of a transition plan: POWER_ON, RECALIBRATE (drive the volume down to 0 from wherever it might be),
+    DISPLAY_MODE to the given mode or VOLUME to the given level.
+    """
+    __slots__ = ()
+
+
+class TransitionPlanner(object):
+    """
+    Works out the fewest steps that take the TV from its tracked state to a target state.
+
+    The volume is moved straight from its tracked level to the target rather than via 0, and the display mode menu
+    is only used when the mode actually differs.  The slow recalibration down to 0 is only planned when the
+    tracked volume isn't trusted, or it's been recalibrate_interval seconds since the last one, to stop any drift
+    between the tracked and real volume from building up.
+    """
+    def __init__(self, recalibrate_interval=24 * 60 * 60):
+        """
+
+        :param recalibrate_interval: Seconds after a recalibration before another one is planned, or None to only
+            recalibrate when the state isn't trusted.
+        :type recalibrate_interval: Union[float, None]
+        """
+        self.recalibrate_interval = recalibrate_interval
+
+    def needs_recalibration(self, trusted, last_calibrated, now):
+        """
+        :param trusted: Whether the tracked volume is believed to match the TV.
+        :type trusted: bool
+        :param last_calibrated: Monotonic time of the last recalibration, or None if there hasn't been one.
+        :type last_calibrated: Union[float, None]
+        :param now: The monotonic time now.
+        :type now: float
+        :rtype: bool
+        """
+        if not trusted or last_calibrated is None:
+            return True
+
+        return self.recalibrate_interval is not None and now - last_calibrated >= self.recalibrate_interval
+
+    def plan(self, current, target, trusted=True, last_calibrated=None, now=0.0):
+        """
+        :type current: TVState
+        :type target: TVState
+        :return: Steps to run in order.
+        :rtype: list[PlanStep]
+        """
+        steps = []
+
+        if target.powered and not current.powered:
+            steps.append(PlanStep(POWER_ON, True))
+
+        volume = current.volume
+
+        if self.needs_recalibration(trusted, last_calibrated, now):
+            steps.append(PlanStep(RECALIBRATE, 0))
+            volume = 0
+
+        if target.display_mode != current.display_mode:
+            steps.append(PlanStep(DISPLAY_MODE, target.display_mode))
+
+        if target.volume != volume:
+            steps.append(PlanStep(VOLUME, target.volume))
+
+        logger.info("Planned {0} -> {1}: {2}".format(current, target, steps))
+        return steps
@@ -0,0 +1,487 @@
+import logging
+import time
+
+from collections import OrderedDict
+
+import pigpio
+
+from ir_transmitter.metrics import WAVE_BUILD_SECONDS, WAVE_EVICTIONS
+from ir_transmitter.pigpio_transport import PigpioTransport
+
+
+logger = logging.getLogger("ir_transmitter.wave_cache")
+
+# Wave ids are handed out as single bytes in a chain, pigpio itself stops at 250.
+MAX_WAVE_IDS = 250
+# pigpio's chain buffer is dimensioned for roughly 600 entries.
+MAX_CHAIN_LENGTH = 600
+# A single chain delay command holds a 16 bit microsecond count.
+MAX_CHAIN_DELAY = 65535
+# pigpio only has 20 loop counters for a whole chain.
+MAX_CHAIN_LOOPS = 20
+# Longest run of carrier cycles we'll search for a whole number of microseconds.
+MAX_BLOCK_CYCLES = 64
+
+
+def carrier(gpio, frequency, micros):
+    """
+    Generate carrier square wave.
+    """
+    wf = []
+    cycle = 1000.0 / frequency
+    cycles = int(round(micros / cycle))
+    on = int(round(cycle / 2.0))
+    sofar = 0
+
+    for c in range(cycles):
+        target = int(round((c + 1) * cycle))
+        sofar += on
+        off = target - sofar
+        sofar += off
+        wf.append(pigpio.pulse(1 << gpio, 0, on))
+        wf.append(pigpio.pulse(0, 1 << gpio, off))
+
+    return wf
+
+
+def code_pulses(gpio, frequency, code):
+    """
+    Expand a whole code into a single pulse train on one GPIO, keeping every mark starting at its nominal time
+    even when its carrier cycles don't add up to a whole number of microseconds.
+    """
+    pulses = []
+    nominal = 0
+    elapsed = 0
+
+    for i, micros in enumerate(code):
+        nominal += micros
+
+        if i & 1:
+            if nominal > elapsed:
+                pulses.append(pigpio.pulse(0, 0, int(nominal - elapsed)))
+                elapsed = int(nominal)
+        else:
+            wf = carrier(gpio, frequency, micros)
+            pulses += wf
+            elapsed += sum(pulse.delay for pulse in wf)
+
+    return pulses
+
+
+def merge_pulses(trains):
+    """
+    Merge pulse trains for different GPIOs, all starting at time zero, into one train whose pulses switch every
+    GPIO with combined on/off bitmasks, the way pigpio's wave_add_generic merges successive calls: every pulse in
+    any train starts a pulse in the result, even one that doesn't switch anything.
+    """
+    events = {}
+    end = 0
+
+    for pulses in trains:
+        offset = 0
+
+        for pulse in pulses:
+            on, off = events.get(offset, (0, 0))
+            events[offset] = (on | pulse.gpio_on, off | pulse.gpio_off)
+            offset += pulse.delay
+
+        end = max(end, offset)
+
+    times = sorted(events)
+    merged = []
+
+    for index, offset in enumerate(times):
+        following = times[index + 1] if index + 1 < len(times) else end
+        on, off = events[offset]
+        merged.append(pigpio.pulse(on, off, following - offset))
+
+    return merged
+
+
+def carrier_block(frequency, max_cycles=MAX_BLOCK_CYCLES):
+    """
+    Find the smallest number of carrier cycles that lasts a whole number of microseconds.
+
+    A wave of that many cycles can be repeated back to back without the carrier drifting, e.g. at 38kHz
+    19 cycles last exactly 500us.  Returns None if there's no such block within max_cycles.
+    """
+    cycle = 1000.0 / frequency
+
+    for cycles in range(1, max_cycles + 1):
+        micros = cycles * cycle
+
+        if abs(micros - round(micros)) < 1e-6:
+            return cycles
+
+    return None
+
+
+def chain_delay(micros):
+    """
+    Encode a pause of the given length as wave chain delay commands.
+    """
+    chain = []
+    micros = int(micros)
+
+    while micros > 0:
+        step = min(micros, MAX_CHAIN_DELAY)
+        chain += [255, 2, step & 0xff, step >> 8]
+        micros -= step
+
+    return chain
+
+
+class WaveEntry(object):
+    def __init__(self, wave_id, pulses, cbs):
+        self.wave_id = wave_id
+        self.pulses = pulses
+        self.cbs = cbs
+
+
+class WaveCache(object):
+    """
+    Keeps the pigpio waves for every distinct mark and space resident between transmits.
+
+    Each distinct pulse (a run of carrier cycles or a silent space of a given length) is created once and
+    shared between every command that uses it, and the compiled wave chain for each command is kept alongside.
+    Long marks are built from one short carrier block repeated with a chain loop, so a 9ms header costs a
+    few dozen pulses instead of several hundred.
+    When pigpio's wave ids, pulses or DMA control blocks get close to their limits the least recently
+    used waves are deleted, along with any cached chain that referenced them.
+    All the waves a chain is missing are created, and any waves evicted to make room deleted, in a single
+    pipelined round trip to pigpiod.
+    Other clients of the same pigpiod keep their waves unless clear_daemon is set.
+    """
+    def __init__(self, pi, gpio, frequency, headroom=0.9, transport=None, clear_daemon=False):
+        """
+
+        :param pi:
+        :type pi: pigpio.pi
+        :param gpio: The GPIO driving the IR LED.
+        :type gpio: int
+        :param frequency: Carrier frequency in kHz.
+        :type frequency: float
+        :param headroom: Fraction of pigpio's wave resources the cache is allowed to occupy.
+        :type headroom: float
+        :param transport: Pipelines the wave commands, a new one on pi unless given one to share.
+        :type transport: PigpioTransport
+        :param clear_daemon: Delete every wave on pigpiod first, including other clients' waves.  Only for the
+            process that owns the daemon, at its startup, to reclaim what a previous run left behind.
+        :type clear_daemon: bool
+        """
+        self.pi = pi
+        self.transport = transport if transport is not None else PigpioTransport(pi)
+        self.gpio = gpio
+        self.frequency = frequency
+        self.cycle = 1000.0 / frequency
+        self.block_cycles = carrier_block(frequency)
+
+        self.max_waves = int(MAX_WAVE_IDS * headroom)
+        self.max_pulses = int(self.pi.wave_get_max_pulses() * headroom)
+        self.max_cbs = int(self.pi.wave_get_max_cbs() * headroom)
+
+        self.pulses_used = 0
+        self.cbs_used = 0
+
+        self.waves = OrderedDict()
+        """ :type: OrderedDict[tuple, WaveEntry]"""
+        self.chains = OrderedDict()
+        """ :type: OrderedDict[str, list]"""
+        self.chain_waves = {}
+        self.wave_users = {}
+
+        if clear_daemon:
+            # Anything left over from a previous process holds wave resources we can't account for.
+            self.transport.wave_clear()
+
+    def chain(self, command, code, pinned=frozenset()):
+        """
+        Return the wave chain for the given command, building any waves it needs that aren't resident.
+
+        :param command: Name the chain is cached under.
+        :type command: str
+        :param code: Alternating mark/space lengths in microseconds, starting with a mark.
+        :type code: list[int]
+        :param pinned: Keys of waves that must not be evicted while building this chain.
+        :type pinned: set[tuple]
+        :return: The chain to hand to pigpio's wave_chain.
+        :rtype: list[int]
+        """
+        if command in self.chains:
+            self.chains.move_to_end(command)
+
+            for key in self.chain_waves[command]:
+                self.waves.move_to_end(key)
+
+            return self.chains[command]
+
+        plan = self._plan(code)
+        keys = set(item[1] for item in plan)
+        pinned = pinned.union(keys)
+        missing = []
+
+        for item in plan:
+            if item[1] not in self.waves and item[1] not in missing:
+                missing.append(item[1])
+
+        self._build(missing, pinned)
+        chain = []
+
+        for item in plan:
+            if item[0] == "loop":
+                repeats = item[2]
+                chain += [255, 0, self._wave(item[1]).wave_id, 255, 1, repeats & 0xff, repeats >> 8]
+            else:
+                chain.append(self._wave(item[1]).wave_id)
+
+        self.chains[command] = chain
+        self.chain_waves[command] = keys
+
+        for key in keys:
+            self.wave_users.setdefault(key, set()).add(command)
+
+        return chain
+
+    def sequence(self, steps):
+        """
+        Split several commands, each with a pause after it, into groups that can each be sent as a single chain.
+
+        The sequence is split into as few chains as pigpio allows: each has to fit its chain length and loop limits,
+        and every wave it uses has to fit in the cache at once.  Nothing is built here.  Build each group with
+        sequence_chain() only once the chain before it has finished sending, since building it may evict waves the
+        earlier chains use.
+
+        :param steps: (command, code, gap in microseconds) for each key in the sequence.
+        :type steps: list[tuple[str, list[int], int]]
+        :return: The steps making up each chain, in order.
+        :rtype: list[list[tuple[str, list[int], int]]]
+        """
+        groups = []
+        keys = set()
+        length = 0
+        loops = 0
+
+        for step in steps:
+            plan = self._plan(step[1])
+            step_keys = set(item[1] for item in plan)
+            step_length = sum(7 if item[0] == "loop" else 1 for item in plan) + len(chain_delay(step[2]))
+            step_loops = sum(1 for item in plan if item[0] == "loop")
+
+            if not groups or (length + step_length > MAX_CHAIN_LENGTH or loops + step_loops > MAX_CHAIN_LOOPS or
+                              not self._fits(keys.union(step_keys))):
+                groups.append([])
+                keys = set()
+                length = 0
+                loops = 0
+
+            groups[-1].append(step)
+            keys.update(step_keys)
+            length += step_length
+            loops += step_loops
+
+        return groups
+
+    def sequence_chain(self, steps):
+        """
+        Build the chain for one group of steps from sequence(), keeping all of its waves resident until it's built.
+
+        :type steps: list[tuple[str, list[int], int]]
+        :return: The chain to hand to pigpio's wave_chain and how long it takes to send in microseconds.
+        :rtype: tuple[list[int], int]
+        """
+        pinned = set()
+
+        for _, code, _ in steps:
+            pinned.update(item[1] for item in self._plan(code))
+
+        chain = []
+        micros = 0
+
+        for command, code, gap_micros in steps:
+            chain += self.chain(command, code, pinned) + chain_delay(gap_micros)
+            micros += sum(code) + int(gap_micros)
+
+        return chain, micros
+
+    def held(self, command, code, repeat_code, repeats, period):
+        """
+        Compile a key being held down: the full frame followed by the repeat frame sent over and over.
+
+        The repeats are a chain loop, so the chain is the same size however long the key is held.
+
+        :param command: Name of the key being held.
+        :type command: str
+        :param code: The key's full frame.
+        :type code: list[int]
+        :param repeat_code: The frame sent while the key stays held.
+        :type repeat_code: list[int]
+        :param repeats: Number of repeat frames after the first frame.
+        :type repeats: int
+        :param period: Microseconds from the start of one frame to the start of the next.
+        :type period: int
+        :rtype: list[int]
+        """
+        chain = self.chain(command, code) + chain_delay(period - sum(code))
+
+        if not repeats:
+            return chain
+
+        repeat = self.chain(command + ":repeat", repeat_code, self.chain_waves[command])
+        chain += [255, 0] + repeat + chain_delay(period - sum(repeat_code))
+
+        while repeats:
+            count = min(repeats, 0xffff)
+            chain += [255, 1, count & 0xff, count >> 8]
+            repeats -= count
+
+            if repeats:
+                chain += [255, 0] + repeat + chain_delay(period - sum(repeat_code))
+
+        return chain
+
+    def clear(self, delete=True):
+        """
+        Drop every wave and chain from the cache.
+
+        :param delete: Delete the waves from pigpiod too.  Not when pigpiod has lost them already, their ids may
+            since have been handed to another client's waves.
+        :type delete: bool
+        """
+        if delete:
+            self.transport.delete_waves([entry.wave_id for entry in self.waves.values()])
+
+        self.waves.clear()
+        self.chains.clear()
+        self.chain_waves.clear()
+        self.wave_users.clear()
+        self.pulses_used = 0
+        self.cbs_used = 0
+
+    def _plan(self, code):
+        """
+        Work out which waves make up a code.
+
+        Spaces are a single silent wave.  Marks are keyed by their number of carrier cycles; a long mark is
+        a carrier block repeated with a chain loop followed by whatever cycles are left over, and anything
+        short (or any mark at all if the carrier frequency has no whole-microsecond block) is expanded into
+        a single wave as before.
+        """
+        plan = []
+        loops = 0
+
+        for i, micros in enumerate(code):
+            if i & 1:
+                plan.append(("wave", ("space", int(micros))))
+                continue
+
+            cycles = int(round(micros / self.cycle))
+
+            if not cycles:
+                continue
+
+            if self.block_cycles and cycles // self.block_cycles >= 2 and loops < MAX_CHAIN_LOOPS:
+                repeats, remainder = divmod(cycles, self.block_cycles)
+                plan.append(("loop", ("carrier", self.block_cycles), repeats))
+                loops += 1
+
+                if remainder:
+                    plan.append(("wave", ("carrier", remainder)))
+            else:
+                plan.append(("wave", ("carrier", cycles)))
+
+        return plan
+
+    def _pulses(self, key):
+        kind, length = key
+
+        if kind == "space":
+            return [pigpio.pulse(0, 0, length)]
+
+        return carrier(self.gpio, self.frequency, length * self.cycle)
+
+    @staticmethod
+    def _pulse_count(key):
+        kind, length = key
+        # A carrier wave is an on and an off pulse per cycle.
+        return 1 if kind == "space" else 2 * length
+
+    def _fits(self, keys):
+        """
+        Whether the waves for all the given keys could be resident at once.
+        """
+        pulses = sum(self._pulse_count(key) for key in keys)
+        return len(keys) <= self.max_waves and pulses <= self.max_pulses and 2 * pulses <= self.max_cbs
+
+    def _wave(self, key):
+        self.waves.move_to_end(key)
+        return self.waves[key]
+
+    def _build(self, keys, pinned):
+        """
+        Create the waves for the given keys, making room for them first.
+        """
+        if not keys:
+            return
+
+        waveforms = [self._pulses(key) for key in keys]
+        self._make_room(sum(len(wf) for wf in waveforms), len(keys), pinned)
+
+        start = time.perf_counter()
+
+        try:
+            created = self.transport.create_waves(waveforms)
+        except pigpio.error:
+            logger.warning("pigpio refused to create waves for {0}, evicting every unpinned wave".format(keys))
+            self._evict_all(pinned)
+            created = self.transport.create_waves(waveforms)
+
+        WAVE_BUILD_SECONDS.observe(time.perf_counter() - start)
+
+        for key, wf, (wave_id, cbs) in zip(keys, waveforms, created):
+            entry = WaveEntry(wave_id, len(wf), cbs)
+            self.waves[key] = entry
+            self.pulses_used += entry.pulses
+            self.cbs_used += entry.cbs
+
+    def _full(self, pulses, waves=1):
+        return (len(self.waves) + waves > self.max_waves or
+                self.pulses_used + pulses > self.max_pulses or
+                self.cbs_used + 2 * pulses > self.max_cbs)
+
+    def _make_room(self, pulses, waves, pinned):
+        evicted = []
+
+        for key in list(self.waves):
+            if not self._full(pulses, waves):
+                break
+
+            if key not in pinned:
+                evicted.append(self._evict(key))
+
+        self.transport.delete_waves(evicted)
+
+    def _evict_all(self, pinned):
+        self.transport.delete_waves([self._evict(key) for key in list(self.waves) if key not in pinned])
+
+    def _evict(self, key):
+        """
+        Drop a wave and every chain using it from the cache, leaving the caller to delete it from pigpio.
+
+        :return: The wave's id.
+        :rtype: int
+        """
+        entry = self.waves.pop(key)
+        logger.debug("Evicting wave {0} ({1} pulses) from the wave cache".format(key, entry.pulses))
+
+        WAVE_EVICTIONS.inc()
+        self.pulses_used -= entry.pulses
+        self.cbs_used -= entry.cbs
+
+        for command in self.wave_users.pop(key, ()):
+            self.chains.pop(command, None)
+
+            for other in self.chain_waves.pop(command, ()):
+                if other != key:
+                    self.wave_users.get(other, set()).discard(command)
+
+        return entry.wave_id
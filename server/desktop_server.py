@@ -1,27 +1,38 @@
+import ctypes
+import logging
 import webbrowser
 import pyaudio
-import requests
-import time
 import os
+import time
 
-from Queue import Queue
+from concurrent.futures import ThreadPoolExecutor
 
 from flask import Flask, request, make_response, abort
 
-from audio_normalizer.audio_normalizer import AudioInputNormalizer, AudioPlaybackStreamer
+from audio_normalizer.audio_normalizer import CallbackAudioStreamer
+from server.pi_client import PiClient
+from server.step_graph import StepGraph
 
 
+logging.basicConfig(level=logging.INFO)
+
 input_device = "VirtualCableOutput"
 output_device = "TV"
 
 
 aud_manager = pyaudio.PyAudio()
-normalizer = AudioInputNormalizer(aud_manager, device_name=input_device)
-streamer = AudioPlaybackStreamer(aud_manager, device_name=output_device)
-seg_queue = Queue()
+# Callback mode keeps the TV's sound within a few buffers of the picture.
+audio = CallbackAudioStreamer(aud_manager, input_device_name=input_device, output_device_name=output_device)
 app = Flask("PyBedTime_PC_WebServer")
 PI_HOSTNAME = "raspberrypi"
 PI_API_URL = 'http://{0}/api/'.format(PI_HOSTNAME)
+pi_client = PiClient(PI_API_URL)
+# Transitions run one at a time in the background, so a daytime can't overlap the end of a bedtime.
+transitions = ThreadPoolExecutor(max_workers=1)
+# The desktop drives the laptop's screen and the TV, so cloning them shows as two active display paths.
+DISPLAY_PATHS = {"internal": 1, "clone": 2}
+DISPLAY_SWITCH_TIMEOUT = 15.0
+QDC_ONLY_ACTIVE_PATHS = 2
 
 
 @app.route('/api/open_webpage', methods=["POST"])
@@ -45,33 +56,95 @@ def bedtime():
     json_object = request.json
     print(json_object)
 
-    send_pi_command("bedtime")
-    webbrowser.open_new_tab(json_object["url"])
-
-    os.system("displayswitch.exe/internal")
-    os.system("..\\lib\\nircmd.exe setdefaultsounddevice \"VirtualCableInput\" 1")
-
-    normalizer.start_monitoring(seg_queue)
-    streamer.start_playback(seg_queue)
+    transitions.submit(bedtime_graph(json_object["url"]).run)
 
     return make_response("", 200)
 
 
 @app.route("/api/daytime", methods=["POST"])
 def daytime():
-    normalizer.stop()
-    streamer.stop()
+    transitions.submit(daytime_graph().run)
 
-    os.system("displayswitch.exe/clone")
-    os.system("..\\lib\\nircmd.exe setdefaultsounddevice \"TV\" 1")
-    time.sleep(10)
-    send_pi_command("daytime")
     return make_response("", 200)
 
 
-def send_pi_command(endpoint, json=None):
-    response = requests.post(PI_API_URL + endpoint, json=json)
-    assert response.status_code == 200
+def run_command(command):
+    status = os.system(command)
+
+    if status != 0:
+        raise RuntimeError("{0} exited with {1}".format(command, status))
+
+
+def active_display_paths():
+    """
+    :return: Number of source to display paths Windows currently has active.
+    :rtype: int
+    """
+    paths = ctypes.c_uint32()
+    modes = ctypes.c_uint32()
+    result = ctypes.windll.user32.GetDisplayConfigBufferSizes(QDC_ONLY_ACTIVE_PATHS, ctypes.byref(paths),
+                                                              ctypes.byref(modes))
+
+    if result != 0:
+        raise ctypes.WinError(result)
+
+    return paths.value
+
+
+def switch_display(mode, timeout=DISPLAY_SWITCH_TIMEOUT, poll_interval=0.25):
+    """
+    Switch the desktop's displays and wait for Windows to finish changing them.
+
+    displayswitch.exe only asks Windows to change the display topology and exits straight away, so this polls the
+    active display configuration until it has the number of paths the mode should have.
+
+    :param mode: "internal" or "clone".
+    :type mode: str
+    :param timeout: Seconds to wait for the switch before giving up.
+    :type timeout: float
+    :param poll_interval: Seconds between checks of the display configuration.
+    :type poll_interval: float
+    :raises RuntimeError: If displayswitch.exe failed or the displays didn't change in time.
+    """
+    run_command("displayswitch.exe/" + mode)
+    deadline = time.time() + timeout
+
+    while True:
+        paths = active_display_paths()
+
+        if paths == DISPLAY_PATHS[mode]:
+            return
+
+        if time.time() + poll_interval > deadline:
+            raise RuntimeError("Displays still have {0} active paths {1} seconds after switching to {2}".format(
+                paths, timeout, mode))
+
+        time.sleep(poll_interval)
+
+
+def switch_sound_device(name):
+    run_command("..\\lib\\nircmd.exe setdefaultsounddevice \"{0}\" 1".format(name))
+
+
+def bedtime_graph(url):
+    graph = StepGraph("bedtime")
+    graph.add("pi", lambda: pi_client.run("bedtime"))
+    graph.add("display", lambda: switch_display("internal"))
+    graph.add("sound_device", lambda: switch_sound_device("VirtualCableInput"))
+    # The page should open on the laptop's screen with its sound already going into the virtual cable.
+    graph.add("browser", lambda: webbrowser.open_new_tab(url), requires=["display", "sound_device"])
+    graph.add("audio", audio.start, requires=["sound_device"])
+    return graph
+
+
+def daytime_graph():
+    graph = StepGraph("daytime")
+    graph.add("audio", audio.stop)
+    graph.add("display", lambda: switch_display("clone"))
+    graph.add("sound_device", lambda: switch_sound_device("TV"), requires=["audio"])
+    # The TV only switches back once the picture and sound are coming from the desktop again.
+    graph.add("pi", lambda: pi_client.run("daytime"), requires=["display", "sound_device"])
+    return graph
 
 
 if __name__ == "__main__":
@@ -0,0 +1,149 @@
+import logging
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+logger = logging.getLogger("pi_client")
+
+# Job statuses on the Pi after which nothing more will happen.
+FINISHED_STATUSES = ("done", "failed", "superseded")
+
+
+class PiJobFailed(Exception):
+    pass
+
+
+class PiClient(object):
+    """
+    Talks to the Pi server's API over a single keep-alive session.
+
+    Every request has connect and read timeouts, and connection failures and gateway errors are retried with
+    exponential backoff.  Retrying a POST is safe here, the Pi queues commands and a repeated transition just
+    supersedes the first one.  send() runs the request on a small thread pool and returns a future, so request
+    handlers on the desktop don't have to wait on the Pi or the network.
+    """
+    def __init__(self, api_url, connect_timeout=3.05, read_timeout=10.0, retries=3, backoff_factor=0.5,
+                 max_workers=2):
+        """
+
+        :param api_url: Base URL of the Pi's API, ending in a slash.
+        :type api_url: str
+        :param connect_timeout: Seconds to wait for the connection to the Pi.
+        :type connect_timeout: float
+        :param read_timeout: Seconds to wait for the Pi to answer once connected.
+        :type read_timeout: float
+        :param retries: Number of times a failed request is retried.
+        :type retries: int
+        :param backoff_factor: Retries wait backoff_factor * 2 ** (attempt - 1) seconds first.
+        :type backoff_factor: float
+        :param max_workers: Number of requests that can be in flight at once.
+        :type max_workers: int
+        """
+        self.api_url = api_url
+        self.timeout = (connect_timeout, read_timeout)
+
+        retry = Retry(total=retries, connect=retries, read=retries, status=retries, backoff_factor=backoff_factor,
+                      status_forcelist=(502, 503, 504), method_whitelist=frozenset(["GET", "POST"]),
+                      raise_on_status=False)
+        adapter = HTTPAdapter(max_retries=retry, pool_connections=1, pool_maxsize=max_workers)
+
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def post(self, endpoint, json=None):
+        """
+        Send a command to the Pi and wait for it to be accepted.
+
+        :type endpoint: str
+        :param json: Body of the request.
+        :type json: Union[dict, None]
+        :return: The Pi's answer, e.g. {"job_id": ...} for a queued command.
+        :rtype: dict
+        :raises requests.RequestException: If the Pi couldn't be reached or refused the command.
+        """
+        start = time.time()
+        response = self.session.post(self.api_url + endpoint, json=json, timeout=self.timeout)
+        response.raise_for_status()
+
+        logger.info("Pi accepted {0} in {1:.0f}ms".format(endpoint, (time.time() - start) * 1000))
+        return response.json() if response.content else {}
+
+    def job(self, job_id):
+        """
+        :type job_id: str
+        :return: The status of a command the Pi accepted.
+        :rtype: dict
+        """
+        response = self.session.get(self.api_url + "jobs/" + job_id, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def wait_for_job(self, job_id, timeout=120.0, poll_interval=1.0):
+        """
+        Wait for a command the Pi accepted to finish running.
+
+        :type job_id: str
+        :param timeout: Seconds to wait before giving up.
+        :type timeout: float
+        :param poll_interval: Seconds between status checks.
+        :type poll_interval: float
+        :return: The job's final status.
+        :rtype: dict
+        :raises PiJobFailed: If the job failed, was superseded or didn't finish in time.
+        """
+        deadline = time.time() + timeout
+
+        while True:
+            job = self.job(job_id)
+
+            if job["status"] in FINISHED_STATUSES:
+                break
+
+            if time.time() + poll_interval > deadline:
+                raise PiJobFailed("{0} job {1} still {2} after {3} seconds".format(
+                    job["name"], job_id, job["status"], timeout))
+
+            time.sleep(poll_interval)
+
+        if job["status"] != "done":
+            raise PiJobFailed("{0} job {1} {2}: {3}".format(
+                job["name"], job_id, job["status"], job["error"] or job["superseded_by"]))
+
+        return job
+
+    def run(self, endpoint, json=None, timeout=120.0):
+        """
+        Send a command to the Pi and wait for it to finish on the TV.
+
+        :rtype: dict
+        """
+        return self.wait_for_job(self.post(endpoint, json)["job_id"], timeout)
+
+    def send(self, endpoint, json=None):
+        """
+        Send a command to the Pi in the background.
+
+        Failures are logged, so the future can be dropped if nobody needs the result.
+
+        :rtype: concurrent.futures.Future
+        """
+        future = self.executor.submit(self.post, endpoint, json)
+        future.add_done_callback(lambda done: self._log_failure(endpoint, done))
+        return future
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        self.session.close()
+
+    @staticmethod
+    def _log_failure(endpoint, future):
+        if future.exception() is not None:
+            logger.error("Failed to send {0} to the Pi: {1}".format(endpoint, future.exception()))
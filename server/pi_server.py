@@ -1,13 +1,48 @@
 import logging
 import sys
 
-from flask import Flask, make_response, request
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIServer, make_server
+
+from flask import Flask, jsonify, make_response, request
+from ir_transmitter.command_queue import ControllerWorker
 from ir_transmitter.ir_transmitter import InsigniaController
+from ir_transmitter.metrics import CONTENT_TYPE, REGISTRY
 
 
 logging.basicConfig(stream=sys.stdout, level=logging.INFO)
 app = Flask("PyBedTime_TV_Controller")
-insignia_controller = InsigniaController("/home/pi/PyBedTime/insignia_commands.json")
+# The server owns the Pi's pigpiod, so it clears out whatever waves a previous run left behind.
+insignia_controller = InsigniaController("/home/pi/PyBedTime/insignia_nec.json",
+                                         state_file="/home/pi/PyBedTime/controller_state.json", clear_waves=True)
+controller_worker = ControllerWorker(insignia_controller)
+
+REGISTRY.gauge("ir_waves_resident", "pigpio waves currently held by the wave cache.",
+               lambda: len(insignia_controller.wave_cache.waves))
+REGISTRY.gauge("ir_wave_pulses_used", "pigpio wave pulses used by the wave cache.",
+               lambda: insignia_controller.wave_cache.pulses_used)
+REGISTRY.gauge("ir_wave_pulses_max", "pigpio wave pulses the wave cache may use.",
+               lambda: insignia_controller.wave_cache.max_pulses)
+REGISTRY.gauge("ir_wave_cbs_used", "pigpio DMA control blocks used by the wave cache.",
+               lambda: insignia_controller.wave_cache.cbs_used)
+REGISTRY.gauge("ir_wave_cbs_max", "pigpio DMA control blocks the wave cache may use.",
+               lambda: insignia_controller.wave_cache.max_cbs)
+REGISTRY.gauge("ir_pigpio_round_trips", "Round trips made to pigpiod for wave commands since the server started.",
+               lambda: insignia_controller.transport.round_trips)
+REGISTRY.gauge("ir_keys_sent", "Key presses sent since the server started.",
+               lambda: insignia_controller.keys_sent)
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    """
+    Handles each request on its own daemon thread, so a slow client can't hold up the others.  Requests only queue
+    work for the controller and return, so this is all the server the Pi Zero needs.
+    """
+    daemon_threads = True
+
+
+def job_accepted(job):
+    return make_response(jsonify({"job_id": job.id, "status_url": "/api/jobs/" + job.id}), 202)
 
 
 @app.route('/api/bedtime', methods=["POST"])
@@ -15,8 +50,7 @@ def py_bedtime():
     if not insignia_controller.initialized:
         return make_response("Insignia controller not ready for commands yet!", 500)
 
-    insignia_controller.bedtime()
-    return make_response("", 200)
+    return job_accepted(controller_worker.submit("bedtime"))
 
 
 @app.route("/api/daytime", methods=["POST"])
@@ -24,8 +58,7 @@ def py_daytime():
     if not insignia_controller.initialized:
         return make_response("Insignia controller not ready for commands yet!", 500)
 
-    insignia_controller.daytime()
-    return make_response("", 200)
+    return job_accepted(controller_worker.submit("daytime"))
 
 
 @app.route("/api/pi/configuration", methods=["POST"])
@@ -36,15 +69,49 @@ def py_configuration():
     if not request.json:
         return make_response("No valid configuration provided!", 400)
 
-    insignia_controller.update_configuration(request.json)
-    return make_response("", 200)
+    return job_accepted(controller_worker.submit("update_configuration", configuration_data=request.json))
+
+
+@app.route("/api/pi/volume", methods=["POST"])
+def py_volume():
+    if not insignia_controller.initialized:
+        return make_response("Insignia controller not ready for commands yet!", 500)
+
+    if not request.json or "volume" not in request.json:
+        return make_response("No volume provided!", 400)
+
+    return job_accepted(controller_worker.submit("set_volume", volume=int(request.json["volume"])))
+
+
+@app.route("/api/pi/hdmi_events", methods=["GET"])
+def py_hdmi_events():
+    since = request.args.get("since", type=float)
+    return jsonify([event.to_json() for event in insignia_controller.hdmi_events(since)])
+
+
+@app.route("/api/jobs/<job_id>", methods=["GET"])
+def py_job(job_id):
+    job = controller_worker.job(job_id)
+
+    if job is None:
+        return make_response("No such job!", 404)
+
+    return jsonify(job.to_json())
+
+
+@app.route("/api/metrics", methods=["GET"])
+def py_metrics():
+    response = make_response(REGISTRY.render(), 200)
+    response.headers["Content-Type"] = CONTENT_TYPE
+    return response
 
 
 def initialize():
     insignia_controller.initialize()
     insignia_controller.daytime()
+    controller_worker.start()
 
 
 if __name__ == "__main__":
     initialize()
-    app.run(host="raspberrypi", port=5001)
+    make_server("raspberrypi", 5001, app, server_class=ThreadingWSGIServer).serve_forever()
@@ -0,0 +1,150 @@
+import logging
+import time
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+logger = logging.getLogger("step_graph")
+
+
+class StepFailed(Exception):
+    pass
+
+
+class Step(object):
+    def __init__(self, name, function, requires):
+        self.name = name
+        self.function = function
+        self.requires = tuple(requires)
+        self.started = None
+        self.finished = None
+        self.result = None
+        self.error = None
+
+
+class StepGraph(object):
+    """
+    A transition declared as steps with explicit dependencies, run on a thread pool.
+
+    Every step starts as soon as the steps it requires have finished, so independent steps overlap.  When a step
+    fails, anything depending on it is skipped while unrelated steps carry on, and StepFailed is raised at the end.
+    Each step's start and duration are logged along with the critical path, the chain of dependencies that decided
+    how long the whole transition took.
+
+        graph = StepGraph("bedtime")
+        graph.add("display", switch_display)
+        graph.add("sound_device", switch_sound_device)
+        graph.add("audio", start_audio, requires=["sound_device"])
+        graph.run()
+    """
+    def __init__(self, name, max_workers=4):
+        """
+
+        :param name: What the transition is called in the log.
+        :type name: str
+        :param max_workers: Number of steps that can run at once.
+        :type max_workers: int
+        """
+        self.name = name
+        self.max_workers = max_workers
+        self.steps = []
+        """ :type: list[Step]"""
+
+    def add(self, name, function, requires=()):
+        """
+        :type name: str
+        :param function: Called with no arguments to run the step.
+        :type function: callable
+        :param requires: Names of steps that have to finish first, all of them added before this one.
+        :type requires: list[str]
+        """
+        names = set(step.name for step in self.steps)
+
+        if name in names:
+            raise ValueError("Step {0} added twice to {1}".format(name, self.name))
+
+        for required in requires:
+            if required not in names:
+                raise ValueError("Step {0} requires unknown step {1}".format(name, required))
+
+        self.steps.append(Step(name, function, requires))
+        return self
+
+    def run(self):
+        """
+        Run every step, waiting for them all to finish.
+
+        :return: Each step's result by name.
+        :rtype: dict[str, object]
+        :raises StepFailed: If any step failed, after everything that could still run has finished.
+        """
+        start = time.time()
+        pending = list(self.steps)
+        done = set()
+        failed = set()
+        running = {}
+
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+
+        try:
+            while pending or running:
+                for step in list(pending):
+                    if any(required in failed for required in step.requires):
+                        logger.warning("{0}: skipping {1}, a step it requires failed".format(self.name, step.name))
+                        pending.remove(step)
+                        failed.add(step.name)
+                    elif all(required in done for required in step.requires):
+                        pending.remove(step)
+                        step.started = time.time()
+                        running[executor.submit(step.function)] = step
+
+                if not running:
+                    break
+
+                finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+
+                for future in finished:
+                    step = running.pop(future)
+                    step.finished = time.time()
+
+                    if future.exception() is not None:
+                        step.error = future.exception()
+                        logger.error("{0}: {1} failed: {2}".format(self.name, step.name, step.error))
+                        failed.add(step.name)
+                    else:
+                        step.result = future.result()
+                        done.add(step.name)
+        finally:
+            executor.shutdown(wait=False)
+
+        self._log_timings(start)
+
+        if failed:
+            raise StepFailed("{0} failed at {1}".format(self.name, ", ".join(sorted(failed))))
+
+        return dict((step.name, step.result) for step in self.steps)
+
+    def critical_path(self):
+        """
+        :return: Names of the steps that ended last, each one waiting on the one before it.
+        :rtype: list[str]
+        """
+        steps = dict((step.name, step) for step in self.steps if step.finished is not None)
+        path = []
+        step = max(steps.values(), key=lambda s: s.finished) if steps else None
+
+        while step is not None:
+            path.append(step.name)
+            requires = [steps[name] for name in step.requires if name in steps]
+            step = max(requires, key=lambda s: s.finished) if requires else None
+
+        return list(reversed(path))
+
+    def _log_timings(self, start):
+        for step in self.steps:
+            if step.finished is not None:
+                logger.info("{0}: {1} started at +{2:.2f}s and took {3:.2f}s".format(
+                    self.name, step.name, step.started - start, step.finished - step.started))
+
+        logger.info("{0}: finished in {1:.2f}s, critical path {2}".format(
+            self.name, time.time() - start, " -> ".join(self.critical_path())))
@@ -0,0 +1,95 @@
+import math
+
+import numpy
+import pytest
+
+from audio_normalizer.gain_stage import FULL_SCALE, SAMPLE_MAX, GainStage, SmoothedGainStage, dbfs, rms
+
+
+SAMPLE_RATE = 44100
+CHANNELS = 2
+FRAMES = 1024
+TARGET_DBFS = -40.0
+
+
+def tone(level_dbfs, blocks, frequency=440.0):
+    """
+    :return: Stereo blocks of a sine at the given RMS level, continuous across blocks.
+    """
+    amplitude = FULL_SCALE * 10 ** (level_dbfs / 20) * math.sqrt(2)
+    frames = numpy.arange(blocks * FRAMES) / float(SAMPLE_RATE)
+    samples = numpy.repeat(numpy.floor(amplitude * numpy.sin(2 * math.pi * frequency * frames)), CHANNELS)
+    return [bytearray(block.astype(numpy.int16).tobytes()) for block in numpy.split(samples, blocks)]
+
+
+def silence(blocks):
+    return [bytearray(FRAMES * CHANNELS * 2) for _ in range(blocks)]
+
+
+def play(stage, blocks):
+    for block in blocks:
+        stage.process(block)
+
+    return numpy.concatenate([numpy.frombuffer(block, dtype=numpy.int16) for block in blocks])
+
+
+def level(samples):
+    return dbfs(rms(samples.astype(numpy.float64)))
+
+
+def peak_dbfs(samples):
+    return 20 * math.log10(numpy.abs(samples.astype(numpy.float64)).max() / FULL_SCALE)
+
+
+def smoothed_stage():
+    return SmoothedGainStage(TARGET_DBFS, SAMPLE_RATE, CHANNELS)
+
+
+def test_gain_stage_normalises_to_target():
+    block = tone(-10.0, 1)[0]
+    GainStage(TARGET_DBFS).process(block)
+
+    assert level(numpy.frombuffer(block, dtype=numpy.int16)) == pytest.approx(TARGET_DBFS, abs=0.1)
+
+
+def test_gain_stage_leaves_silence_alone():
+    block = silence(1)[0]
+
+    assert GainStage(TARGET_DBFS).process(block) == 0.0
+    assert not any(block)
+
+
+def test_tone_after_silence_is_not_a_burst():
+    stage = smoothed_stage()
+    play(stage, tone(-40.0, 20))
+    gain = stage.last_gain
+    play(stage, silence(200))
+
+    assert stage.last_gain == gain
+
+    output = play(stage, tone(-10.0, 20))
+
+    # A sine peaks 3dB above its RMS level.
+    assert peak_dbfs(output) < TARGET_DBFS + 3.1
+    assert numpy.abs(output).max() < SAMPLE_MAX
+
+
+def test_first_sound_is_not_amplified_from_zero_gain():
+    output = play(smoothed_stage(), silence(50) + tone(-10.0, 5))
+
+    assert peak_dbfs(output) < TARGET_DBFS + 3.1
+
+
+def test_quiet_stream_converges_to_target():
+    stage = smoothed_stage()
+    output = play(stage, tone(-25.0, 100))
+
+    assert level(output[-FRAMES * CHANNELS:]) == pytest.approx(TARGET_DBFS, abs=0.5)
+
+
+def test_gain_is_capped():
+    stage = smoothed_stage()
+    output = play(stage, tone(stage.silence_dbfs + 5, 100))
+
+    assert stage.last_gain == stage.max_gain
+    assert level(output[-FRAMES * CHANNELS:]) == pytest.approx(stage.silence_dbfs + 5 + stage.max_gain, abs=0.5)
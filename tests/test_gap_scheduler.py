@@ -0,0 +1,34 @@
+import pytest
+
+from ir_transmitter.fake_pigpio import SimulatedClock
+from ir_transmitter.gap_scheduler import GapScheduler
+
+
+def test_waits_only_for_what_is_left_of_the_gap():
+    clock = SimulatedClock()
+    scheduler = GapScheduler(default_gap=0.1, profiles={"KEY_MENU": 0.5}, clock=clock)
+
+    assert scheduler.wait() == 0.0
+
+    scheduler.emitted("KEY_MENU")
+    clock.sleep(0.2)
+
+    assert scheduler.wait() == pytest.approx(0.3)
+    assert clock.now == pytest.approx(0.5)
+
+
+def test_gap_can_be_overridden():
+    clock = SimulatedClock()
+    scheduler = GapScheduler(default_gap=0.1, clock=clock)
+    scheduler.emitted("KEY_OK", 4)
+
+    assert scheduler.wait() == 4
+
+
+def test_hold_off_never_shortens_a_gap():
+    clock = SimulatedClock()
+    scheduler = GapScheduler(clock=clock)
+    scheduler.hold_off(10)
+    scheduler.emitted("KEY_OK")
+
+    assert scheduler.wait() == 10
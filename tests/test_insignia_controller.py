@@ -0,0 +1,181 @@
+import os
+
+import pytest
+
+import ir_transmitter.ir_transmitter as ir_transmitter_module
+
+from ir_transmitter.fake_pigpio import FakePi, SimulatedClock
+from ir_transmitter.ir_transmitter import InsigniaController
+from ir_transmitter.transition_planner import DISPLAY_MODE_KEYS
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = SimulatedClock(1000000.0)
+    monkeypatch.setattr(ir_transmitter_module, "time", clock)
+    return clock
+
+
+def make_controller(tmpdir, clock):
+    controller = InsigniaController(os.path.join(ROOT, "insignia_nec.json"), state_file=str(tmpdir.join("state.json")),
+                                    pi=FakePi(clock=clock, record_edges=False, pipelined=True))
+    controller.scheduler.clock = clock
+    return controller
+
+
+@pytest.fixture
+def controller(tmpdir, clock):
+    controller = make_controller(tmpdir, clock)
+    controller.power_state.update(True)
+    return controller
+
+
+@pytest.fixture
+def sent(controller, monkeypatch):
+    """
+    :return: ("hold", key, repeats) or ("sequence", keys) for every held key and sequence sent.
+    """
+    sent = []
+    hold = controller.hold
+    transmit_sequence = controller.transmit_sequence
+
+    def spy_hold(command, repeats, end_delay=None):
+        sent.append(("hold", command, repeats))
+        hold(command, repeats, end_delay)
+
+    def spy_sequence(sequence):
+        sent.append(("sequence", [item if isinstance(item, str) else item[0] for item in sequence]))
+        transmit_sequence(sequence)
+
+    monkeypatch.setattr(controller, "hold", spy_hold)
+    monkeypatch.setattr(controller, "transmit_sequence", spy_sequence)
+    return sent
+
+
+def test_small_volume_change_is_pressed_and_stays_trusted(controller, sent):
+    controller.current_volume = 15
+    controller.trusted = True
+
+    controller.set_volume(18)
+
+    # One press to bring up the volume menu, then one per step.
+    assert sent == [("sequence", ["KEY_VOLUME_UP"] * 4)]
+    assert controller.current_volume == 18
+    assert controller.trusted
+
+
+def test_large_volume_change_is_held_and_not_trusted(controller, sent):
+    controller.current_volume = 0
+    controller.trusted = True
+
+    controller.set_volume(15)
+
+    assert sent == [("hold", "KEY_VOLUME_UP", controller.volume_hold_delay + 15 * controller.volume_repeats_per_step)]
+    assert controller.current_volume == 15
+    assert not controller.trusted
+    assert not controller.state_store.load()["trusted"]
+
+
+def test_recalibrate_holds_past_zero_and_is_trusted(controller, sent):
+    controller.current_volume = 15
+
+    controller.recalibrate()
+
+    expected = 2 * (controller.volume_hold_delay + controller.daytime_volume * controller.volume_repeats_per_step)
+    assert sent == [("hold", "KEY_VOLUME_DOWN", expected)]
+    assert controller.current_volume == 0
+    assert controller.trusted
+    assert controller.state_store.load()["trusted"]
+
+
+def test_hold_timing_is_configurable(controller, sent):
+    controller.update_configuration({"volume_hold_delay": 1, "volume_repeats_per_step": 3})
+    controller.current_volume = 0
+
+    controller.set_volume(10)
+
+    assert sent == [("hold", "KEY_VOLUME_UP", 31)]
+
+
+def test_display_mode_keys_from_an_unknown_mode_are_not_trusted(controller, sent, monkeypatch):
+    monkeypatch.setattr(ir_transmitter_module, "query_power", lambda: True)
+    controller.current_volume = 15
+    controller.save_state(dirty=True)
+    assert controller.restore_state()
+    assert controller.display_mode is None
+    # Few enough volume steps to be pressed, so only the display mode can leave the state untrusted.
+    controller.bedtime_volume = 3
+
+    controller.bedtime()
+
+    assert ("sequence", DISPLAY_MODE_KEYS["CUSTOM"]) in sent
+    assert controller.display_mode is None
+    assert not controller.trusted
+    assert not controller.state_store.load()["trusted"]
+
+
+def test_display_mode_can_be_configured(controller):
+    controller.display_mode = None
+
+    controller.update_configuration({"display_mode": "CUSTOM"})
+
+    assert controller.display_mode == "CUSTOM"
+    assert controller.state_store.load()["display_mode"] == "CUSTOM"
+
+    with pytest.raises(KeyError):
+        controller.update_configuration({"display_mode": "VIVID"})
+
+
+def test_restore_without_a_snapshot(controller):
+    assert not controller.restore_state()
+
+
+def test_restore_trusted_snapshot(controller, tmpdir, clock, monkeypatch):
+    monkeypatch.setattr(ir_transmitter_module, "query_power", lambda: True)
+    controller.current_volume = 15
+    controller.display_mode = "CUSTOM"
+    controller.trusted = True
+    controller.last_calibrated = clock.monotonic() - 100
+    controller.save_state()
+    clock.sleep(60)
+
+    restarted = make_controller(tmpdir, clock)
+
+    assert restarted.restore_state()
+    assert restarted.state == (True, 15, "CUSTOM")
+    assert restarted.trusted
+    assert restarted.last_calibrated == pytest.approx(clock.monotonic() - 160)
+
+
+def test_restore_untrusted_snapshot_forgets_the_display_mode(controller, tmpdir, clock, monkeypatch):
+    monkeypatch.setattr(ir_transmitter_module, "query_power", lambda: True)
+    controller.current_volume = 15
+    controller.display_mode = "CUSTOM"
+    controller.trusted = True
+    controller.save_state(dirty=True)
+
+    restarted = make_controller(tmpdir, clock)
+
+    assert restarted.restore_state()
+    assert restarted.state == (True, 15, None)
+    assert not restarted.trusted
+
+
+def test_restore_stale_snapshot(controller, tmpdir, clock, monkeypatch):
+    monkeypatch.setattr(ir_transmitter_module, "query_power", lambda: True)
+    controller.trusted = True
+    controller.save_state()
+    clock.sleep(controller.state_max_age + 1)
+
+    assert not make_controller(tmpdir, clock).restore_state()
+
+
+def test_restore_snapshot_contradicted_by_tvservice(controller, tmpdir, clock, monkeypatch):
+    monkeypatch.setattr(ir_transmitter_module, "query_power", lambda: False)
+    controller.trusted = True
+    controller.save_state()
+
+    assert not make_controller(tmpdir, clock).restore_state()
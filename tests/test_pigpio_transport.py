@@ -0,0 +1,97 @@
+import pigpio
+import pytest
+
+from ir_transmitter import pigpio_transport
+from ir_transmitter.fake_pigpio import FakePi
+from ir_transmitter.pigpio_transport import PigpioTransport, is_bad_wave_id
+
+
+GPIO = 17
+
+
+def waveform(marks):
+    """
+    :return: A mark and a space of each length, 2 pulses and 4 control blocks per mark.
+    """
+    pulses = []
+
+    for micros in marks:
+        pulses += [pigpio.pulse(1 << GPIO, 0, micros), pigpio.pulse(0, 1 << GPIO, micros)]
+
+    return pulses
+
+
+def pipelined_transport(**kwargs):
+    pi = FakePi(record_edges=False, pipelined=True, **kwargs)
+    return pi, PigpioTransport(pi)
+
+
+def test_create_waves_is_one_round_trip():
+    pi, transport = pipelined_transport()
+    waveforms = [waveform([100]), waveform([200, 300]), waveform([400, 500, 600])]
+
+    assert transport.pipelined
+    assert transport.create_waves(waveforms) == [(0, 4), (1, 8), (2, 12)]
+    assert transport.round_trips == 1
+    assert pi.sl.s.writes == 1
+    assert [command[0] for command in pi.sl.s.commands] == [pigpio_transport.WVNEW, pigpio_transport.WVAG,
+                                                            pigpio_transport.WVSC, pigpio_transport.WVCRE] * 3
+    assert [pigpio_transport.pack_pulses(pi.waves[wave_id]) for wave_id in range(3)] == \
+        [pigpio_transport.pack_pulses(pulses) for pulses in waveforms]
+
+
+def test_replies_are_parsed_from_partial_reads(monkeypatch):
+    pi, transport = pipelined_transport()
+    socket = pi.sl.s
+    recv_into = socket.recv_into
+    monkeypatch.setattr(socket, "recv_into", lambda buffer: recv_into(buffer[:5]))
+    wave_id = transport.create_waves([waveform([100])])[0][0]
+
+    results = transport.pipeline([(pigpio_transport.WVDEL, 99, 0, b""),
+                                  (pigpio_transport.WVBSY, 0, 0, b""),
+                                  (pigpio_transport.WVDEL, wave_id, 0, b"")])
+
+    assert results == [pigpio.PI_BAD_WAVE_ID, 0, 0]
+    assert pi.waves == {}
+    assert transport.round_trips == 2
+
+
+def test_delete_waves_is_one_round_trip():
+    pi, transport = pipelined_transport()
+    waves = transport.create_waves([waveform([100]), waveform([200]), waveform([300])])
+
+    transport.delete_waves([wave_id for wave_id, _ in waves])
+
+    assert pi.waves == {}
+    assert transport.round_trips == 2
+    assert pi.sl.s.writes == 2
+
+
+def test_create_waves_failing_partway_deletes_the_rest():
+    # Room for the first and last waveforms together, but not for the middle one as well as the first.
+    pi, transport = pipelined_transport(max_pulses=5)
+    socket = pi.sl.s
+
+    with pytest.raises(pigpio.error) as raised:
+        transport.create_waves([waveform([100]), waveform([200, 300]), waveform([400])])
+
+    assert raised.value.value == pigpio.error_text(pigpio.PI_TOO_MANY_PULSES)
+    creates = [result for (cmd, _, _, _), result in zip(socket.commands, socket.results)
+               if cmd == pigpio_transport.WVCRE]
+    # pigpiod carried on past the middle wave's failure, so the last wave was created and had to be deleted too.
+    assert creates == [0, pigpio.PI_TOO_MANY_PULSES, 1]
+    assert [p1 for cmd, p1, _, _ in socket.commands if cmd == pigpio_transport.WVDEL] == [0, 1]
+    assert pi.waves == {}
+    assert transport.round_trips == 2
+
+
+def test_delete_waves_failing_partway_deletes_the_rest():
+    pi, transport = pipelined_transport()
+    first, second = [wave_id for wave_id, _ in transport.create_waves([waveform([100]), waveform([200])])]
+
+    with pytest.raises(pigpio.error) as raised:
+        transport.delete_waves([first, 99, second])
+
+    assert is_bad_wave_id(raised.value)
+    assert pi.waves == {}
+    assert transport.round_trips == 2
@@ -0,0 +1,79 @@
+import threading
+
+import pytest
+
+from audio_normalizer.ring_buffer import BLOCK, DROP_OLDEST, PcmRingBuffer
+
+
+# 8 frames of 2 bytes.
+RATE = 8
+FRAME_BYTES = 2
+
+
+def ring_buffer(overflow=DROP_OLDEST):
+    return PcmRingBuffer(1.0, RATE, FRAME_BYTES, overflow)
+
+
+def read(buffer, length):
+    out = bytearray(length)
+    return buffer.read_into(out), bytes(out)
+
+
+def test_reads_what_was_written_across_the_end():
+    buffer = ring_buffer()
+    buffer.write(b"abcdefghij")
+    read(buffer, 8)
+    buffer.write(b"klmnopqr")
+
+    assert buffer.latency == 5 / 8.0
+    assert read(buffer, 10) == (10, b"ijklmnopqr")
+
+
+def test_underrun_is_padded_with_silence():
+    buffer = ring_buffer()
+    buffer.write(b"ab")
+
+    assert read(buffer, 6) == (2, b"ab\0\0\0\0")
+    assert buffer.underruns == 1
+
+
+def test_overflow_drops_the_oldest():
+    buffer = ring_buffer()
+    buffer.write(b"abcdefghijkl")
+    buffer.write(b"mnopqrst")
+
+    assert buffer.dropped_bytes == 4
+    assert read(buffer, 16) == (16, b"efghijklmnopqrst")
+
+
+def test_writes_have_to_be_whole_frames():
+    with pytest.raises(ValueError):
+        ring_buffer().write(b"abc")
+
+
+def test_blocking_write_waits_for_room():
+    buffer = ring_buffer(BLOCK)
+    buffer.write(b"abcdefghijklmnop")
+    writer = threading.Thread(target=buffer.write, args=(b"qrst",))
+    writer.start()
+    writer.join(0.05)
+
+    assert writer.is_alive()
+    assert read(buffer, 4) == (4, b"abcd")
+
+    writer.join(5)
+
+    assert not writer.is_alive()
+    assert read(buffer, 16) == (16, b"efghijklmnopqrst")
+
+
+def test_close_releases_a_blocked_writer():
+    buffer = ring_buffer(BLOCK)
+    buffer.write(b"abcdefghijklmnop")
+    written = []
+    writer = threading.Thread(target=lambda: written.append(buffer.write(b"qrst")))
+    writer.start()
+    buffer.close()
+    writer.join(5)
+
+    assert written == [0]
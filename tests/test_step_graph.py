@@ -0,0 +1,63 @@
+import threading
+import time
+
+import pytest
+
+from server.step_graph import StepFailed, StepGraph
+
+
+def test_independent_steps_overlap():
+    started = threading.Event()
+    graph = StepGraph("test")
+    # a can only finish while b is running alongside it.
+    graph.add("a", lambda: started.wait(5))
+    graph.add("b", started.set)
+
+    assert graph.run() == {"a": True, "b": None}
+
+
+def test_steps_wait_for_what_they_require():
+    finished = []
+    graph = StepGraph("test")
+    graph.add("a", lambda: time.sleep(0.05) or finished.append("a"))
+    graph.add("b", lambda: finished.append("b"))
+    graph.add("c", lambda: list(finished), requires=["a", "b"])
+
+    assert sorted(graph.run()["c"]) == ["a", "b"]
+
+
+def test_failed_step_skips_what_requires_it():
+    ran = []
+    graph = StepGraph("test")
+    graph.add("a", lambda: 1 // 0)
+    graph.add("b", lambda: ran.append("b"), requires=["a"])
+    graph.add("c", lambda: ran.append("c"))
+
+    with pytest.raises(StepFailed) as raised:
+        graph.run()
+
+    assert str(raised.value) == "test failed at a, b"
+    assert ran == ["c"]
+    assert isinstance(graph.steps[0].error, ZeroDivisionError)
+
+
+def test_critical_path_follows_the_last_requirement_to_finish():
+    graph = StepGraph("test")
+    graph.add("slow", lambda: time.sleep(0.1))
+    graph.add("fast", lambda: None)
+    graph.add("after", lambda: None, requires=["slow", "fast"])
+    graph.add("other", lambda: None)
+    graph.run()
+
+    assert graph.critical_path() == ["slow", "after"]
+
+
+def test_steps_have_to_be_added_after_what_they_require():
+    graph = StepGraph("test")
+    graph.add("a", lambda: None)
+
+    with pytest.raises(ValueError):
+        graph.add("a", lambda: None)
+
+    with pytest.raises(ValueError):
+        graph.add("b", lambda: None, requires=["c"])
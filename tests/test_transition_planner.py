@@ -0,0 +1,37 @@
+from ir_transmitter.transition_planner import (DISPLAY_MODE, POWER_ON, RECALIBRATE, VOLUME, PlanStep, TransitionPlanner,
+                                               TVState)
+
+
+def test_nothing_to_do():
+    state = TVState(True, 15, "CUSTOM")
+
+    assert TransitionPlanner().plan(state, state, last_calibrated=0.0) == []
+
+
+def test_volume_moves_straight_to_target_when_trusted():
+    plan = TransitionPlanner().plan(TVState(True, 25, "STANDARD"), TVState(True, 15, "CUSTOM"), last_calibrated=0.0,
+                                    now=60.0)
+
+    assert plan == [PlanStep(DISPLAY_MODE, "CUSTOM"), PlanStep(VOLUME, 15)]
+
+
+def test_recalibrates_when_untrusted():
+    plan = TransitionPlanner().plan(TVState(False, 25, "STANDARD"), TVState(True, 15, "STANDARD"), trusted=False,
+                                    last_calibrated=0.0)
+
+    assert plan == [PlanStep(POWER_ON, True), PlanStep(RECALIBRATE, 0), PlanStep(VOLUME, 15)]
+
+
+def test_recalibrates_after_the_interval():
+    planner = TransitionPlanner(recalibrate_interval=100)
+    state = TVState(True, 0, "STANDARD")
+
+    assert planner.plan(state, state, last_calibrated=0.0, now=99.0) == []
+    assert planner.plan(state, state, last_calibrated=0.0, now=100.0) == [PlanStep(RECALIBRATE, 0)]
+    assert TransitionPlanner(None).plan(state, state, last_calibrated=0.0, now=1e9) == []
+
+
+def test_unknown_display_mode_is_always_set():
+    plan = TransitionPlanner().plan(TVState(True, 15, None), TVState(True, 15, "CUSTOM"), last_calibrated=0.0)
+
+    assert plan == [PlanStep(DISPLAY_MODE, "CUSTOM")]
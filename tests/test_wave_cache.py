@@ -0,0 +1,89 @@
+import json
+
+import pytest
+
+import ir_transmitter.ir_transmitter as ir_transmitter_module
+
+from ir_transmitter.fake_pigpio import FakePi, SimulatedClock
+from ir_transmitter.ir_transmitter import IRTransmitter
+from ir_transmitter.wave_cache import WaveCache
+
+
+# No whole number of carrier cycles at 36.7kHz lasts a whole number of microseconds, so every mark is expanded
+# into its own wave like an untidied learned code's.
+FREQUENCY = 36.7
+GPIO = 17
+
+
+def learned_code(key):
+    """
+    A code where every mark and space is a different length from every other code's, around 7.5k pulses worth of
+    distinct waves: each fits in FakePi's wave pool on its own but no two fit at once.
+    """
+    code = []
+
+    for i in range(34):
+        code += [1000 + 120 * i + 40 * key, 400 + 21 * i + 7 * key]
+
+    return code
+
+
+def learned_codes():
+    return dict(("KEY_{0}".format(key), learned_code(key)) for key in range(3))
+
+
+def transmitter(tmpdir, monkeypatch, clock):
+    code_file = tmpdir.join("learned.json")
+    code_file.write(json.dumps(learned_codes()))
+    monkeypatch.setattr(ir_transmitter_module, "time", clock)
+
+    pi = FakePi(clock=clock, record_edges=False)
+    ir = IRTransmitter(str(code_file), frequency=FREQUENCY, pi=pi)
+    ir.scheduler.clock = clock
+    return ir, pi
+
+
+def cache_keys(cache, steps):
+    return set(item[1] for _, code, _ in steps for item in cache._plan(code))
+
+
+def test_sequence_splits_when_waves_exceed_the_pool():
+    cache = WaveCache(FakePi(record_edges=False), GPIO, FREQUENCY)
+    steps = [(command, code, 100000) for command, code in sorted(learned_codes().items())]
+
+    assert not cache._fits(cache_keys(cache, steps[:2]))
+
+    groups = cache.sequence(steps)
+
+    assert groups == [[step] for step in steps]
+
+    for group in groups:
+        assert cache._fits(cache_keys(cache, group))
+        cache.sequence_chain(group)
+
+
+def test_transmit_sequence_larger_than_the_pool_cold(tmpdir, monkeypatch):
+    clock = SimulatedClock()
+    ir, pi = transmitter(tmpdir, monkeypatch, clock)
+    codes = learned_codes()
+
+    ir.transmit_sequence([("KEY_0", 100), ("KEY_1", 100), ("KEY_2", 100)])
+
+    assert pi.chains_sent == 3
+    # Marks are rounded to whole carrier cycles.
+    assert pi.micros_sent == pytest.approx(sum(sum(code) for code in codes.values()) + 2 * 100000, rel=1e-3)
+    assert ir.keys_sent == 3
+
+
+def test_transmit_sequence_larger_than_the_pool_warm(tmpdir, monkeypatch):
+    clock = SimulatedClock()
+    ir, pi = transmitter(tmpdir, monkeypatch, clock)
+
+    for command in ("KEY_2", "KEY_1", "KEY_0"):
+        ir.transmit(command)
+
+    chains_sent = pi.chains_sent
+    ir.transmit_sequence(["KEY_0", "KEY_1", "KEY_2", "KEY_0"])
+
+    assert pi.chains_sent - chains_sent == 4
+    assert ir.keys_sent == 7